@@ -5,20 +5,52 @@ from routes.auth import auth_bp
 from routes.ticket import ticket_bp
 from routes.profile import profile_bp
 from routes.sales import sales_bp
+from routes.media import media_bp, protect_static_uploads
+from routes.uploads import uploads_bp
+from routes.debug import debug_bp
+from routes.metrics import metrics_bp
+import routes.realtime  # noqa: F401 — обработчики Socket.IO
 from extensions import socketio
+from commands import register_commands
+from services.thumbnails import thumbnail_url, avatar_url
+from services.profiler import profiler
+from services import metrics
+from services.ticket_views import views
 
 
-def create_app():
+def create_app(config_overrides=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    # serve.py передаёт режим воркера и его долю пула: Config к этому моменту уже прочитан из окружения
+    app.config.update(config_overrides or {})
     if not app.config.get("DIGISELLER_SELLER_ID") or not app.config.get("DIGISELLER_API_KEY"):
         raise RuntimeError("DIGISELLER_SELLER_ID или DIGISELLER_API_KEY не заданы в окружении")
 
+    if not (app.config.get('SQLALCHEMY_DATABASE_URI') or '').startswith('sqlite'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'pool_recycle': app.config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': True,
+        })
+
     # Инициализация расширений
     db.init_app(app)
     login_manager.init_app(app)
     migrate.init_app(app, db)
-    socketio.init_app(app)
+    # Без SOCKETIO_MESSAGE_QUEUE события живут внутри процесса; с очередью
+    # (redis://, amqp:// и любой URL kombu) — доходят до клиентов всех воркеров
+    socketio.init_app(
+        app,
+        message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+        channel=app.config.get('SOCKETIO_CHANNEL'),
+        async_mode=app.config.get('SOCKETIO_ASYNC_MODE'),
+    )
+    cache.init_app(app)
+    profiler.init_app(app)
+    metrics.init_app(app)
+    views.init_app(app)
     
     login_manager.login_view = 'auth.login'
     
@@ -28,11 +60,22 @@ def create_app():
     app.register_blueprint(ticket_bp)
     app.register_blueprint(profile_bp)
     app.register_blueprint(sales_bp)
+    app.register_blueprint(media_bp)
+    app.register_blueprint(uploads_bp)
+    app.register_blueprint(debug_bp)
+    app.register_blueprint(metrics_bp)
+    protect_static_uploads(app)
+
+    app.add_template_global(thumbnail_url)
+    app.add_template_global(avatar_url)
+
+    register_commands(app)
 
     return app
 
 
 
 if __name__ == "__main__":
+    # Сервер для разработки; в бою — python serve.py
     app = create_app()
-    socketio.run(app,host="0.0.0.0", port=8080, debug=True)
+    socketio.run(app,host="0.0.0.0", port=8080, debug=True, allow_unsafe_werkzeug=True)
@@ -0,0 +1,255 @@
+"""
+Синтетические данные для бенчмарков (benchmarks/suite.py):
+
+    DATABASE_URL=sqlite:////tmp/bench.sqlite python benchmarks/datagen.py
+    DATABASE_URL=postgresql://bench@localhost/bench python benchmarks/datagen.py --scale 0.1
+
+По умолчанию 100k тикетов, 1M сообщений и 2M заказов. Покупатели и товары
+распределены по Ципфу: у нескольких email сотни заказов, у большинства один-два,
+как в жизни. Генерация детерминирована (--seed). База должна быть пустой:
+таблицы создаются через db.create_all(). После вставки строятся поисковый
+индекс, свёртки продаж и счётчики тикетов, как после обычного развёртывания.
+
+Вход в приложение: bench / bench (администратор).
+"""
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench"
+
+WORDS = (
+    "ключ не пришёл оплата зависла возврат активация регион аккаунт подписка код ошибка "
+    "steam xbox playstation gift card refund payment key region activation wallet balance "
+    "заказ товар поддержка продавец покупатель письмо почта чек карта перевод"
+).split()
+METHODS = ("BankCard", "QIWI", "WebMoney", "YooMoney", "SBP", "Crypto")
+AGGREGATORS = ("plati", "ggsel", "digiseller", "wmcentre", "")
+CURRENCIES = ("RUB", "USD", "EUR")
+SOURCES = ("talkme", "digiseller")
+STATUSES = (
+    # name, label, category, color, group, доля тикетов
+    ("open", "Открыт", "reason", "warning", "payment", 0.06),
+    ("admin_needed", "Нужен Админ", "process", "danger", "payment", 0.03),
+    ("waiting", "Ждём ответа", "process", "info", "key", 0.04),
+    ("closed", "Закрыт", "final", "success", None, 0.87),
+)
+
+
+def bench_app():
+    """Приложение для бенчмарков: Digiseller не нужен (fetch_sales_v2 идёт в поддельный API)"""
+    if not os.environ.get("DATABASE_URL"):
+        raise SystemExit("Укажите DATABASE_URL отдельной базы для бенчмарков")
+    os.environ.setdefault("DIGISELLER_SELLER_ID", "bench")
+    os.environ.setdefault("DIGISELLER_API_KEY", "bench")
+    from app import create_app
+    return create_app()
+
+
+class Zipf:
+    """Выбор из n элементов с весами 1/rank^s за O(log n)"""
+
+    def __init__(self, rng, n, s=1.1):
+        self.rng = rng
+        self.cum = list(itertools.accumulate(1 / (rank ** s) for rank in range(1, n + 1)))
+
+    def __call__(self):
+        return bisect.bisect_left(self.cum, self.rng.random() * self.cum[-1])
+
+
+def chunked(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert(conn, table, rows, batch_size, label):
+    started = time.perf_counter()
+    total = 0
+    for batch in chunked(rows, batch_size):
+        conn.execute(table.insert(), batch)
+        total += len(batch)
+    print(f"  {label}: {total} за {time.perf_counter() - started:.1f} с")
+    return total
+
+
+def generate(app, tickets, messages, sales, seed=42, batch_size=10000, days=730):
+    from extensions import db
+    from models.sales import Sale
+    from models.ticket import Ticket, TicketMessage, Status
+    from models.ticket_view import TicketView
+    from models.user import User
+
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(days=days)
+    span = int((now - start).total_seconds())
+
+    def moment():
+        # Больше свежих данных, чем старых
+        return start + timedelta(seconds=int(span * rng.random() ** 0.6))
+
+    customers = max(sales // 4, 10)
+    pick_customer = Zipf(rng, customers, 1.05)
+    products = [(100000 + i, f"Товар {i} ({rng.choice(WORDS)})") for i in range(500)]
+    pick_product = Zipf(rng, len(products), 1.2)
+
+    with app.app_context():
+        engine = db.engine
+        if engine.dialect.name == "postgresql":
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        db.create_all()
+        if db.session.query(Ticket.id).first() or db.session.query(Sale.id).first():
+            raise SystemExit("База не пустая: datagen заполняет только новую базу")
+
+        agents = [User(username=BENCH_USER, password=generate_password_hash(BENCH_PASSWORD),
+                       display_name="Bench", is_admin=True)]
+        agents += [User(username=f"agent{i}", password=generate_password_hash(BENCH_PASSWORD),
+                        display_name=f"Агент {i}") for i in range(1, 20)]
+        db.session.add_all(agents)
+        status_rows = [Status(name=n, label=l, category=c, color=col, group=g) for n, l, c, col, g, _ in STATUSES]
+        db.session.add_all(status_rows)
+        db.session.commit()
+        agent_ids = [a.id for a in agents]
+        status_ids = [s.id for s in status_rows]
+        status_cum = list(itertools.accumulate(share for *_, share in STATUSES))
+        closed_id = status_rows[-1].id
+
+        print(f"Генерация: {sales} заказов, {tickets} тикетов, {messages} сообщений ({engine.dialect.name})")
+        with engine.begin() as conn:
+            def sale_rows():
+                for i in range(sales):
+                    paid = moment()
+                    product_id, product_name = products[pick_product()]
+                    amount = round(rng.lognormvariate(6, 1), 2)
+                    yield dict(
+                        id=i + 1,
+                        invoice_id=str(10_000_000 + i),
+                        product_id=product_id,
+                        product_name=product_name,
+                        product_entry=f"KEY-{rng.getrandbits(64):016X}",
+                        date_put=paid - timedelta(seconds=rng.randint(5, 600)),
+                        date_pay=paid,
+                        email=f"buyer{pick_customer()}@example.com",
+                        amount_in=amount,
+                        amount_out=round(amount * 0.9, 2),
+                        amount_currency=rng.choices(CURRENCIES, weights=(85, 10, 5))[0],
+                        method_pay=rng.choice(METHODS),
+                        aggregator_pay=rng.choice(AGGREGATORS),
+                        ip=f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}",
+                        partner_id=0,
+                        lang=rng.choice(("ru-RU", "en-US")),
+                        created_at=paid,
+                    )
+            insert(conn, Sale.__table__, sale_rows(), batch_size, "заказы")
+
+            ticket_created = {}
+
+            def ticket_rows():
+                for i in range(tickets):
+                    sale_no = rng.randrange(sales) if sales and rng.random() < 0.8 else None
+                    created = moment()
+                    status_id = status_ids[bisect.bisect_left(status_cum, rng.random() * status_cum[-1])]
+                    closed = (created + timedelta(seconds=int(rng.lognormvariate(10, 1.3)))
+                              if status_id == closed_id else None)
+                    ticket_created[i + 1] = created
+                    yield dict(
+                        id=i + 1,
+                        sales_id=sale_no + 1 if sale_no is not None else None,
+                        order_number=str(10_000_000 + sale_no) if sale_no is not None else f"EXT-{i}",
+                        customer_email=f"buyer{pick_customer()}@example.com",
+                        product=products[pick_product()][1][:100],
+                        source=rng.choice(SOURCES),
+                        reason=" ".join(rng.choices(WORDS, k=rng.randint(5, 30))),
+                        user_id=rng.choice(agent_ids),
+                        status_id=status_id,
+                        created_at=created,
+                        updated_at=closed or created,
+                        closed_at=closed,
+                    )
+            insert(conn, Ticket.__table__, ticket_rows(), batch_size, "тикеты")
+
+            # Сообщения тоже с перекосом: у части тикетов длинная переписка
+            pick_ticket = Zipf(rng, tickets, 0.6)
+            ticket_order = list(range(1, tickets + 1))
+            rng.shuffle(ticket_order)
+
+            def message_rows():
+                for i in range(messages):
+                    ticket_id = ticket_order[pick_ticket()]
+                    yield dict(
+                        id=i + 1,
+                        ticket_id=ticket_id,
+                        user_id=rng.choice(agent_ids),
+                        content=" ".join(rng.choices(WORDS, k=rng.randint(3, 40))),
+                        created_at=ticket_created[ticket_id] + timedelta(seconds=rng.randint(60, 86400 * 3)),
+                    )
+            insert(conn, TicketMessage.__table__, message_rows(), batch_size, "сообщения")
+
+            view_rows = (
+                dict(ticket_id=ticket_id, user_id=agent_ids[0], last_viewed_at=ticket_created[ticket_id])
+                for ticket_id in range(1, tickets + 1) if rng.random() < 0.5
+            )
+            insert(conn, TicketView.__table__, view_rows, batch_size, "просмотры")
+
+        if engine.dialect.name == "postgresql":
+            # Явные id сбили последовательности — продолжаем их после максимума
+            with engine.begin() as conn:
+                for table in ("sales", "ticket", "ticket_message"):
+                    conn.execute(text(
+                        f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT coalesce(max(id), 1) FROM {table}))"
+                    ))
+                conn.execute(text("ANALYZE"))
+
+        from services import sales_rollup, search, ticket_metrics
+        for label, build in (
+            ("поисковый индекс", lambda: search.rebuild_index(batch_size=5000)),
+            ("свёртки продаж", lambda: sales_rollup.rebuild(batch_size=batch_size)),
+            ("счётчики тикетов", lambda: ticket_metrics.repair(batch_size=batch_size)),
+        ):
+            started = time.perf_counter()
+            build()
+            print(f"  {label}: {time.perf_counter() - started:.1f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические данные для бенчмарков")
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--sales", type=int, default=2_000_000)
+    parser.add_argument("--scale", type=float, default=1.0, help="Множитель объёмов (0.01 — быстрый прогон)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    generate(
+        bench_app(),
+        tickets=max(int(args.tickets * args.scale), 1),
+        messages=int(args.messages * args.scale),
+        sales=int(args.sales * args.scale),
+        seed=args.seed,
+        batch_size=args.batch_size,
+    )
+    print(f"Готово за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
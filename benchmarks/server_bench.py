@@ -0,0 +1,198 @@
+"""
+Нагрузочный замер запущенного сервера (python serve.py ...):
+
+    python benchmarks/server_bench.py --url http://127.0.0.1:8080 -u admin -p secret --ticket-id 1
+
+1. HTTP: --concurrency потоков --duration секунд запрашивают --path,
+   считаем запросы в секунду и перцентили задержки.
+2. Socket.IO: открываем websocket-клиентов ступенями по --ws-step до
+   --ws-max, все в комнате дашборда. После каждой ступени отправляем
+   сообщение в тикет --ticket-id и ждём, пока ticket_updated дойдёт до всех.
+   Ёмкость — последняя ступень, где подключились все и рассылка уложилась в --ws-timeout.
+
+Нужны пакеты requests, python-socketio[client] и websocket-client.
+"""
+import argparse
+import re
+import statistics
+import threading
+import time
+
+import requests
+import socketio
+
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def login(url, username, password):
+    session = requests.Session()
+    page = session.get(f"{url}/auth/login")
+    match = CSRF_RE.search(page.text)
+    data = {'username': username, 'password': password}
+    if match:
+        data['csrf_token'] = match.group(1)
+    response = session.post(f"{url}/auth/login", data=data, allow_redirects=False)
+    if response.status_code != 302:
+        raise SystemExit("Не удалось войти: проверьте логин и пароль")
+    return session
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def bench_http(url, cookies, path, concurrency, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        session = requests.Session()
+        session.cookies.update(cookies)
+        local, failed = [], 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                ok = session.get(f"{url}{path}", allow_redirects=False).status_code < 400
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local.append(time.perf_counter() - started)
+            else:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'mean_ms': (statistics.mean(latencies) * 1000) if latencies else 0.0,
+    }
+
+
+class DashboardClient:
+    """Websocket-клиент в комнате дашборда; считает полученные ticket_updated"""
+
+    def __init__(self, url, cookie_header):
+        self.received = {}
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('ticket_updated', self._on_update)
+        self.url = url
+        self.cookie_header = cookie_header
+
+    def _on_update(self, data):
+        self.received[data.get('message_id')] = time.perf_counter()
+
+    def connect(self, timeout):
+        self.sio.connect(self.url, headers={'Cookie': self.cookie_header},
+                         transports=['websocket'], wait_timeout=timeout)
+        self.sio.emit('join', {'dashboard': True})
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def post_message(session, url, ticket_id):
+    page = session.get(f"{url}/ticket/{ticket_id}")
+    match = CSRF_RE.search(page.text)
+    data = {'content': f"benchmark {time.time()}"}
+    if match:
+        data['csrf_token'] = match.group(1)
+    started = time.perf_counter()
+    response = session.post(f"{url}/ticket/{ticket_id}", data=data, headers={'Accept': 'application/json'})
+    response.raise_for_status()
+    if 'json' not in response.headers.get('Content-Type', ''):
+        raise SystemExit(f"Сообщение в тикет {ticket_id} не принято: тикет закрыт или форма не прошла проверку")
+    return response.json()['message_id'], started
+
+
+def bench_websockets(url, session, ticket_id, step, maximum, timeout):
+    cookie_header = "; ".join(f"{k}={v}" for k, v in session.cookies.items())
+    clients, results = [], []
+    try:
+        while len(clients) < maximum:
+            failed = 0
+            for _ in range(step):
+                client = DashboardClient(url, cookie_header)
+                try:
+                    client.connect(timeout)
+                    clients.append(client)
+                except Exception:
+                    failed += 1
+            time.sleep(0.5)
+
+            message_id, started = post_message(session, url, ticket_id)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline and any(message_id not in c.received for c in clients):
+                time.sleep(0.05)
+            delays = [c.received[message_id] - started for c in clients if message_id in c.received]
+            row = {
+                'clients': len(clients),
+                'connect_failures': failed,
+                'delivered': len(delays),
+                'fanout_p50_ms': percentile(delays, 50) * 1000,
+                'fanout_max_ms': (max(delays) * 1000) if delays else 0.0,
+            }
+            results.append(row)
+            print(f"  {row['clients']:>5} клиентов: доставлено {row['delivered']}, "
+                  f"p50 {row['fanout_p50_ms']:.0f} мс, max {row['fanout_max_ms']:.0f} мс, "
+                  f"ошибок подключения {failed}")
+            if failed or len(delays) < len(clients):
+                break
+    finally:
+        for client in clients:
+            client.close()
+
+    capacity = max((r['clients'] for r in results
+                    if not r['connect_failures'] and r['delivered'] == r['clients']), default=0)
+    return capacity, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замер HTTP и Socket.IO запущенного сервера")
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('-u', '--username', required=True)
+    parser.add_argument('-p', '--password', required=True)
+    parser.add_argument('--path', default='/dashboard')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--ticket-id', type=int, help="тикет для замера рассылки; без него Socket.IO не замеряем")
+    parser.add_argument('--ws-step', type=int, default=100)
+    parser.add_argument('--ws-max', type=int, default=1000)
+    parser.add_argument('--ws-timeout', type=float, default=5)
+    args = parser.parse_args()
+    url = args.url.rstrip('/')
+
+    session = login(url, args.username, args.password)
+
+    print(f"HTTP GET {args.path}: {args.concurrency} потоков, {args.duration:.0f} с")
+    http = bench_http(url, session.cookies, args.path, args.concurrency, args.duration)
+    print(f"  {http['rps']:.1f} req/s, p50 {http['p50_ms']:.0f} мс, p95 {http['p95_ms']:.0f} мс, "
+          f"ошибок {http['errors']}")
+
+    if args.ticket_id:
+        print(f"Socket.IO: ступени по {args.ws_step} до {args.ws_max} клиентов")
+        capacity, _ = bench_websockets(url, session, args.ticket_id, args.ws_step, args.ws_max, args.ws_timeout)
+        print(f"  Ёмкость: {capacity} одновременных websocket-клиентов")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""
+Замеры горячих путей приложения на данных benchmarks/datagen.py:
+
+    DATABASE_URL=sqlite:////tmp/bench.sqlite python benchmarks/suite.py --save sqlite
+    DATABASE_URL=sqlite:////tmp/bench.sqlite python benchmarks/suite.py --compare sqlite
+
+Запросы идут через тестовый клиент Flask в том же процессе: в замер входят
+маршрут, шаблоны и база, но не сеть и не WSGI-сервер (для них —
+benchmarks/server_bench.py). Для каждого сценария: перцентили задержки и
+число SQL-запросов на вызов.
+
+fetch_sales_v2 работает с поддельным API Digiseller: страницы новых заказов
+(и часть повторов) генерируются на лету, а после замера вставленные заказы
+удаляются и вычитаются из свёрток, так что база остаётся прежней.
+
+Результаты сохраняются в benchmarks/baselines/<имя>.json (--save).
+--compare сверяет прогон с сохранённым: рост p95 больше --tolerance или
+больше SQL-запросов на вызов — регрессия, код выхода 1.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, func, select
+
+from benchmarks.datagen import BENCH_PASSWORD, BENCH_USER, WORDS, bench_app
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class FakeResponse:
+    status_code = 200
+    text = ""
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeDigiseller:
+    """Вместо requests.Session: apilogin и seller-sells/v2 с синтетическими страницами"""
+
+    def __init__(self, rng, pages, rows, duplicates=0.1, first_invoice=90_000_000):
+        self.lock = threading.Lock()
+        self.rng = rng
+        self.pages = pages
+        self.rows = rows
+        self.duplicates = duplicates
+        self.next_invoice = first_invoice
+        self.issued = []
+
+    def _row(self):
+        if self.issued and self.rng.random() < self.duplicates:
+            invoice = self.rng.choice(self.issued)
+        else:
+            invoice = self.next_invoice
+            self.next_invoice += 1
+            self.issued.append(invoice)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        amount = round(self.rng.lognormvariate(6, 1), 2)
+        return {
+            "invoice_id": invoice, "product_id": 100000 + self.rng.randrange(500),
+            "product_name": "Товар из API", "product_entry": f"KEY-{self.rng.getrandbits(64):016X}",
+            "date_put": now, "date_pay": now, "email": f"buyer{self.rng.randrange(1000)}@example.com",
+            "amount_in": amount, "amount_out": round(amount * 0.9, 2), "amount_currency": "RUB",
+            "method_pay": "BankCard", "aggregator": "plati", "ip": "10.0.0.1", "partner_id": 0, "lang": "ru-RU",
+        }
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        if "/apilogin" in url:
+            return FakeResponse({"retval": 0, "token": "bench"})
+        # Страницы запрашиваются из нескольких потоков
+        with self.lock:
+            rows = [self._row() for _ in range(self.rows)]
+        return FakeResponse({"retval": 0, "pages": self.pages, "rows": rows})
+
+
+def build_scenarios(app, client, seed):
+    """
+    Сценарии: имя -> функция одного вызова (возвращает HTTP-код). У каждого
+    сценария свой генератор от (seed, имя): выборка не зависит от --only.
+    """
+    rng = random.Random(f"{seed}:sample")
+    from extensions import db
+    from models.sales import Sale
+    from models.ticket import Ticket, TicketMessage
+
+    with app.app_context():
+        max_ticket = db.session.execute(select(func.max(Ticket.id))).scalar() or 1
+        busy = db.session.execute(
+            select(TicketMessage.ticket_id).group_by(TicketMessage.ticket_id)
+            .order_by(func.count().desc()).limit(20)
+        ).scalars().all()
+        max_sale = db.session.execute(select(func.max(Sale.id))).scalar() or 1
+        sales_sample = db.session.execute(
+            select(Sale.invoice_id, Sale.email, Sale.product_name)
+            .where(Sale.id.in_([rng.randint(1, max_sale) for _ in range(50)]))
+        ).all()
+        orders = db.session.execute(
+            select(Ticket.order_number).where(Ticket.id.in_([rng.randint(1, max_ticket) for _ in range(50)]))
+        ).scalars().all()
+
+    def pick(rng, values, fallback):
+        return rng.choice(values) if values else fallback
+
+    def view_ticket(rng=random.Random(f"{seed}:view_ticket")):
+        # Половина — тикеты с самой длинной перепиской, половина — случайные
+        ticket_id = pick(rng, busy, 1) if rng.random() < 0.5 else rng.randint(1, max_ticket)
+        return client.get(f"/ticket/{ticket_id}").status_code
+
+    def search_tickets(rng=random.Random(f"{seed}:search_tickets")):
+        query = pick(rng, orders, "1") if rng.random() < 0.3 else " ".join(rng.sample(WORDS, 2))
+        return client.get("/tickets/search", query_string={"q": query}).status_code
+
+    def search_sales(rng=random.Random(f"{seed}:search_sales")):
+        row = pick(rng, sales_sample, None)
+        query = rng.choice((row.invoice_id, row.email, row.product_name[:12])) if row else "buyer1@example.com"
+        return client.get("/sales/search", query_string={"q": query}).status_code
+
+    def check_order(rng=random.Random(f"{seed}:check_order")):
+        row = pick(rng, sales_sample, None)
+        return client.post("/check_order", json={"order_number": row.invoice_id if row else "0"}).status_code
+
+    return {
+        "dashboard": lambda: client.get("/dashboard").status_code,
+        "view_ticket": view_ticket,
+        "search_tickets": search_tickets,
+        "search_sales": search_sales,
+        "check_order": check_order,
+    }
+
+
+def run_scenario(call, counter, iterations, warmup):
+    for _ in range(warmup):
+        call()
+    latencies, queries, failures = [], [], 0
+    for _ in range(iterations):
+        counter.count = 0
+        started = time.perf_counter()
+        result = call()
+        latencies.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+        if isinstance(result, int) and result >= 400:
+            failures += 1
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "queries": int(statistics.median(queries)),
+        "max_queries": max(queries),
+        "failures": failures,
+    }
+
+
+def bench_fetch_sales(app, counter, seed, iterations, pages, rows):
+    """fetch_sales_v2 на поддельном API; вставленные заказы затем убираем"""
+    import digiseller
+    from extensions import db
+    from models.sales import Sale, SalesDaily, SalesLog, SalesProductMonthly
+    from services import counters, sales_rollup
+    from services.token_store import MemoryTokenStore
+
+    with app.app_context():
+        first_new_id = (db.session.execute(select(func.max(Sale.id))).scalar() or 0) + 1
+        first_log_id = (db.session.execute(select(func.max(SalesLog.id))).scalar() or 0) + 1
+        db.session.remove()
+
+        fake = FakeDigiseller(random.Random(f"{seed}:fetch_sales_v2"), pages, rows)
+        saved_http = digiseller._http
+        digiseller.configure_digiseller("bench", "bench", page_rows=rows, token_store=MemoryTokenStore())
+        digiseller._http = fake
+
+        latencies, queries = [], []
+        try:
+            for _ in range(iterations):
+                counter.count = 0
+                started = time.perf_counter()
+                digiseller.fetch_sales_v2()
+                latencies.append((time.perf_counter() - started) * 1000)
+                queries.append(counter.count)
+        finally:
+            digiseller._http = saved_http
+            db.session.rollback()
+            inserted = db.session.execute(
+                select(*sales_rollup.SALE_COLUMNS).where(Sale.id >= first_new_id)
+            ).all()
+            daily, products = sales_rollup.aggregate(inserted)
+            conn = db.session.connection()
+            counters.increment(conn, SalesDaily, sales_rollup.DAILY_KEYS, sales_rollup.SUMS, [
+                dict(zip(sales_rollup.DAILY_KEYS, key), orders=-t[0], amount_in=-t[1], amount_out=-t[2])
+                for key, t in daily.items()
+            ])
+            counters.increment(conn, SalesProductMonthly, sales_rollup.PRODUCT_KEYS, sales_rollup.SUMS, [
+                dict(zip(sales_rollup.PRODUCT_KEYS, key), product_name=None, orders=-p[1], amount_in=-p[2], amount_out=-p[3])
+                for key, p in products.items()
+            ])
+            for model in (SalesDaily, SalesProductMonthly):
+                db.session.execute(model.__table__.delete().where(model.orders <= 0))
+            db.session.execute(Sale.__table__.delete().where(Sale.id >= first_new_id))
+            db.session.execute(SalesLog.__table__.delete().where(SalesLog.id >= first_log_id))
+            db.session.commit()
+
+    return {
+        "iterations": iterations,
+        "rows_per_call": pages * rows,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2),
+        "queries": int(statistics.median(queries)),
+        "max_queries": max(queries),
+        "failures": 0,
+    }
+
+
+def dataset_info(app):
+    from extensions import db
+    from models.sales import Sale
+    from models.ticket import Ticket, TicketMessage
+    with app.app_context():
+        return {
+            "dialect": db.engine.dialect.name,
+            "tickets": db.session.execute(select(func.count(Ticket.id))).scalar(),
+            "messages": db.session.execute(select(func.count(TicketMessage.id))).scalar(),
+            "sales": db.session.execute(select(func.count(Sale.id))).scalar(),
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(BASELINES_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(result, baseline, tolerance):
+    """Регрессии относительно baseline: рост p95 больше tolerance или больше запросов"""
+    regressions = []
+    for name, current in result["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if not before:
+            continue
+        if current["queries"] > before["queries"]:
+            regressions.append(f"{name}: SQL-запросов {before['queries']} → {current['queries']}")
+        if current["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} → {current['p95_ms']} мс")
+    return regressions
+
+
+def print_table(result, baseline=None):
+    print(f"{'сценарий':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'SQL':>6}{'ошибок':>8}")
+    for name, r in result["scenarios"].items():
+        line = f"{name:<16}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}{r['queries']:>6}{r['failures']:>8}"
+        before = (baseline or {}).get("scenarios", {}).get(name)
+        if before:
+            line += f"   (было p95 {before['p95_ms']}, SQL {before['queries']})"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Замеры горячих путей на синтетических данных")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--only", action="append", help="Только этот сценарий (можно несколько раз)")
+    parser.add_argument("--fetch-iterations", type=int, default=5)
+    parser.add_argument("--fetch-pages", type=int, default=4)
+    parser.add_argument("--fetch-rows", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save", metavar="NAME", help="Сохранить как baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Сравнить с baselines/NAME.json")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимый рост p95 (0.2 = 20%%)")
+    parser.add_argument("--allow-other-dataset", action="store_true",
+                        help="Сравнивать, даже если baseline снят на других данных (только предупреждение)")
+    args = parser.parse_args()
+
+    from extensions import db
+    app = bench_app()
+    app.config.update(WTF_CSRF_ENABLED=False)
+
+    client = app.test_client()
+    response = client.post("/auth/login", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+    if response.status_code != 302:
+        raise SystemExit("Не удалось войти: база заполнена benchmarks/datagen.py?")
+
+    with app.app_context():
+        counter = QueryCounter(db.engine)
+
+    scenarios = build_scenarios(app, client, args.seed)
+    selected = args.only or [*scenarios, "fetch_sales_v2"]
+    result = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "dataset": dataset_info(app),
+        "scenarios": {},
+    }
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f"{args.compare}.json"), encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("dataset") != result["dataset"]:
+            # Цифры на других данных несравнимы: 1%-й прогон против полного «без регрессий» всегда
+            message = f"Данные отличаются от baseline {args.compare}: {baseline.get('dataset')} против {result['dataset']}"
+            if not args.allow_other_dataset:
+                raise SystemExit(f"{message}. Сравнение отменено (--allow-other-dataset — сравнить всё равно)")
+            print(f"ВНИМАНИЕ: {message}")
+
+    for name in selected:
+        if name == "fetch_sales_v2":
+            result["scenarios"][name] = bench_fetch_sales(
+                app, counter, args.seed, args.fetch_iterations, args.fetch_pages, args.fetch_rows)
+        elif name in scenarios:
+            result["scenarios"][name] = run_scenario(scenarios[name], counter, args.iterations, args.warmup)
+        else:
+            raise SystemExit(f"Нет сценария {name}: {', '.join([*scenarios, 'fetch_sales_v2'])}")
+
+    print(f"{result['dataset']}, ревизия {result['revision']}")
+    print_table(result, baseline)
+
+    if args.save:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        path = os.path.join(BASELINES_DIR, f"{args.save}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"Сохранено: {path}")
+
+    if baseline:
+        regressions = compare(result, baseline, args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        if regressions:
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
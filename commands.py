@@ -0,0 +1,162 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+search_cli = AppGroup('search', help='Поисковый индекс тикетов')
+sales_cli = AppGroup('sales', help='Загрузка заказов Digiseller')
+media_cli = AppGroup('media', help='Файлы вложений и аватаров')
+tickets_cli = AppGroup('tickets', help='Тикеты')
+
+
+@search_cli.command('rebuild')
+@click.option('--batch-size', default=1000, show_default=True)
+def rebuild_search_index(batch_size):
+    """Создать индекс (если его нет) и переиндексировать все тикеты"""
+    from services.search import rebuild_index
+    total = rebuild_index(batch_size=batch_size)
+    click.echo(f'Проиндексировано тикетов: {total}')
+
+
+@sales_cli.command('sync')
+@click.option('--once', is_flag=True, help='Один проход и выход (для cron)')
+def sync_sales(once):
+    """Постоянная синхронизация заказов с адаптивным интервалом опроса"""
+    from services import metrics
+    from services.sales_sync import configure_from_app, run_daemon, runner_id, sync_once
+    app = current_app._get_current_object()
+    if once:
+        configure_from_app(app)
+        try:
+            count = sync_once(runner_id(), app.config['SALES_SYNC_LEASE_TTL'], app.config['SALES_SYNC_OVERLAP'])
+        finally:
+            metrics.push_batch(app.config['METRICS_PUSHGATEWAY'], 'sales_loader')
+            metrics.process_exited()
+        click.echo('Синхронизацию выполняет другой раннер' if count is None else f'Новых заказов: {count}')
+        return
+    run_daemon(
+        app,
+        min_interval=app.config['SALES_SYNC_MIN_INTERVAL'],
+        max_interval=app.config['SALES_SYNC_MAX_INTERVAL'],
+        lease_ttl=app.config['SALES_SYNC_LEASE_TTL'],
+        overlap=app.config['SALES_SYNC_OVERLAP'],
+    )
+
+
+@sales_cli.command('rebuild-rollups')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--lease-ttl', default=3600, show_default=True, help='На сколько секунд занять аренду синхронизации')
+def rebuild_sales_rollups(batch_size, lease_ttl):
+    """Пересчитать свёртки продаж (по дням и по товарам) из таблицы sales"""
+    from services.sales_rollup import rebuild
+    from services.sales_sync import acquire_lease, release_lease, runner_id
+    # Пока идёт пересчёт, синхронизация не должна добавлять заказы: иначе они не попадут в свёртки
+    owner = runner_id()
+    if not acquire_lease(owner, lease_ttl):
+        raise click.ClickException('Синхронизация продаж сейчас работает, повторите позже')
+    try:
+        total, days, products = rebuild(batch_size=batch_size)
+    finally:
+        release_lease(owner)
+    click.echo(f'Заказов: {total}, строк по дням: {days}, строк по товарам: {products}')
+
+
+@sales_cli.command('fix-lmt-dates')
+@click.option('--before', required=True, type=click.DateTime(formats=['%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M']),
+              help='Время (UTC) развёртывания исправления: правятся заказы, загруженные раньше')
+@click.option('--dry-run', is_flag=True, help='Только посчитать заказы')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--lease-ttl', default=3600, show_default=True, help='На сколько секунд занять аренду синхронизации')
+def fix_sales_lmt_dates(before, dry_run, batch_size, lease_ttl):
+    """Разово сдвинуть даты старых заказов, сохранённых со смещением LMT (+2:30), и пересчитать свёртки"""
+    from datetime import timezone
+    from services.sales_rollup import fix_lmt_dates, rebuild
+    from services.sales_sync import acquire_lease, release_lease, runner_id
+    owner = runner_id()
+    if not acquire_lease(owner, lease_ttl):
+        raise click.ClickException('Синхронизация продаж сейчас работает, повторите позже')
+    try:
+        fixed = fix_lmt_dates(before.replace(tzinfo=timezone.utc), dry_run=dry_run)
+        if fixed and not dry_run:
+            rebuild(batch_size=batch_size)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    finally:
+        release_lease(owner)
+    click.echo(f'Заказов {"к правке" if dry_run else "исправлено"}: {fixed}')
+
+
+@sales_cli.command('compact-log')
+@click.option('--keep-days', type=int, default=None, help='По умолчанию SALES_LOG_RETENTION_DAYS')
+@click.option('--batch-size', default=5000, show_default=True)
+def compact_sales_log(keep_days, batch_size):
+    """Свернуть старые проходы загрузчика в итоги по дням (sales_log_daily) и удалить их"""
+    from services.sales_log import compact
+    if keep_days is None:
+        keep_days = current_app.config['SALES_LOG_RETENTION_DAYS']
+    total = compact(keep_days, batch_size=batch_size)
+    click.echo(f'Свёрнуто проходов: {total}')
+
+
+@tickets_cli.command('dedupe-views')
+def dedupe_ticket_views():
+    """Схлопнуть дубликаты ticket_view и создать уникальный индекс (пользователь, тикет)"""
+    from services.ticket_views import deduplicate
+    removed = deduplicate()
+    click.echo(f'Удалено дубликатов: {removed}')
+
+
+@tickets_cli.command('repair-metrics')
+@click.option('--dry-run', is_flag=True, help='Только сверить, ничего не менять')
+@click.option('--batch-size', default=5000, show_default=True)
+def repair_ticket_metrics(dry_run, batch_size):
+    """Сверить счётчики по статусам и гистограмму времени закрытия с таблицей ticket и исправить"""
+    from services.ticket_metrics import repair
+    mismatches = repair(dry_run=dry_run, batch_size=batch_size)
+    click.echo(('Пробный проход: ' if dry_run else '') + f'расхождений: {mismatches}')
+
+
+@media_cli.command('thumbnails')
+def build_thumbnails():
+    """Построить недостающие миниатюры для всех вложений и аватаров"""
+    from extensions import db
+    from models.attachment import TicketAttachment
+    from models.ticket import TicketMessageAttachment
+    from models.user import User
+    from services import thumbnails
+
+    names = db.session.execute(
+        db.select(TicketAttachment.filename).union(db.select(TicketMessageAttachment.filename))
+    ).scalars()
+    jobs = [(name, thumbnails.ATTACHMENT_KINDS) for name in names]
+    for avatar in db.session.execute(db.select(User.avatar).where(User.avatar.isnot(None))).scalars():
+        name = thumbnails.avatar_upload_name(avatar)
+        if name:
+            jobs.append((name, thumbnails.AVATAR_KINDS))
+
+    built, failed = thumbnails.generate_missing(jobs)
+    click.echo(f'Обработано файлов: {built}, с ошибками: {failed}')
+
+
+@media_cli.command('gc')
+@click.option('--grace-hours', type=float, default=None, help='По умолчанию MEDIA_GC_GRACE_HOURS')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Только посчитать, ничего не удалять')
+@click.option('--every', type=float, default=0, help='Повторять каждые N секунд (0 — один проход)')
+def media_gc(grace_hours, batch_size, dry_run, every):
+    """Удалить файлы загрузок, на которые не ссылается ни одно вложение или аватар"""
+    from datetime import timedelta
+    from services.media_gc import collect_garbage, run_gc_loop
+    app = current_app._get_current_object()
+    grace = timedelta(hours=grace_hours if grace_hours is not None else app.config['MEDIA_GC_GRACE_HOURS'])
+    if every:
+        run_gc_loop(app, grace, batch_size, every)
+        return
+    stats = collect_garbage(app.config['UPLOAD_FOLDER'], grace, batch_size=batch_size, dry_run=dry_run)
+    click.echo(('Пробный проход: ' if dry_run else '') + str(stats))
+
+
+def register_commands(app):
+    app.cli.add_command(search_cli)
+    app.cli.add_command(sales_cli)
+    app.cli.add_command(media_cli)
+    app.cli.add_command(tickets_cli)
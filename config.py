@@ -5,12 +5,100 @@ load_dotenv()
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# Бэкенды flask_caching, из которых чтение заметно быстрее запроса к БД по ключу
+FAST_CACHE_TYPES = ('RedisCache', 'RedisClusterCache', 'RedisSentinelCache', 'SimpleCache', 'redis', 'simple')
+
+
+def _is_fast_cache(cache_type):
+    return cache_type.rsplit('.', 1)[-1] in FAST_CACHE_TYPES
+
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-secret-key'
     DIGISELLER_SELLER_ID = os.environ.get("DIGISELLER_SELLER_ID")
     DIGISELLER_API_KEY = os.environ.get("DIGISELLER_API_KEY")
+    DIGISELLER_PAGE_ROWS = int(os.environ.get("DIGISELLER_PAGE_ROWS") or 500)
+    DIGISELLER_MAX_PARALLEL = int(os.environ.get("DIGISELLER_MAX_PARALLEL") or 4)
+    DIGISELLER_MAX_RETRIES = int(os.environ.get("DIGISELLER_MAX_RETRIES") or 5)
+    DIGISELLER_TOKEN_STORE = os.environ.get("DIGISELLER_TOKEN_STORE") or "cache"   # cache | sqlite | memory
+    DIGISELLER_TOKEN_SQLITE_PATH = os.environ.get("DIGISELLER_TOKEN_SQLITE_PATH") or os.path.join(basedir, 'instance', 'tokens.sqlite3')
+    SALES_SYNC_MIN_INTERVAL = float(os.environ.get("SALES_SYNC_MIN_INTERVAL") or 5)
+    SALES_SYNC_MAX_INTERVAL = float(os.environ.get("SALES_SYNC_MAX_INTERVAL") or 120)
+    SALES_SYNC_LEASE_TTL = int(os.environ.get("SALES_SYNC_LEASE_TTL") or 300)
+    SALES_SYNC_OVERLAP = int(os.environ.get("SALES_SYNC_OVERLAP") or 120)
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(basedir, 'static', 'uploads')
+    # Пул соединений с БД на один процесс (для SQLite не применяется)
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 5)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 10)
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE') or 1800)
+    # Вне static/: вложения отдаются только через /media после входа
+    UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(basedir, 'instance', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024
+    # Приём файлов через /uploads: лимиты на файл и на запрос, параллельность загрузки в браузере
+    UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE') or 16 * 1024 * 1024)
+    UPLOAD_MAX_FILES = int(os.environ.get('UPLOAD_MAX_FILES') or 20)
+    UPLOAD_MAX_REQUEST_SIZE = int(os.environ.get('UPLOAD_MAX_REQUEST_SIZE') or 64 * 1024 * 1024)
+    UPLOAD_PARALLEL = int(os.environ.get('UPLOAD_PARALLEL') or 4)
+    # Какие файлы принимает /uploads (как FileAllowed в формах: только изображения)
+    UPLOAD_ALLOWED_EXTENSIONS = set((os.environ.get('UPLOAD_ALLOWED_EXTENSIONS') or 'jpg,jpeg,png,gif').lower().split(','))
+    # Отдача вложений: '' — сам Flask, x-accel — nginx (X-Accel-Redirect), x-sendfile — Apache/lighttpd
+    MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or ''
+    MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX') or '/_uploads/'
+    MEDIA_MAX_AGE = int(os.environ.get('MEDIA_MAX_AGE') or 31536000)
+    USE_X_SENDFILE = MEDIA_SENDFILE == 'x-sendfile'
+    # Сборка мусора в UPLOAD_FOLDER: файлы без ссылок моложе этого срока не трогаем
+    MEDIA_GC_GRACE_HOURS = float(os.environ.get('MEDIA_GC_GRACE_HOURS') or 24)
+    # Миниатюры вложений и аватаров строятся в отдельных процессах (нужен Pillow)
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS') or 2)
+    THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT') or 'webp'   # webp | jpeg
+    THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY') or 80)
+    DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE') or 40)
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE') or 25)
+    CHAT_FETCH_LIMIT = int(os.environ.get('CHAT_FETCH_LIMIT') or 100)
+    # Просмотры тикетов копятся в памяти и пишутся пачкой раз в N секунд (0 — сразу)
+    TICKET_VIEW_FLUSH_INTERVAL = float(os.environ.get('TICKET_VIEW_FLUSH_INTERVAL') or 5)
+    TICKET_VIEW_BUFFER_MAX = int(os.environ.get('TICKET_VIEW_BUFFER_MAX') or 10000)
+    PURCHASE_HISTORY_PAGE_SIZE = int(os.environ.get('PURCHASE_HISTORY_PAGE_SIZE') or 20)
+    SALES_SEARCH_PAGE_SIZE = int(os.environ.get('SALES_SEARCH_PAGE_SIZE') or 50)
+    SALES_SEARCH_COUNT_CAP = int(os.environ.get('SALES_SEARCH_COUNT_CAP') or 1000)
+    SALES_ANALYTICS_MAX_MONTHS = int(os.environ.get('SALES_ANALYTICS_MAX_MONTHS') or 36)
+    SALES_LOG_PAGE_SIZE = int(os.environ.get('SALES_LOG_PAGE_SIZE') or 50)
+    # Проходы загрузчика старше этого срока сворачиваются в итоги по дням (flask sales compact-log)
+    SALES_LOG_RETENTION_DAYS = int(os.environ.get('SALES_LOG_RETENTION_DAYS') or 30)
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'FileSystemCache'
+    CACHE_DIR = os.environ.get('CACHE_DIR') or os.path.join(basedir, 'instance', 'cache')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_DEFAULT_TIMEOUT = 300
+    # Сколько секунд current_user берётся из кэша без запроса к БД (0 — всегда из БД).
+    # Окупается с RedisCache (или SimpleCache при одном воркере), не с FileSystemCache:
+    # по умолчанию 60 только для быстрых бэкендов, иначе 0
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or (60 if _is_fast_cache(CACHE_TYPE) else 0))
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL') or 'ticket-site'
+    # eventlet | gevent | threading; пусто — Flask-SocketIO выберет сам
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+    # Боевой сервер (serve.py)
+    SERVER_MODE = os.environ.get('SERVER_MODE') or 'eventlet'
+    SERVER_HOST = os.environ.get('SERVER_HOST') or '0.0.0.0'
+    SERVER_PORT = int(os.environ.get('SERVER_PORT') or 8080)
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or 1)
+    # Потоков на воркер в режиме threading (gunicorn gthread): каждый websocket занимает поток,
+    # поэтому это и потолок одновременных клиентов Socket.IO
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 1000)
+    # Сколько соединений с БД всего можно занять всеми воркерами
+    SERVER_DB_CONNECTIONS = int(os.environ.get('SERVER_DB_CONNECTIONS') or 40)
+    # Профилирование SQL по запросам (/debug/perf). Выключено — слушатели движка не ставятся вовсе
+    PERF_PROFILING = os.environ.get('PERF_PROFILING') == '1'
+    PERF_SAMPLE_RATE = float(os.environ.get('PERF_SAMPLE_RATE') or 1.0)          # доля профилируемых запросов
+    PERF_SLOW_REQUEST_MS = float(os.environ.get('PERF_SLOW_REQUEST_MS') or 500)   # медленные — в лог
+    PERF_N_PLUS_ONE_THRESHOLD = int(os.environ.get('PERF_N_PLUS_ONE_THRESHOLD') or 5)
+    PERF_HISTORY = int(os.environ.get('PERF_HISTORY') or 200)
+    # Метрики Prometheus на /metrics, только с Authorization: Bearer <METRICS_TOKEN> (без токена — лишь в debug)
+    METRICS_ENABLED = (os.environ.get('METRICS_ENABLED') or '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or ''
+    # Pushgateway для разовых прогонов загрузчика (flask sales sync --once, run_sales_loader.py из cron)
+    METRICS_PUSHGATEWAY = os.environ.get('METRICS_PUSHGATEWAY') or ''
+    # Каталог файлов метрик воркеров для serve.py --workers N (файлы завершившихся процессов удаляются при старте)
+    METRICS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(basedir, 'instance', 'metrics')
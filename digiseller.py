@@ -1,66 +1,129 @@
 import time
+import random
 import hashlib
 import logging
 import requests
 import pytz
-from datetime import datetime, timedelta
-from sqlalchemy.exc import IntegrityError
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from requests.adapters import HTTPAdapter
 from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite, mysql
 from extensions import db
-from models.sales import Sale, SalesLog
+from models.sales import Sale
+from services import sales_rollup
+from services.sales_log import LoaderRun
+from services.metrics import (
+    DIGISELLER_ERRORS, DIGISELLER_LATENCY, SALES_FETCH_DURATION, SALES_FETCH_ROWS, SALES_FETCH_RUNS,
+)
+from services.token_store import MemoryTokenStore
 
 DIGISELLER_API_URL = "https://api.digiseller.com/api"
 
 # Глобальные переменные для конфигурации (будут установлены извне)
 DIGISELLER_SELLER_ID = None
 DIGISELLER_API_KEY = None
-CACHE = {}  # Простой кэш вместо flask-cache
+TOKEN_STORE = MemoryTokenStore()  # заменяется через configure_digiseller(token_store=...)
+TOKEN_TTL = 6600                  # токен живёт 2 часа, храним 1 час 50 минут
+TOKEN_REFRESH_MARGIN = 600        # обновляем заранее, за 10 минут до истечения
 
-def configure_digiseller(seller_id, api_key):
+# Постраничная выгрузка seller-sells/v2
+PAGE_ROWS = 500           # строк на страницу
+MAX_PARALLEL_PAGES = 4    # одновременных запросов страниц
+MAX_RETRIES = 5           # попыток на страницу
+RETRY_BASE_DELAY = 1.0    # секунды, удваивается на каждой попытке
+HEARTBEAT_INTERVAL = 15   # секунды: как часто, пока качаются страницы, зовём heartbeat() (продление аренды)
+
+_http = None
+
+
+class PageFetchError(Exception):
+    """Страницу не удалось получить после всех попыток"""
+
+
+class BatchInsertError(Exception):
+    """Пачку заказов страницы не удалось записать; окно нужно повторить"""
+
+
+def configure_digiseller(seller_id, api_key, page_rows=None, max_parallel=None, max_retries=None, token_store=None):
     """Установка конфигурации извне"""
-    global DIGISELLER_SELLER_ID, DIGISELLER_API_KEY
+    global DIGISELLER_SELLER_ID, DIGISELLER_API_KEY, PAGE_ROWS, MAX_PARALLEL_PAGES, MAX_RETRIES, TOKEN_STORE, _http
     DIGISELLER_SELLER_ID = seller_id
     DIGISELLER_API_KEY = api_key
+    TOKEN_STORE = token_store or TOKEN_STORE
+    PAGE_ROWS = page_rows or PAGE_ROWS
+    MAX_RETRIES = max_retries or MAX_RETRIES
+    if max_parallel and max_parallel != MAX_PARALLEL_PAGES:
+        MAX_PARALLEL_PAGES = max_parallel
+        _http = None  # пул соединений пересоздастся под новый размер
 
-def save_sales_log(orders_count=0, note="", errors=None):
-    """Сохраняет лог подгрузки заказов в БД"""
-    error_text = "; ".join(errors) if errors else ""
-    log_entry = SalesLog(
-        orders_loaded=orders_count,
-        note=note,
-        errors=error_text
-    )
-    db.session.add(log_entry)
-    db.session.commit()
 
-def get_token():
-    """Получаем и кэшируем токен Digiseller"""
-    # Проверяем кэш
-    if "digiseller_token" in CACHE:
-        token, expiry = CACHE["digiseller_token"]
-        if time.time() < expiry:
-            return token
-    
+def get_http_session():
+    """Общая HTTP-сессия с пулом соединений на MAX_PARALLEL_PAGES потоков"""
+    global _http
+    if _http is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL_PAGES)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept": "application/json"})
+        _http = session
+    return _http
+
+def _login():
+    """Запрос нового токена у apilogin"""
     if not DIGISELLER_SELLER_ID or not DIGISELLER_API_KEY:
         raise ValueError("DIGISELLER_SELLER_ID или DIGISELLER_API_KEY не настроены")
-    
+
     current_time = int(time.time())
     sign = hashlib.sha256((DIGISELLER_API_KEY + str(current_time)).encode()).hexdigest()
 
     payload = {"seller_id": DIGISELLER_SELLER_ID, "timestamp": current_time, "sign": sign}
     headers = {"Accept": "application/json"}
 
-    resp = requests.post(f"{DIGISELLER_API_URL}/apilogin", json=payload, headers=headers, timeout=30)
+    try:
+        with DIGISELLER_LATENCY.labels("login").time():
+            resp = get_http_session().post(f"{DIGISELLER_API_URL}/apilogin", json=payload, headers=headers, timeout=30)
+    except requests.RequestException:
+        DIGISELLER_ERRORS.labels("login", "network").inc()
+        raise
     data = resp.json()
 
     if data.get("retval") == 0:
-        token = data["token"]
-        # Кэшируем на 1 час 50 минут
-        CACHE["digiseller_token"] = (token, time.time() + 6600)
-        return token
+        return data["token"]
     else:
+        DIGISELLER_ERRORS.labels("login", "retval").inc()
         raise Exception(f"Ошибка получения токена: {data}")
 
+
+def get_token():
+    """
+    Токен Digiseller из общего хранилища. Обновляет его один вызывающий
+    (под блокировкой хранилища); остальные тем временем пользуются старым
+    токеном, пока он ещё действует, или ждут нового.
+    """
+    entry = TOKEN_STORE.get()
+    now = time.time()
+    if entry and now < entry[1] - TOKEN_REFRESH_MARGIN:
+        return entry[0]
+
+    # Пока старый токен жив, за блокировку не стоим: обновит тот, кто её взял
+    still_valid = bool(entry and now < entry[1])
+    with TOKEN_STORE.lock(blocking=not still_valid) as acquired:
+        entry = TOKEN_STORE.get()
+        now = time.time()
+        if entry and now < entry[1] - TOKEN_REFRESH_MARGIN:
+            return entry[0]
+        if not acquired:
+            if entry and now < entry[1]:
+                return entry[0]
+            raise Exception("Не удалось дождаться обновления токена Digiseller")
+
+        token = _login()
+        TOKEN_STORE.set(token, now + TOKEN_TTL)
+        return token
+
+
 def get_last_sale_date():
     """Берём последнюю дату заказа в БД"""
     last_date = db.session.query(func.max(Sale.date_pay)).scalar()
@@ -68,94 +131,309 @@ def get_last_sale_date():
         last_date = db.session.query(func.max(Sale.date_put)).scalar()
 
     if last_date:
-        return last_date + timedelta(seconds=1)
+        # Без "+1 секунды": заказы с той же секундой иначе теряются, а повторы отсекает ON CONFLICT
+        return last_date
     else:
         # если база пустая — старт с 2020 года
         tz_msk = pytz.timezone("Europe/Moscow")
         return datetime(2020, 1, 1, 0, 0, 0, tzinfo=tz_msk)
 
+def parse_sale_row(row):
+    """Строка API -> словарь колонок Sale; None, если нет обязательных полей"""
+    if not all([row.get("invoice_id"), row.get("product_id"), row.get("product_name"), row.get("product_entry")]):
+        return None
+    tz_msk = pytz.timezone("Europe/Moscow")
+    return dict(
+        invoice_id=str(row.get("invoice_id")),
+        product_id=row.get("product_id"),
+        product_name=row.get("product_name"),
+        product_entry=row.get("product_entry"),
+        # localize, а не replace(tzinfo=...): у pytz-зоны без localize смещение LMT (+2:30), а не +3
+        date_put=tz_msk.localize(datetime.strptime(row["date_put"], "%Y-%m-%d %H:%M:%S")),
+        date_pay=tz_msk.localize(datetime.strptime(row["date_pay"], "%Y-%m-%d %H:%M:%S")) if row.get("date_pay") else None,
+        email=row.get("email") or "",
+        amount_in=row.get("amount_in") or 0,
+        amount_out=row.get("amount_out") or 0,
+        amount_currency=row.get("amount_currency") or "",
+        method_pay=row.get("method_pay") or "",
+        aggregator_pay=row.get("aggregator") or "",
+        ip=row.get("ip") or "",
+        partner_id=row.get("partner_id") or 0,
+        lang=row.get("lang") or "",
+    )
+
+
+def insert_sales_batch(values):
+    """
+    Вставка пачки заказов одним multi-row INSERT с пропуском дубликатов
+    по invoice_id. Вставленные заказы сразу попадают в свёртки продаж.
+    Возвращает (inserted, skipped). Коммит — на вызывающем.
+    """
+    # Дубликаты внутри самой пачки отбрасываем сразу
+    unique = list({v["invoice_id"]: v for v in values}.values())
+    if not unique:
+        return 0, len(values)
+
+    conn = db.session.connection()
+    dialect = conn.dialect.name
+    table = Sale.__table__
+
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = (insert(table)
+                .on_conflict_do_nothing(index_elements=["invoice_id"])
+                .returning(table.c.invoice_id))
+        returned = set(conn.execute(stmt, unique).scalars())
+        fresh = [v for v in unique if v["invoice_id"] in returned]
+    else:
+        existing = set(conn.execute(
+            db.select(table.c.invoice_id).where(table.c.invoice_id.in_([v["invoice_id"] for v in unique]))
+        ).scalars())
+        fresh = [v for v in unique if v["invoice_id"] not in existing]
+        if fresh:
+            # IGNORE страхует от параллельной вставки между SELECT и INSERT
+            insert = mysql.insert(table).prefix_with("IGNORE") if dialect == "mysql" else table.insert()
+            conn.execute(insert, fresh)
+
+    sales_rollup.apply_sales(fresh)
+    return len(fresh), len(values) - len(fresh)
+
+
+def ingest_sales_rows(rows, run):
+    """
+    Разбор и вставка одной страницы API. Возвращает (inserted, skipped).
+    Неразобранные строки пропускаются (ошибки — в run); если не записалась
+    сама пачка — BatchInsertError.
+    """
+    values = []
+    for row in rows:
+        try:
+            parsed = parse_sale_row(row)
+        except (KeyError, ValueError, TypeError) as e:
+            run.error("parse", e, row.get("invoice_id"))
+            continue
+        if parsed is None:
+            run.error("missing", "Нет обязательных полей", row.get("invoice_id"))
+            continue
+        values.append(parsed)
+
+    try:
+        inserted, skipped = insert_sales_batch(values)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        run.error("insert", f"Пачка из {len(values)} заказов: {e}")
+        raise BatchInsertError(str(e)) from e
+    return inserted, skipped
+
+
 def get_moscow_time():
     """Текущее время в Москве (UTC+3)"""
     tz_msk = pytz.timezone("Europe/Moscow")
     return datetime.now(tz_msk)
 
-def fetch_sales_v2():
-    """Загрузка новых заказов через Digiseller API v2"""
-    if not DIGISELLER_SELLER_ID or not DIGISELLER_API_KEY:
-        logging.error("Digiseller не настроен. Вызовите configure_digiseller() first.")
-        return 0
+def _retry_delay(resp, attempt):
+    """Пауза перед повтором: Retry-After от API или экспоненциальный backoff с джиттером"""
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return RETRY_BASE_DELAY * (2 ** (attempt - 1)) + random.uniform(0, RETRY_BASE_DELAY)
+
+
+def fetch_sales_page(token, payload, page, run=None):
+    """Одна страница seller-sells/v2 с повторами при 429/5xx и сетевых ошибках"""
+    url = f"{DIGISELLER_API_URL}/seller-sells/v2?token={token}"
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    error = None
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        resp = None
+        started = time.perf_counter()
+        try:
+            resp = get_http_session().post(url, json={**payload, "page": page}, headers=headers, timeout=60)
+        except requests.RequestException as e:
+            DIGISELLER_ERRORS.labels("sales_page", "network").inc()
+            error = f"{type(e).__name__}: {e}"
+        else:
+            elapsed = time.perf_counter() - started
+            DIGISELLER_LATENCY.labels("sales_page").observe(elapsed)
+            if run is not None:
+                run.api_call(elapsed * 1000)
+            if resp.status_code == 200:
+                data = resp.json()
+                if data.get("retval") not in (None, 0):
+                    DIGISELLER_ERRORS.labels("sales_page", "retval").inc()
+                    raise PageFetchError(f"Страница {page}: retval {data.get('retval')}: {data.get('retdesc')}")
+                return data
+            DIGISELLER_ERRORS.labels("sales_page", f"http_{resp.status_code}").inc()
+            error = f"HTTP {resp.status_code}: {resp.text[:200]}"
+            if resp.status_code != 429 and resp.status_code < 500:
+                raise PageFetchError(f"Страница {page}: {error}")
+
+        if attempt < MAX_RETRIES:
+            delay = _retry_delay(resp, attempt)
+            logging.warning(f"Страница {page}, попытка {attempt}: {error}; повтор через {delay:.1f} с")
+            if run is not None:
+                run.error("retry", f"Страница {page}, попытка {attempt}: {error}")
+            time.sleep(delay)
+
+    raise PageFetchError(f"Страница {page}: {error} (попыток: {MAX_RETRIES})")
+
+
+def _completed(futures, heartbeat=None):
+    """
+    Как as_completed, но ожидание идёт в вызывающем потоке: пока страницы
+    качаются (с повторами и паузами), раз в HEARTBEAT_INTERVAL зовём heartbeat().
+    """
+    pending = set(futures)
+    last_beat = time.monotonic()
+    while pending:
+        done, pending = wait(pending, timeout=HEARTBEAT_INTERVAL, return_when=FIRST_COMPLETED)
+        if heartbeat is not None and time.monotonic() - last_beat >= HEARTBEAT_INTERVAL:
+            heartbeat()
+            last_beat = time.monotonic()
+        yield from done
+
+
+def fetch_all_sales_pages(token, payload, run=None, heartbeat=None):
+    """
+    Все страницы окна: первая — отдельно (из неё узнаём число страниц),
+    остальные — параллельно, не больше MAX_PARALLEL_PAGES одновременно.
+    Запросы идут в потоках пула, а heartbeat() зовётся из вызывающего потока
+    всё время выгрузки; исключение из него прерывает её.
+    Возвращает список rows по страницам в порядке номеров.
+    """
+    pages = {}
+
+    def fetch(numbers):
+        futures = {pool.submit(fetch_sales_page, token, payload, n, run): n for n in numbers}
+        failures = []
+        for future in _completed(futures, heartbeat):
+            try:
+                pages[futures[future]] = future.result()
+            except PageFetchError as e:
+                failures.append(str(e))
+        if failures:
+            raise PageFetchError("; ".join(sorted(failures)))
+
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_PAGES) as pool:
+        try:
+            fetch([1])
+            total_pages = pages[1].get("pages")
+            if total_pages is None:
+                # API не сообщил число страниц — идём последовательно до неполной страницы
+                page = 1
+                while len(pages[page].get("rows") or []) >= payload["rows"]:
+                    page += 1
+                    fetch([page])
+            else:
+                fetch(range(2, int(total_pages) + 1))
+        except BaseException:
+            # Ещё не начатые страницы не качаем; уже идущие запросы пул дождётся
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return [pages[n].get("rows") or [] for n in sorted(pages)]
+
 
+def to_moscow(dt):
+    """Даты из БД бывают naive (SQLite) — считаем их московскими"""
+    tz_msk = pytz.timezone("Europe/Moscow")
+    if dt.tzinfo is None:
+        return tz_msk.localize(dt)
+    return dt.astimezone(tz_msk)
+
+
+def load_sales_window(date_start, date_finish, before_page=None):
+    """
+    Загрузка заказов за окно [date_start, date_finish] целиком.
+    Возвращает (ok, inserted); ok=False — окно не загружено, повторить позже.
+    before_page() зовётся раз в HEARTBEAT_INTERVAL секунд, пока качаются
+    страницы, и перед записью каждой страницы (продление аренды);
+    исключение из него прерывает проход.
+    Проход с заказами или ошибками пишется в sales_log (services.sales_log).
+    """
+    run = LoaderRun(date_start, date_finish)
+    with SALES_FETCH_DURATION.time():
+        status = _load_sales_window(run, before_page)
+    SALES_FETCH_RUNS.labels(status).inc()
+    if status == "ok":
+        SALES_FETCH_ROWS.labels("fetched").inc(run.fetched)
+        SALES_FETCH_ROWS.labels("inserted").inc(run.inserted)
+        SALES_FETCH_ROWS.labels("skipped").inc(run.skipped)
+        # Не разобранные и не вставленные из-за ошибки пачки
+        SALES_FETCH_ROWS.labels("rejected").inc(run.fetched - run.inserted - run.skipped)
+    return status in ("ok", "empty"), run.inserted
+
+
+def _load_sales_window(run, before_page=None):
+    """Сам проход; возвращает статус: ok | empty | api_error | error"""
     try:
         token = get_token()
-        date_start = get_last_sale_date()
-        date_finish = get_moscow_time()
 
         payload = {
-            "date_start": date_start.strftime("%Y-%m-%d %H:%M:%S"),
-            "date_finish": date_finish.strftime("%Y-%m-%d %H:%M:%S"),
+            "date_start": to_moscow(run.window_start).strftime("%Y-%m-%d %H:%M:%S"),
+            "date_finish": to_moscow(run.window_end).strftime("%Y-%m-%d %H:%M:%S"),
             "returned": 0,
-            "page": 1,
-            "rows": 500
+            "rows": PAGE_ROWS
         }
 
-        url = f"{DIGISELLER_API_URL}/seller-sells/v2?token={token}"
-        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        # Окно пишем только целиком: иначе водяной знак уедет за пропущенную страницу
+        try:
+            pages = fetch_all_sales_pages(token, payload, run, heartbeat=before_page)
+        except PageFetchError as e:
+            logging.error(str(e))
+            run.error("api", e)
+            run.save("api_error", note="Ошибка API")
+            return "api_error"
 
-        errors = []
-        inserted_count = 0
-
-        resp = requests.post(url, json=payload, headers=headers, timeout=60)
-        if resp.status_code != 200:
-            error_msg = f"HTTP {resp.status_code}: {resp.text}"
-            logging.error(error_msg)
-            save_sales_log(0, note="Ошибка API", errors=[error_msg])
-            return 0
-
-        data = resp.json()
-        if "rows" not in data or not data["rows"]:
+        if not any(pages):
             logging.info("Новых заказов нет")
-            return 0
+            return "empty"
 
-        for row in data["rows"]:
-            if not all([row.get("invoice_id"), row.get("product_id"), row.get("product_name"), row.get("product_entry")]):
-                errors.append(f"Пропущен заказ из-за отсутствия обязательных полей: {row.get('invoice_id')}")
+        run.pages = len(pages)
+        run.fetched = sum(len(rows) for rows in pages)
+        failed_pages = 0
+        for rows in pages:
+            if before_page is not None:
+                before_page()
+            try:
+                inserted, skipped = ingest_sales_rows(rows, run)
+            except BatchInsertError:
+                # Остальные страницы пишем; записанные при повторе окна уйдут в дубликаты
+                failed_pages += 1
                 continue
+            run.inserted += inserted
+            run.skipped += skipped
 
-            sale = Sale(
-                invoice_id=row.get("invoice_id"),
-                product_id=row.get("product_id"),
-                product_name=row.get("product_name"),
-                product_entry=row.get("product_entry"),
-                date_put=datetime.strptime(row["date_put"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=pytz.timezone("Europe/Moscow")),
-                date_pay=datetime.strptime(row["date_pay"], "%Y-%m-%d %H:%M:%S").replace(tzinfo=pytz.timezone("Europe/Moscow")) if row.get("date_pay") else None,
-                email=row.get("email") or "",
-                amount_in=row.get("amount_in") or 0,
-                amount_out=row.get("amount_out") or 0,
-                amount_currency=row.get("amount_currency") or "",
-                method_pay=row.get("method_pay") or "",
-                aggregator_pay=row.get("aggregator") or "",
-                ip=row.get("ip") or "",
-                partner_id=row.get("partner_id") or 0,
-                lang=row.get("lang") or "",
-            )
-            
-            try:
-                db.session.add(sale)
-                db.session.commit()
-                inserted_count += 1
-            except IntegrityError:
-                db.session.rollback()
-            except Exception as e:
-                db.session.rollback()
-                errors.append(f"Ошибка вставки {row.get('invoice_id')}: {e}")
-
-        # Сохраняем лог
-        save_sales_log(inserted_count, note="Автозагрузка", errors=errors)
-        logging.info(f"Добавлено {inserted_count} новых заказов, ошибок: {len(errors)}")
-        
-        return inserted_count
+        if failed_pages:
+            # Водяной знак не двигаем, пока окно не записано целиком
+            run.save("error", note=f"Ошибка вставки: страниц {failed_pages} из {run.pages}")
+            logging.error(f"Не записано страниц: {failed_pages} из {run.pages}; окно будет загружено повторно")
+            return "error"
+
+        run.save("ok", note="Автозагрузка")
+        logging.info(f"Добавлено {run.inserted} новых заказов со {run.pages} страниц, дубликатов: {run.skipped}, ошибок: {run.error_count}")
+        return "ok"
 
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Общая ошибка в fetch_sales_v2: {e}")
-        save_sales_log(0, note="Общая ошибка", errors=[str(e)])
-        return 0
\ No newline at end of file
+        run.error("fatal", e)
+        try:
+            run.save("error", note="Общая ошибка")
+        except Exception as save_error:
+            # БД недоступна — проход остаётся только в логе приложения и метриках
+            db.session.rollback()
+            logging.error(f"Проход не записан в sales_log: {save_error}")
+        return "error"
+
+
+def fetch_sales_v2():
+    """Загрузка новых заказов через Digiseller API v2 (все страницы окна)"""
+    if not DIGISELLER_SELLER_ID or not DIGISELLER_API_KEY:
+        logging.error("Digiseller не настроен. Вызовите configure_digiseller() first.")
+        return 0
+
+    _, inserted = load_sales_window(get_last_sale_date(), get_moscow_time())
+    return inserted
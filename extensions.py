@@ -12,6 +12,6 @@ socketio = SocketIO(cors_allowed_origins="*")
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models.user import User
-    from extensions import db
-    return db.session.get(User, int(user_id))
+    # Без запроса к БД на каждый запрос: см. services.user_cache
+    from services.user_cache import load_identity
+    return load_identity(user_id)
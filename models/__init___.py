@@ -1,4 +1,5 @@
 from .user import User
 from .ticket import Ticket, TicketMessage, Status
-from .attachment import TicketAttachment
-from .sales import Sale, SalesLog
+from .ticket_metrics import TicketStatusCounter, TicketCloseBucket
+from .attachment import TicketAttachment, StoredFile, Upload
+from .sales import Sale, SalesLog, SyncState, SalesDaily, SalesProductMonthly, SalesLogDaily
@@ -1,10 +1,13 @@
 from extensions import db
 from flask import url_for
 
+from datetime import datetime, timezone
+
 
 class TicketAttachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(256), nullable=False)
+    original_name = db.Column(db.String(256))
     ticket_id = db.Column(
         db.Integer,
         db.ForeignKey('ticket.id', ondelete='CASCADE'),
@@ -12,4 +15,29 @@ class TicketAttachment(db.Model):
     )
 
     def url(self):
-        return url_for('static', filename='uploads/' + self.filename)
+        return url_for('media.serve_upload', name=self.filename)
+
+
+class StoredFile(db.Model):
+    """Файл в UPLOAD_FOLDER под путём от SHA-256 содержимого; ref_count — сколько вложений на него ссылается"""
+    __tablename__ = "stored_file"
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(256), unique=True, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100))
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+
+class Upload(db.Model):
+    """Загруженный, но ещё не прикреплённый файл: держит ссылку на StoredFile, пока его не заберёт сообщение или тикет"""
+    __tablename__ = "upload"
+    # id уходят клиенту: на SQLite без AUTOINCREMENT id забранной загрузки достался бы следующей
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(256), nullable=False)
+    original_name = db.Column(db.String(256))
+    content_type = db.Column(db.String(100))
+    size = db.Column(db.BigInteger, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
@@ -3,6 +3,14 @@ from datetime import datetime, timezone
 
 class Sale(db.Model):
     __tablename__ = "sales"
+    __table_args__ = (
+        db.Index('idx_sales_ip', 'ip'),
+        # В Postgres — триграммные GIN-индексы (нужен pg_trgm): обслуживают и префикс, и ILIKE '%...%'
+        db.Index('idx_sales_product_entry', 'product_entry', mysql_length=64,
+                 postgresql_using='gin', postgresql_ops={'product_entry': 'gin_trgm_ops'}),
+        db.Index('idx_sales_product_name', 'product_name', mysql_length=64,
+                 postgresql_using='gin', postgresql_ops={'product_name': 'gin_trgm_ops'}),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.String(50), unique=True, index=True)      # Номер заказа, уникальный
@@ -24,10 +32,101 @@ class Sale(db.Model):
     created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime(timezone=True), onupdate=lambda: datetime.now(timezone.utc))
 
+# Выдача поиска и история покупок листаются по (coalesce(date_pay, date_put), id)
+db.Index('idx_sales_pay_sort', db.func.coalesce(Sale.date_pay, Sale.date_put), Sale.id)
+db.Index('idx_sales_email_pay_sort', Sale.email, db.func.coalesce(Sale.date_pay, Sale.date_put), Sale.id)
+
+# Триграммные индексы выше требуют pg_trgm: ставим расширение перед созданием таблицы (db.create_all)
+db.event.listen(
+    Sale.__table__, "before_create",
+    db.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
 class SalesLog(db.Model):
+    """Один проход загрузчика заказов (services.sales_log.LoaderRun)"""
     __tablename__ = "sales_log"
     id = db.Column(db.Integer, primary_key=True)
-    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
-    orders_loaded = db.Column(db.Integer, nullable=False)
+    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))   # окончание прохода, UTC
+    orders_loaded = db.Column(db.Integer, nullable=False)                            # новых заказов
     note = db.Column(db.String(255), nullable=True)  # например: "Автообновление" или "Ручная загрузка"
-    errors = db.Column(db.Text)
+    errors = db.Column(db.Text)                      # текст ошибок старых записей; новые — в error_items
+    status = db.Column(db.String(20), index=True)    # ok | empty | api_error | error
+    window_start = db.Column(db.DateTime(timezone=True))
+    window_end = db.Column(db.DateTime(timezone=True))
+    duration_ms = db.Column(db.Integer)
+    pages = db.Column(db.Integer, default=0)
+    rows_fetched = db.Column(db.Integer, default=0)
+    rows_skipped = db.Column(db.Integer, default=0)  # дубликаты
+    api_requests = db.Column(db.Integer, default=0)
+    api_ms = db.Column(db.Float, default=0)          # суммарное время запросов к API
+    api_max_ms = db.Column(db.Float, default=0)
+    error_count = db.Column(db.Integer, default=0)
+    error_items = db.Column(db.JSON)                 # [{"kind", "message", "invoice_id"}], не больше MAX_ERROR_ITEMS
+
+    @property
+    def rows_per_second(self):
+        if not self.duration_ms or not self.rows_fetched:
+            return None
+        return self.rows_fetched * 1000 / self.duration_ms
+
+    @property
+    def api_avg_ms(self):
+        return self.api_ms / self.api_requests if self.api_requests else None
+
+
+class SalesLogDaily(db.Model):
+    """Итоги старых проходов загрузчика за день (московская дата); сами проходы удаляются"""
+    __tablename__ = "sales_log_daily"
+    day = db.Column(db.Date, primary_key=True)
+    runs = db.Column(db.Integer, nullable=False, default=0)
+    failed_runs = db.Column(db.Integer, nullable=False, default=0)
+    orders_loaded = db.Column(db.Integer, nullable=False, default=0)
+    rows_fetched = db.Column(db.Integer, nullable=False, default=0)
+    rows_skipped = db.Column(db.Integer, nullable=False, default=0)
+    pages = db.Column(db.Integer, nullable=False, default=0)
+    duration_ms = db.Column(db.BigInteger, nullable=False, default=0)
+    api_requests = db.Column(db.Integer, nullable=False, default=0)
+    api_ms = db.Column(db.Float, nullable=False, default=0)
+    error_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def api_avg_ms(self):
+        return self.api_ms / self.api_requests if self.api_requests else None
+
+
+class SyncState(db.Model):
+    """Состояние фоновой синхронизации: водяной знак и аренда (lease) раннера"""
+    __tablename__ = "sync_state"
+    name = db.Column(db.String(50), primary_key=True)                    # например: "digiseller_sales"
+    watermark = db.Column(db.DateTime(timezone=True))                     # до этого момента всё загружено
+    last_run_at = db.Column(db.DateTime(timezone=True))
+    last_success_at = db.Column(db.DateTime(timezone=True))
+    last_inserted = db.Column(db.Integer, default=0)
+    consecutive_failures = db.Column(db.Integer, default=0)
+    lease_owner = db.Column(db.String(100))                               # host:pid текущего раннера
+    lease_expires_at = db.Column(db.DateTime(timezone=True))
+
+
+class SalesDaily(db.Model):
+    """Свёртка продаж по дням (по московской дате оплаты): валюта × метод оплаты × агрегатор"""
+    __tablename__ = "sales_daily"
+    day = db.Column(db.Date, primary_key=True)
+    currency = db.Column(db.String(5), primary_key=True)
+    method_pay = db.Column(db.String(50), primary_key=True)
+    aggregator_pay = db.Column(db.String(50), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    amount_in = db.Column(db.Float, nullable=False, default=0)
+    amount_out = db.Column(db.Float, nullable=False, default=0)
+
+
+class SalesProductMonthly(db.Model):
+    """Свёртка продаж по товарам за месяц (month — первое число месяца) в разрезе валюты"""
+    __tablename__ = "sales_product_monthly"
+    month = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.BigInteger, primary_key=True)
+    currency = db.Column(db.String(5), primary_key=True)
+    product_name = db.Column(db.String(255))                              # последнее встреченное название
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    amount_in = db.Column(db.Float, nullable=False, default=0)
+    amount_out = db.Column(db.Float, nullable=False, default=0)
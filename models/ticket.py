@@ -9,6 +9,7 @@ class Ticket(db.Model):
     __tablename__ = "ticket"
     __table_args__ = (
         db.Index('idx_ticket_order_number', 'order_number'),
+        db.Index('idx_ticket_status_created', 'status_id', 'created_at'),
     )
     id = db.Column(db.Integer, primary_key=True)
     sales_id = db.Column(db.Integer, db.ForeignKey("sales.id"), nullable=True)
@@ -46,6 +47,14 @@ class Ticket(db.Model):
     )
 
 
+# Архив на дашборде листается по (coalesce(closed_at, created_at), id)
+db.Index(
+    'idx_ticket_closed_sort',
+    db.func.coalesce(Ticket.closed_at, Ticket.created_at),
+    Ticket.id,
+)
+
+
 class Status(db.Model):
     __tablename__ = "status" 
     id = db.Column(db.Integer, primary_key=True)
@@ -58,6 +67,9 @@ class Status(db.Model):
 
 
 class TicketMessage(db.Model):
+    __table_args__ = (
+        db.Index('idx_ticket_message_ticket_created', 'ticket_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=True)
     ticket_id = db.Column(
@@ -80,6 +92,7 @@ class TicketMessage(db.Model):
 class TicketMessageAttachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     filename = db.Column(db.String(256), nullable=False)
+    original_name = db.Column(db.String(256))
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('ticket_message.id', ondelete='CASCADE'),
@@ -88,5 +101,5 @@ class TicketMessageAttachment(db.Model):
 
     @property
     def url(self):
-        return url_for('static', filename='uploads/' + self.filename)
+        return url_for('media.serve_upload', name=self.filename)
 
@@ -0,0 +1,19 @@
+from extensions import db
+
+
+class TicketStatusCounter(db.Model):
+    """Сколько тикетов сейчас в каждом статусе (поддерживается при коммите, см. services.ticket_metrics)"""
+    __tablename__ = "ticket_status_counter"
+    status_id = db.Column(db.Integer, primary_key=True)
+    tickets = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TicketCloseBucket(db.Model):
+    """
+    Гистограмма времени до закрытия (closed_at - created_at) по закрытым
+    сейчас тикетам: число тикетов и сумма секунд в корзине ≤ le секунд.
+    """
+    __tablename__ = "ticket_close_bucket"
+    le = db.Column(db.Integer, primary_key=True)        # верхняя граница корзины, секунды
+    tickets = db.Column(db.Integer, nullable=False, default=0)
+    seconds = db.Column(db.Float, nullable=False, default=0)
@@ -2,6 +2,11 @@ from datetime import datetime, timezone
 from extensions import db
 
 class TicketView(db.Model):
+    """Когда пользователь последний раз открывал тикет; пишется пачками (services.ticket_views)"""
+    __table_args__ = (
+        # Одна строка на пару: на этот индекс опирается upsert при сбросе буфера
+        db.Index('uq_ticket_view_user_ticket', 'user_id', 'ticket_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(
         db.Integer,
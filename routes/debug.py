@@ -0,0 +1,30 @@
+from flask import Blueprint, abort, jsonify, redirect, render_template, request, url_for
+from flask_login import login_required, current_user
+from services.profiler import profiler
+
+debug_bp = Blueprint('debug', __name__, url_prefix='/debug')
+
+ORDERINGS = {'db': 'db_ms', 'queries': 'queries', 'duration': 'duration_ms'}
+
+
+@debug_bp.before_request
+@login_required
+def _admin_only():
+    if not current_user.is_admin:
+        abort(403)
+
+
+@debug_bp.route('/perf')
+def perf():
+    """Последние профили запросов этого процесса, самые дорогие сверху"""
+    order = request.args.get('order', 'db')
+    profiles = [p.as_dict() for p in profiler.recent(ORDERINGS.get(order, 'db_ms'))]
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(enabled=profiler.enabled, sample_rate=profiler.sample_rate, requests=profiles)
+    return render_template('debug_perf.html', profiles=profiles, order=order, profiler=profiler)
+
+
+@debug_bp.route('/perf/clear', methods=['POST'])
+def perf_clear():
+    profiler.clear()
+    return redirect(url_for('debug.perf'))
@@ -0,0 +1,90 @@
+import mimetypes
+import os
+import posixpath
+import re
+from flask import Blueprint, abort, current_app, make_response, request, send_file
+from flask_login import login_required
+from werkzeug.security import safe_join
+
+media_bp = Blueprint('media', __name__, url_prefix='/media')
+
+# ab/cd/<sha256>.png и производные thumbs/ab/cd/<sha256>_320.webp: содержимое по имени не меняется
+CONTENT_ADDRESSED_RE = re.compile(r"^(?:thumbs/)?[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64}(?:_\d+)?)(?:\.[a-z0-9]+)?$")
+# Показываем в браузере только растровые картинки; всё остальное (html, svg, ...) — скачиванием
+INLINE_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+
+def _safe_headers(response, mimetype, name):
+    # Браузер не угадывает тип по содержимому: файл не станет HTML на нашем домене
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    if mimetype not in INLINE_TYPES:
+        response.headers['Content-Disposition'] = f'attachment; filename="{os.path.basename(name)}"'
+    return response
+
+
+def _cache_headers(response, etag):
+    if etag:
+        # Имя от хэша содержимого: браузер может не перепроверять файл вообще
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = current_app.config['MEDIA_MAX_AGE']
+        response.cache_control.immutable = True
+    else:
+        # Старые плоские имена могли перезаписываться — только с перепроверкой
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+
+@media_bp.route('/<path:name>')
+@login_required
+def serve_upload(name):
+    """
+    Вложения и аватары из UPLOAD_FOLDER. С MEDIA_SENDFILE=x-accel отдачу
+    байтов берёт на себя nginx (X-Accel-Redirect), с x-sendfile — Apache/lighttpd.
+    Иначе send_file: ETag, If-None-Match/If-Modified-Since и Range.
+    """
+    if name.startswith('.'):
+        abort(404)
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], name)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    match = CONTENT_ADDRESSED_RE.match(name)
+    etag = match.group(1) if match else None
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    if current_app.config['MEDIA_SENDFILE'] == 'x-accel':
+        if etag and etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            response = make_response('')
+            response.headers['X-Accel-Redirect'] = current_app.config['MEDIA_ACCEL_PREFIX'].rstrip('/') + '/' + name
+            response.mimetype = mimetype
+        if etag:
+            response.set_etag(etag)
+        return _cache_headers(_safe_headers(response, mimetype, name), etag)
+
+    # X-Sendfile send_file ставит сам (USE_X_SENDFILE), условные и Range-запросы — тоже
+    response = send_file(path, mimetype=mimetype, etag=etag or True, conditional=True, max_age=None)
+    return _cache_headers(_safe_headers(response, mimetype, name), etag)
+
+
+def protect_static_uploads(app):
+    """
+    Если UPLOAD_FOLDER оставлен внутри static/ (старый путь static/uploads),
+    файлы оттуда отдавались бы /static/... без входа — закрываем этот префикс.
+    """
+    static = os.path.realpath(app.static_folder)
+    upload = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    if upload != static and not upload.startswith(static + os.sep):
+        return
+    prefix = os.path.relpath(upload, static).replace(os.sep, '/')
+    prefix = '' if prefix == '.' else prefix + '/'
+
+    @app.before_request
+    def _deny_static_uploads():
+        if request.endpoint == 'static':
+            filename = posixpath.normpath((request.view_args or {}).get('filename', ''))
+            if (filename + '/').startswith(prefix):
+                abort(404)
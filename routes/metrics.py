@@ -0,0 +1,24 @@
+import hmac
+from flask import Blueprint, Response, abort, current_app, request
+from prometheus_client import CONTENT_TYPE_LATEST
+from services import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics')
+def export():
+    """
+    Метрики для Prometheus, нужен заголовок Authorization: Bearer <METRICS_TOKEN>.
+    Без токена эндпоинт открыт только в debug и тестах.
+    """
+    if not current_app.config['METRICS_ENABLED']:
+        abort(404)
+    token = current_app.config['METRICS_TOKEN']
+    if not token:
+        if not (current_app.debug or current_app.testing):
+            abort(403)
+    elif not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        abort(403)
+    # content_type, а не mimetype: в CONTENT_TYPE_LATEST уже есть charset, Werkzeug добавил бы второй
+    return Response(metrics.render(), content_type=CONTENT_TYPE_LATEST)
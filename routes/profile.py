@@ -1,23 +1,24 @@
-import os
-import uuid
-from flask import Blueprint, render_template, redirect, url_for, request, flash, current_app
+from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 from extensions import db
 from forms.profile_forms import ProfileForm, StatusForm
 from forms.auth_forms import RegisterForm
 from werkzeug.security import generate_password_hash, check_password_hash
-from models.ticket import Status
+from services.status_registry import statuses
+from services import storage, thumbnails, user_cache
 
 profile_bp = Blueprint('profile', __name__)
 
 
-def save_avatar(file):
-    filename = secure_filename(file.filename)
-    unique_name = f"{uuid.uuid4().hex}_{filename}"
-    filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], unique_name)
-    file.save(filepath)
-    return f'uploads/{unique_name}'
+def save_avatar(user, file):
+    # Аватар хранится как вложение (по хэшу содержимого), прежний отпускаем;
+    # квадратные уменьшенные копии строятся в фоне
+    name = storage.store_upload(file)
+    thumbnails.schedule(name, thumbnails.AVATAR_KINDS)
+    old_name = thumbnails.avatar_upload_name(user.avatar)
+    if old_name:
+        storage.release(old_name)
+    return f'uploads/{name}'
 
 
 
@@ -27,13 +28,14 @@ def profile():
     form = ProfileForm()
     register_form = RegisterForm()
     status_form = StatusForm()
+    user = user_cache.record(current_user)
 
     if form.validate_on_submit():
-        current_user.display_name = form.display_name.data
+        user.display_name = form.display_name.data
         if 'avatar' in request.files:
             avatar_file = request.files['avatar']
             if avatar_file.filename != '':
-                current_user.avatar = save_avatar(avatar_file)
+                user.avatar = save_avatar(user, avatar_file)
         db.session.commit()
         flash('Профиль обновлен', 'success')
         return redirect(url_for('profile.profile'))
@@ -41,14 +43,13 @@ def profile():
         form.display_name.data = current_user.display_name
 
     # вот это добавляем:
-    statuses = Status.query.all()
-
     return render_template(
         'profile.html',
+        user=user,
         form=form,
         register_form=register_form,
         status_form=status_form,
-        statuses=statuses   # ← передаём список статусов
+        statuses=statuses.all()   # ← передаём список статусов
     )
 
 
@@ -58,7 +59,8 @@ def change_avatar():
     if 'avatar' in request.files:
         avatar_file = request.files['avatar']
         if avatar_file.filename != '':
-            current_user.avatar = save_avatar(avatar_file)
+            user = user_cache.record(current_user)
+            user.avatar = save_avatar(user, avatar_file)
             db.session.commit()
             flash('Аватар обновлен', 'success')
         else:
@@ -76,7 +78,8 @@ def change_password():
     new_password = request.form.get('new_password')
     confirm_password = request.form.get('confirm_password')
 
-    if not check_password_hash(current_user.password, current_password):
+    user = user_cache.record(current_user)
+    if not check_password_hash(user.password, current_password):
         flash('Текущий пароль неверен', 'danger')
         return redirect(url_for('profile.profile'))
 
@@ -84,7 +87,7 @@ def change_password():
         flash('Новые пароли не совпадают', 'danger')
         return redirect(url_for('profile.profile'))
 
-    current_user.password = generate_password_hash(new_password)
+    user.password = generate_password_hash(new_password)
     db.session.commit()
 
     flash('Пароль успешно изменен', 'success')
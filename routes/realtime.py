@@ -0,0 +1,48 @@
+from flask_login import current_user
+from flask_socketio import join_room, leave_room
+from extensions import socketio
+from services.metrics import SOCKETIO_CLIENTS
+from services.realtime import DASHBOARD_ROOM, ticket_room, user_room
+
+
+def _rooms_from(data):
+    """Комнаты из запроса клиента: {"ticket_id": 5} и/или {"dashboard": true}"""
+    data = data if isinstance(data, dict) else {}
+    rooms = []
+    try:
+        if data.get('ticket_id') is not None:
+            rooms.append(ticket_room(int(data['ticket_id'])))
+    except (TypeError, ValueError):
+        pass
+    if data.get('dashboard'):
+        rooms.append(DASHBOARD_ROOM)
+    return rooms
+
+
+@socketio.on('connect')
+def on_connect(auth=None):
+    # Анонимам сокет не нужен: все события — про тикеты
+    if not current_user.is_authenticated:
+        return False
+    join_room(user_room(current_user.id))
+    SOCKETIO_CLIENTS.inc()
+
+
+@socketio.on('disconnect')
+def on_disconnect(*args):
+    # Отклонённые соединения сюда не доходят, поэтому счётчик сходится
+    SOCKETIO_CLIENTS.dec()
+
+
+@socketio.on('join')
+def on_join(data):
+    if not current_user.is_authenticated:
+        return
+    for room in _rooms_from(data):
+        join_room(room)
+
+
+@socketio.on('leave')
+def on_leave(data):
+    for room in _rooms_from(data):
+        leave_room(room)
@@ -1,33 +1,35 @@
-from flask import Blueprint, render_template, request
-from sqlalchemy import or_
-from extensions import db
+from flask import Blueprint, render_template, request, current_app, jsonify
+from flask_login import login_required
 from models.ticket import Ticket
-from models.sales import Sale, SalesLog   # ваша модель платежей
 from forms.sales_forms import SalesSearchForm  # создадим форму поиска
+from services import sales_search, sales_rollup, sales_log as loader_log
 
 sales_bp = Blueprint('sales', __name__)
 
 @sales_bp.route('/sales/search', methods=['GET', 'POST'])
 def search_sales():
     form = SalesSearchForm()
-    results = []
+    page = None
+    kind = None
+    search_term = ''
     tickets_by_invoice = {}   # ← сразу инициализируем
 
-    if form.validate_on_submit():
+    # GET ?q=...&after=... — листание уже найденной выдачи
+    if request.method == 'GET' and request.args.get('q'):
+        form.query.data = request.args['q']
+
+    if form.validate_on_submit() or (request.method == 'GET' and form.query.data):
         search_term = form.query.data.strip()
+        kind, page = sales_search.search_sales(
+            search_term,
+            per_page=current_app.config['SALES_SEARCH_PAGE_SIZE'],
+            count_cap=current_app.config['SALES_SEARCH_COUNT_CAP'],
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+        )
 
-        results = db.session.query(Sale).filter(
-            or_(
-                Sale.invoice_id.ilike(f"%{search_term}%"),
-                Sale.product_name.ilike(f"%{search_term}%"),
-                Sale.product_entry.ilike(f"%{search_term}%"),
-                Sale.email.ilike(f"%{search_term}%"),
-                Sale.ip.ilike(f"%{search_term}%")
-            )
-        ).order_by(Sale.date_pay.desc()).all()
-            
-        if results:
-            invoice_ids = [s.invoice_id for s in results]
+        if page.items:
+            invoice_ids = [s.invoice_id for s in page.items]
             tickets_by_invoice = {
                 t.order_number.strip(): t.id
                 for t in Ticket.query.filter(Ticket.order_number.in_(invoice_ids)).all()
@@ -36,12 +38,66 @@ def search_sales():
     return render_template(
         "search_sales_result.html",
         form=form,
-        results=results,
+        page=page,
+        results=page.items if page else [],
+        kind_label=sales_search.KIND_LABELS.get(kind),
+        search_term=search_term,
         tickets_by_invoice=tickets_by_invoice
     )
 
 
 @sales_bp.route("/sales-log")
+@login_required
 def sales_log():
-    logs = SalesLog.query.order_by(SalesLog.timestamp.desc()).all()
-    return render_template("sales_log.html", logs=logs)
\ No newline at end of file
+    """Проходы загрузчика по страницам (keyset), с фильтрами; view=daily — итоги сжатых дней"""
+    per_page = current_app.config['SALES_LOG_PAGE_SIZE']
+    after, before = request.args.get('after'), request.args.get('before')
+    filters = {
+        'status': request.args.get('status') or '',
+        'errors': request.args.get('errors') or '',
+        'date_from': request.args.get('date_from') or '',
+        'date_to': request.args.get('date_to') or '',
+    }
+    view = request.args.get('view') or 'runs'
+    if view == 'daily':
+        page = loader_log.list_daily(per_page, after=after, before=before)
+    else:
+        page = loader_log.list_runs(
+            per_page,
+            status=filters['status'],
+            errors_only=bool(filters['errors']),
+            date_from=filters['date_from'],
+            date_to=filters['date_to'],
+            after=after,
+            before=before,
+        )
+    return render_template(
+        "sales_log.html",
+        page=page,
+        view=view,
+        filters=filters,
+        active_filters={k: v for k, v in filters.items() if v},
+        status_labels=loader_log.STATUS_LABELS,
+        error_kinds=loader_log.ERROR_KINDS,
+        retention_days=current_app.config['SALES_LOG_RETENTION_DAYS'],
+    )
+
+
+def _analytics_args():
+    months = request.args.get('months', 12, type=int)
+    return max(1, min(months, current_app.config['SALES_ANALYTICS_MAX_MONTHS'])), request.args.get('currency')
+
+
+@sales_bp.route("/sales/analytics")
+@login_required
+def sales_analytics():
+    months, currency = _analytics_args()
+    return render_template("sales_analytics.html", months=months, currency=currency)
+
+
+@sales_bp.route("/sales/analytics/data")
+@login_required
+def sales_analytics_data():
+    """Выручка по дням и месяцам, по методам оплаты, агрегаторам и товарам — только из свёрток"""
+    months, currency = _analytics_args()
+    return jsonify(sales_rollup.analytics(months, currency))
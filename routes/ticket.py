@@ -1,28 +1,45 @@
-import os
-import uuid
 from flask import Blueprint, render_template, redirect, url_for, request, flash, abort, current_app
 from flask_login import login_required, current_user
-from werkzeug.utils import secure_filename
 from datetime import datetime, timezone
-from extensions import db, socketio
+from extensions import db
 from forms.profile_forms import StatusForm
 from models.ticket import Ticket, TicketMessage, TicketMessageAttachment, Status
 from models.attachment import TicketAttachment
-from models.ticket_view import TicketView
 from models.sales import Sale
+from services.dashboard import get_open_tickets_page, get_closed_tickets_page
+from services import ticket_metrics
+from services import search as ticket_search
+from services import storage, thumbnails
+from services.tickets import delete_tickets
+from services.ticket_views import views
+from services.uploads import claim_uploads
+from routes.uploads import handle_upload_request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from services.status_registry import statuses
+from services.pagination import KeysetPage
+from services.realtime import notify_new_message
+from services.purchase_history import get_purchase_page, get_purchase_totals, tickets_for_invoices
 from forms.ticket_forms import TicketForm, MessageForm, EditTicketForm, TicketSearchForm
-from sqlalchemy import or_, func
+from sqlalchemy.orm import joinedload, selectinload
 from flask import jsonify
-import base64
 
 ticket_bp = Blueprint('ticket', __name__)
 
 
+def wants_json():
+    return request.accept_mimetypes.best == 'application/json'
+
+
+def attach_uploads(model, **owner):
+    """Прикрепляет файлы, заранее загруженные через /uploads (поле upload_ids формы)"""
+    for upload in claim_uploads(request.form.getlist('upload_ids'), current_user.id):
+        db.session.add(model(filename=upload.filename, original_name=upload.original_name, **owner))
+
+
 def save_file(file):
-    filename = secure_filename(file.filename)
-    upload_dir = current_app.config['UPLOAD_FOLDER']
-    os.makedirs(upload_dir, exist_ok=True)
-    file.save(os.path.join(upload_dir, filename))
+    # Файл ложится под путь от хэша содержимого, одинаковые загрузки не дублируются
+    filename = storage.store_upload(file)
+    thumbnails.schedule(filename, thumbnails.ATTACHMENT_KINDS)
     return filename
 
 
@@ -30,45 +47,55 @@ def save_file(file):
 @ticket_bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Получаем "открытые" статусы, кроме категории final
-    open_statuses = Status.query.filter(
-        Status.category != 'final'
-    ).all()
-    open_status_ids = [s.id for s in open_statuses]
-
-    # Открытые тикеты
-    open_tickets = Ticket.query.filter(Ticket.status_id.in_(open_status_ids)).order_by(Ticket.created_at.desc()).all()
-
-    # Закрытые тикеты (не в категории final)
-    closed_statuses = Status.query.filter(Status.category == 'final').all()
-    closed_status_ids = [s.id for s in closed_statuses]
-    closed_tickets = Ticket.query.filter(Ticket.status_id.in_(closed_status_ids)).order_by(Ticket.closed_at.desc()).all()
-
-    # Подсветка новых/обновлённых тикетов
-    ticket_highlights = {}
-    for ticket in open_tickets:
-        view = TicketView.query.filter_by(ticket_id=ticket.id, user_id=current_user.id).first()
-        ticket_highlights[ticket.id] = not view or (ticket.updated_at and ticket.updated_at > view.last_viewed_at)
+    per_page = current_app.config['DASHBOARD_PAGE_SIZE']
+    # Активные тикеты — тоже постранично, со своими курсорами open_after/open_before
+    open_pagination, ticket_highlights, message_counts = get_open_tickets_page(
+        current_user.id,
+        per_page,
+        after=request.args.get('open_after'),
+        before=request.args.get('open_before'),
+    )
+
+    # Закрытые тикеты (категория final) — постранично, по курсору
+    pagination, closed_counts = get_closed_tickets_page(
+        per_page,
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+    )
+    message_counts.update(closed_counts)
+    metrics = ticket_metrics.snapshot()
 
     return render_template(
         'dashboard.html',
-        open_tickets=open_tickets,
-        closed_tickets=closed_tickets,
-        ticket_highlights=ticket_highlights
+        open_tickets=open_pagination.items,
+        open_pagination=open_pagination,
+        closed_tickets=pagination.items,
+        closed_total=metrics['final'],
+        metrics=metrics,
+        ticket_highlights=ticket_highlights,
+        message_counts=message_counts,
+        pagination=pagination
     )
 
 
+@ticket_bp.route('/tickets/metrics')
+@login_required
+def tickets_metrics():
+    """Счётчики по статусам и группам, время до закрытия — из materialized-таблиц"""
+    return jsonify(ticket_metrics.snapshot())
+
+
 @ticket_bp.route('/new_ticket', methods=['GET', 'POST'])
 @login_required
 def new_ticket():
     form = TicketForm()
 
     # Берём только статусы из категории "reason"
-    reason_statuses = Status.query.filter_by(category='reason').all()
+    reason_statuses = statuses.by_category('reason')
     form.status.choices = [(s.id, s.label) for s in reason_statuses]
 
     if form.validate_on_submit():
-        status_obj = Status.query.get(form.status.data)
+        status_obj = statuses.get(form.status.data)
 
         sale = Sale.query.filter_by(invoice_id=form.order_number.data.strip()).first()
         
@@ -79,7 +106,7 @@ def new_ticket():
             product=form.product.data,
             reason=form.reason.data,
             user_id=current_user.id,
-            status=status_obj,
+            status_id=status_obj.id,
             sales_id=sale.id if sale else None
         )
         db.session.add(ticket)
@@ -89,8 +116,9 @@ def new_ticket():
         for file in files:
             if file.filename != '':
                 filename = save_file(file)
-                attachment = TicketAttachment(filename=filename, ticket_id=ticket.id)
+                attachment = TicketAttachment(filename=filename, original_name=file.filename[:256], ticket_id=ticket.id)
                 db.session.add(attachment)
+        attach_uploads(TicketAttachment, ticket_id=ticket.id)
         db.session.commit()
 
         flash('Тикет успешно создан!', 'success')
@@ -102,29 +130,16 @@ def new_ticket():
 @ticket_bp.route('/ticket/<int:ticket_id>', methods=['GET', 'POST'])
 @login_required
 def view_ticket(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    # Тикет, статус, сообщения с авторами и вложениями — фиксированным числом запросов
+    ticket = Ticket.query.options(
+        joinedload(Ticket.status),
+        joinedload(Ticket.author),
+        selectinload(Ticket.images),
+        selectinload(Ticket.messages).joinedload(TicketMessage.author),
+        selectinload(Ticket.messages).selectinload(TicketMessage.attachments),
+    ).filter_by(id=ticket_id).first_or_404()
     form = MessageForm()
 
-    # --- Обновление информации о просмотре тикета ---
-    view = TicketView.query.filter_by(ticket_id=ticket.id, user_id=current_user.id).first()
-    if not view:
-        view = TicketView(ticket_id=ticket.id, user_id=current_user.id)
-        db.session.add(view)
-    view.last_viewed_at = datetime.now(timezone.utc)
-    db.session.commit()
-
-    # История покупок пользователя по email
-    user_sales = Sale.query.filter_by(email=ticket.customer_email)\
-        .order_by(Sale.date_pay.desc()).all()
-    
-    # Лист тикетов по номерам заказов
-    tickets_by_invoice = {
-    t.order_number.strip(): t.id 
-    for t in Ticket.query.filter(Ticket.order_number.in_([s.invoice_id for s in user_sales])).all()
-}
-    # Общая сумма покупок
-    total_amount = sum(s.amount_in for s in user_sales)
-    currency = user_sales[0].amount_currency if user_sales else ''
     if form.validate_on_submit():
 
         # Создаем сообщение
@@ -143,35 +158,96 @@ def view_ticket(ticket_id):
                     filename = save_file(file)
                     attachment = TicketMessageAttachment(
                         filename=filename,
+                        original_name=file.filename[:256],
                         message_id=message.id
                     )
                     db.session.add(attachment)
-            db.session.commit()
+        attach_uploads(TicketMessageAttachment, message_id=message.id)
+        db.session.commit()
 
         ticket.updated_at = datetime.now(timezone.utc)
         db.session.commit()
-        socketio.emit("new_message", {
-            "ticket_id": ticket.id,
-            "author": current_user.display_name or current_user.username,
-            "avatar": url_for('static', filename=current_user.avatar or "img/default-avatar.png"),
-            "message_id": message.id,
-        }, to=None)  # None = всем      
-        print("EMIT: new_message", ticket.id)
+        views.record(current_user.id, ticket.id)
+        notify_new_message(ticket, message, current_user)
+
+        # Чат отправляет форму через fetch и сам дочитывает новые сообщения
+        if wants_json():
+            return jsonify(ok=True, message_id=message.id)
         flash('Сообщение отправлено', 'success')
         return redirect(url_for('ticket.view_ticket', ticket_id=ticket.id))
 
-    all_statuses = Status.query.all()
+    if request.method == 'POST' and wants_json():
+        # Чат показывает ошибки сам и не очищает форму
+        return jsonify(ok=False, errors=form.errors), 400
 
-    return render_template(
+    all_statuses = statuses.all()
+
+    html = render_template(
     'ticket_view/ticket_view.html',
     ticket=ticket,
     form=form,
-    all_statuses=all_statuses,
-    user_sales=user_sales,
-    tickets_by_invoice=tickets_by_invoice,
-    total_amount=total_amount,
-    currency=currency
+    all_statuses=all_statuses
 )
+    # Просмотр попадает в буфер и пишется в БД пачкой (services.ticket_views)
+    views.record(current_user.id, ticket.id)
+    return html
+
+
+@ticket_bp.route('/ticket/<int:ticket_id>/messages')
+@login_required
+def ticket_messages(ticket_id):
+    """
+    Только сообщения после after_id — для дочитывания чата без перезагрузки.
+    Берём старейшие CHAT_FETCH_LIMIT после after_id; has_more — клиент
+    запрашивает следующую порцию, пока не догонит.
+    """
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = current_app.config['CHAT_FETCH_LIMIT']
+    messages = (
+        TicketMessage.query
+        .options(joinedload(TicketMessage.author), selectinload(TicketMessage.attachments))
+        .filter(TicketMessage.ticket_id == ticket_id, TicketMessage.id > after_id)
+        .order_by(TicketMessage.id.asc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    # В чате новые сверху
+    html = ''.join(render_template('ticket_view/_message.html', message=m) for m in reversed(messages))
+    return jsonify(
+        html=html,
+        last_id=messages[-1].id if messages else after_id,
+        count=len(messages),
+        has_more=has_more
+    )
+
+
+@ticket_bp.route('/ticket/<int:ticket_id>/purchases')
+@login_required
+def purchase_history(ticket_id):
+    """История покупок клиента тикета: подгружается отдельно, постранично"""
+    row = db.session.query(Ticket.customer_email).filter_by(id=ticket_id).first()
+    if row is None:
+        abort(404)
+    email = row.customer_email
+
+    after = request.args.get('after')
+    if email:
+        page = get_purchase_page(email, current_app.config['PURCHASE_HISTORY_PAGE_SIZE'], after=after)
+        totals = [] if after else get_purchase_totals(email)
+    else:
+        page, totals = KeysetPage([]), []
+    tickets_by_invoice = tickets_for_invoices([s.invoice_id for s in page.items])
+
+    return jsonify(
+        # Итоги нужны только с первой страницей
+        totals_html=None if after else render_template('ticket_view/_purchase_totals.html', totals=totals),
+        rows_html=render_template(
+            'ticket_view/_purchase_rows.html', sales=page.items, tickets_by_invoice=tickets_by_invoice
+        ),
+        next_cursor=page.next_cursor
+    )
 
 
 
@@ -182,12 +258,11 @@ def edit_ticket(ticket_id):
     form = EditTicketForm()
 
     # 1) Подтянем статусы в choices (value=id, label=читаемое имя)
-    statuses = Status.query.order_by(Status.id).all()
-    form.status.choices = [(s.id, s.label) for s in statuses]
+    form.status.choices = [(s.id, s.label) for s in statuses.all()]
 
     if form.validate_on_submit():
-        old_status_obj = ticket.status  # объект Status до изменения
-        new_status_obj = next((s for s in statuses if s.id == form.status.data), None)
+        old_status_obj = statuses.get(ticket.status_id)  # статус до изменения
+        new_status_obj = statuses.get(form.status.data)
 
         if new_status_obj is None:
             flash('Некорректный статус.', 'danger')
@@ -199,8 +274,8 @@ def edit_ticket(ticket_id):
         ticket.customer_email = form.customer_email.data
         ticket.reason = form.reason.data
 
-        # 3) Обновляем статус через relationship (и, как следствие, status_id)
-        ticket.status = new_status_obj
+        # 3) Обновляем статус (снимки из реестра — не ORM-объекты, меняем status_id)
+        ticket.status_id = new_status_obj.id
 
         # 4) Логика closed_at: сравниваем по техническому имени статуса
         old_name = (old_status_obj.name if old_status_obj else None)
@@ -216,7 +291,8 @@ def edit_ticket(ticket_id):
             for img in form.images.data:
                 if img and getattr(img, 'filename', ''):
                     filename = save_file(img)  # ваша функция сохранения
-                    db.session.add(TicketAttachment(filename=filename, ticket_id=ticket.id))
+                    db.session.add(TicketAttachment(filename=filename, original_name=img.filename[:256], ticket_id=ticket.id))
+        attach_uploads(TicketAttachment, ticket_id=ticket.id)
 
         ticket.updated_at = datetime.now(timezone.utc)
         db.session.commit()
@@ -243,6 +319,8 @@ def delete_message(message_id):
         abort(403)
 
     ticket_id = message.ticket_id
+    for att in message.attachments:
+        storage.release(att.filename)
     db.session.delete(message)
     db.session.commit()
     flash('Сообщение удалено', 'success')
@@ -258,13 +336,12 @@ def change_status(ticket_id):
     if not new_status_id:
         abort(400)
 
-    status_obj = Status.query.get(new_status_id)
+    status_obj = statuses.get(new_status_id)
     if not status_obj:
         abort(400)
 
-    status_obj = Status.query.get(request.form.get('new_status_id'))
-    old_status = ticket.status  # ticket.status – объект Status
-    ticket.status = status_obj
+    old_status = statuses.get(ticket.status_id)
+    ticket.status_id = status_obj.id
 
     if old_status and old_status.name != 'closed' and status_obj.name == 'closed':
         ticket.closed_at = datetime.now(timezone.utc)
@@ -297,65 +374,65 @@ def manage_statuses():
         flash("Статус добавлен", "success")
         return redirect(url_for('profile.profile'))
 
-    statuses = Status.query.all()
     return redirect(url_for('profile.profile'))
 
 
 @ticket_bp.route('/tickets/search', methods=['GET', 'POST'])
+@login_required
 def search_tickets():
     form = TicketSearchForm()
-    results = []
+    page = None
+    search_term = ''
 
-    if form.validate_on_submit():
-        search_term = form.query.data.strip()
+    # GET ?q=...&after=... — следующая страница той же выдачи
+    if request.method == 'GET' and request.args.get('q'):
+        form.query.data = request.args['q']
 
-        # Поиск по полям Ticket и связанным TicketMessage
-        results = db.session.query(Ticket).outerjoin(TicketMessage).filter(
-            or_(
-                Ticket.order_number.ilike(f"%{search_term}%"),
-                Ticket.customer_email.ilike(f"%{search_term}%"),
-                Ticket.product.ilike(f"%{search_term}%"),
-                Ticket.reason.ilike(f"%{search_term}%"),
-                TicketMessage.content.ilike(f"%{search_term}%")
-            )
-        ).distinct().all()
+    if form.validate_on_submit() or (request.method == 'GET' and form.query.data):
+        search_term = form.query.data.strip()
+        page = ticket_search.search_tickets(
+            search_term,
+            current_app.config['SEARCH_PAGE_SIZE'],
+            after=request.args.get('after'),
+        )
 
-    return render_template('search_result.html', form=form, results=results)
+    return render_template('search_result.html', form=form, page=page, search_term=search_term)
 
 
 @ticket_bp.route('/ticket/<int:ticket_id>/delete', methods=['POST'])
 @login_required
 def delete_ticket(ticket_id):
-    ticket = Ticket.query.get_or_404(ticket_id)
+    Ticket.query.get_or_404(ticket_id)
 
     if not current_user.is_admin:
         abort(403)
 
-    # Удаляем все связанные TicketView
-    TicketView.query.filter_by(ticket_id=ticket.id).delete()
-
-    # Удаляем вложения сообщений
-    for msg in ticket.messages:
-        for att in msg.attachments:
-            try:
-                os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], att.filename))
-            except Exception:
-                pass
-            db.session.delete(att)
-
-    # Удаляем файлы самого тикета
-    for att in ticket.images:
-        try:
-            os.remove(os.path.join(current_app.config['UPLOAD_FOLDER'], att.filename))
-        except Exception:
-            pass
-        db.session.delete(att)
-
-    # Наконец, удаляем тикет
-    db.session.delete(ticket)
+    delete_tickets([ticket_id])
     db.session.commit()
 
-    flash(f'Тикет #{ticket.id} удалён', 'success')
+    flash(f'Тикет #{ticket_id} удалён', 'success')
+    return redirect(url_for('ticket.dashboard'))
+
+
+@ticket_bp.route('/tickets/delete', methods=['POST'])
+@login_required
+def bulk_delete_tickets():
+    """Массовое удаление: ticket_ids в форме (несколько значений) или JSON-список"""
+    if not current_user.is_admin:
+        abort(403)
+
+    raw_ids = (request.get_json(silent=True) or {}).get('ticket_ids') if request.is_json else request.form.getlist('ticket_ids')
+    try:
+        ticket_ids = [int(i) for i in raw_ids or []]
+    except (TypeError, ValueError):
+        abort(400)
+
+    deleted = delete_tickets(ticket_ids)
+    db.session.commit()
+
+    if wants_json():
+        return jsonify(deleted=deleted)
+    flash(f'Удалено тикетов: {deleted}', 'success')
     return redirect(url_for('ticket.dashboard'))
 
 @ticket_bp.route('/add_status', methods=['POST'])
@@ -394,17 +471,15 @@ def check_order():
     )
 
 @ticket_bp.route("/upload_from_clipboard/<int:ticket_id>", methods=["POST"])
+@login_required
 def upload_from_clipboard(ticket_id):
-    files = request.files.getlist("image")  # может быть несколько файлов
-    urls = []
-
-    for file in files:
-        ext = os.path.splitext(file.filename)[1] or ".png"
-        filename = f"{uuid.uuid4().hex}{ext}"
-        save_path = os.path.join(current_app.static_folder, "uploads", filename)
-        filename = f"{uuid.uuid4().hex}{ext}"
-        print("Saving clipboard file as:", filename)
-        file.save(save_path)
-        urls.append(url_for('static', filename=f"uploads/{filename}"))
-
-    return {"urls": urls}  # можно возвращать список всех файлов
\ No newline at end of file
+    """Старый эндпоинт вставки из буфера: тот же потоковый приём, что и /uploads"""
+    try:
+        uploads = handle_upload_request()
+    except (RequestEntityTooLarge, BadRequest) as e:
+        db.session.rollback()
+        return jsonify(error=e.description), e.code
+    return {
+        "urls": [url_for('media.serve_upload', name=upload.filename) for upload in uploads],
+        "upload_ids": [upload.id for upload in uploads],
+    }
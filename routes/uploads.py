@@ -0,0 +1,48 @@
+from flask import Blueprint, current_app, jsonify, request, url_for
+from flask_login import login_required, current_user
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from extensions import db
+from services.thumbnails import thumbnail_url
+from services.uploads import receive_uploads
+
+uploads_bp = Blueprint('uploads', __name__, url_prefix='/uploads')
+
+
+def handle_upload_request():
+    """Общий приём файлов для /uploads и старого /upload_from_clipboard"""
+    uploads = receive_uploads(
+        request.environ,
+        current_user.id,
+        max_file_size=current_app.config['UPLOAD_MAX_FILE_SIZE'],
+        max_files=current_app.config['UPLOAD_MAX_FILES'],
+        max_request_size=current_app.config['UPLOAD_MAX_REQUEST_SIZE'],
+        allowed_extensions=current_app.config['UPLOAD_ALLOWED_EXTENSIONS'],
+    )
+    db.session.commit()
+    return uploads
+
+
+@uploads_bp.route('', methods=['POST'])
+@login_required
+def upload_files():
+    """
+    Принимает один или несколько файлов (multipart, любое имя поля) и
+    возвращает их id. Эти id потом передаются с сообщением или тикетом
+    в поле upload_ids. Браузер шлёт файлы параллельными запросами.
+    """
+    try:
+        uploads = handle_upload_request()
+    except (RequestEntityTooLarge, BadRequest) as e:
+        db.session.rollback()
+        return jsonify(error=e.description), e.code
+
+    return jsonify(uploads=[
+        {
+            'id': upload.id,
+            'name': upload.original_name,
+            'size': upload.size,
+            'url': url_for('media.serve_upload', name=upload.filename),
+            'thumb_url': thumbnail_url(upload.filename),
+        }
+        for upload in uploads
+    ])
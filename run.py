@@ -1,6 +1,8 @@
 from app import create_app
-
-app = create_app()
+from extensions import socketio
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    # Сервер для разработки; в бою — python serve.py.
+    # create_app только здесь: дочерние процессы пула миниатюр (spawn) заново импортируют этот модуль
+    app = create_app()
+    socketio.run(app, host='0.0.0.0', port=8080, debug=True, allow_unsafe_werkzeug=True)
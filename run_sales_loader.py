@@ -1,10 +1,18 @@
+import logging
 from app import create_app
-from digiseller import configure_digiseller, fetch_sales_v2
+from services import metrics
+from services.sales_sync import configure_from_app, sync_once, runner_id
 
+# Разовый запуск (например, из cron). Для постоянной синхронизации: flask sales sync
 app = create_app()
 with app.app_context():
-    configure_digiseller(
-        app.config['DIGISELLER_SELLER_ID'],
-        app.config['DIGISELLER_API_KEY']
-    )
-    count = fetch_sales_v2()
\ No newline at end of file
+    configure_from_app(app)
+    try:
+        count = sync_once(runner_id(), app.config['SALES_SYNC_LEASE_TTL'], app.config['SALES_SYNC_OVERLAP'])
+        if count is None:
+            logging.warning("Синхронизацию уже выполняет другой раннер")
+    except Exception as e:
+        logging.error(f"Загрузка заказов не удалась: {e}")
+    finally:
+        metrics.push_batch(app.config['METRICS_PUSHGATEWAY'], 'sales_loader')
+        metrics.process_exited()
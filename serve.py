@@ -0,0 +1,230 @@
+"""
+Боевой запуск сервера: python serve.py [--mode eventlet|gevent|threading] [--workers N]
+
+Один воркер — один процесс со своим пулом соединений с БД. При --workers > 1
+воркеры слушают порты port, port+1, ...: перед ними нужен балансировщик со
+sticky sessions (nginx ip_hash) и SOCKETIO_MESSAGE_QUEUE, чтобы события
+Socket.IO доходили до клиентов всех воркеров.
+"""
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from config import Config
+
+MODES = ('eventlet', 'gevent', 'threading')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Боевой сервер Ticket-Site")
+    parser.add_argument('--mode', choices=MODES, default=Config.SERVER_MODE)
+    parser.add_argument('--host', default=Config.SERVER_HOST)
+    parser.add_argument('--port', type=int, default=Config.SERVER_PORT)
+    parser.add_argument('--workers', type=int, default=Config.SERVER_WORKERS)
+    parser.add_argument('--no-warmup', action='store_true', help="не прогревать приложение при старте")
+    return parser.parse_args(argv)
+
+
+def patch_for(mode):
+    """Monkey patching строго до импорта приложения, иначе сокеты и потоки останутся блокирующими"""
+    if mode == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif mode == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+        try:
+            import geventwebsocket  # noqa: F401
+        except ImportError:
+            # Без него gevent-сервер не принимает websocket: клиенты уйдут на long-polling
+            logging.warning("Режим gevent без пакета gevent-websocket: транспорт websocket недоступен")
+
+
+def pool_size_for(workers):
+    """
+    Делим бюджет SERVER_DB_CONNECTIONS между воркерами. Явно заданные
+    DB_POOL_SIZE/DB_MAX_OVERFLOW не трогаем.
+    """
+    if os.environ.get('DB_POOL_SIZE'):
+        return int(os.environ['DB_POOL_SIZE']), Config.DB_MAX_OVERFLOW
+    per_worker = max(2, Config.SERVER_DB_CONNECTIONS // max(1, workers))
+    overflow = int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else per_worker // 4
+    return per_worker - overflow, overflow
+
+
+def warm_up(app):
+    """Открываем соединения пула, грузим справочники и компилируем шаблоны до первого запроса"""
+    from sqlalchemy import text
+    from extensions import db
+    from services.search import index_ready
+    from services.status_registry import statuses
+
+    started = time.monotonic()
+    with app.app_context():
+        size = db.engine.pool.size() if hasattr(db.engine.pool, 'size') else 1
+        connections = [db.engine.connect() for _ in range(size)]
+        for conn in connections:
+            conn.execute(text("SELECT 1"))
+            conn.close()
+        statuses.all()
+        index_ready()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    logging.info(f"Прогрев: {size} соединений, {len(app.jinja_env.list_templates())} шаблонов "
+                 f"за {time.monotonic() - started:.2f} с")
+
+
+def build_app(args, pool_size, overflow):
+    from app import create_app
+
+    # Config уже вычислен при импорте: режим и пул передаём приложению явно, а не через os.environ
+    app = create_app({
+        'SOCKETIO_ASYNC_MODE': args.mode,
+        'DB_POOL_SIZE': pool_size,
+        'DB_MAX_OVERFLOW': overflow,
+    })
+    if not args.no_warmup:
+        warm_up(app)
+    return app
+
+
+def run_threaded(args, pool_size, overflow):
+    """
+    Режим threading: Werkzeug — сервер только для разработки, поэтому отдаём
+    приложение через gunicorn с потоковым воркером gthread (websocket — через
+    simple-websocket). Процессы по-прежнему ведёт run_supervisor, здесь
+    gunicorn держит ровно один воркер; приложение создаётся уже в нём, после fork.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("Режим threading требует пакета gunicorn (и simple-websocket для websocket)")
+
+    class ThreadedServer(BaseApplication):
+        def load_config(self):
+            for key, value in {
+                'bind': f'{args.host}:{args.port}',
+                'workers': 1,
+                'worker_class': 'gthread',
+                'threads': Config.SERVER_THREADS,
+                'accesslog': None,
+            }.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return build_app(args, pool_size, overflow)
+
+    ThreadedServer().run()
+
+
+def run_worker(args):
+    patch_for(args.mode)
+    pool_size, overflow = pool_size_for(args.workers)
+
+    if args.mode == 'threading':
+        logging.info(f"Воркер {os.getpid()}: threading (gunicorn gthread, {Config.SERVER_THREADS} потоков), "
+                     f"{args.host}:{args.port}, пул БД {pool_size}+{overflow}")
+        run_threaded(args, pool_size, overflow)
+        return
+
+    from extensions import socketio
+
+    from services import thumbnails
+
+    app = build_app(args, pool_size, overflow)
+    logging.info(f"Воркер {os.getpid()}: {args.mode} (Socket.IO: {socketio.async_mode}), {args.host}:{args.port}, "
+                 f"пул БД {pool_size}+{overflow}")
+    # SIGTERM от супервизора останавливает сервер штатно: дальше пул миниатюр и atexit (сброс просмотров)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        socketio.run(app, host=args.host, port=args.port, debug=False, use_reloader=False, log_output=False)
+    finally:
+        thumbnails.shutdown()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def prepare_metrics_dir():
+    """
+    Общий каталог метрик воркеров: каждый процесс пишет туда свои значения,
+    /metrics любого воркера суммирует все. Файлы завершившихся процессов
+    удаляем; файлы живых (flask sales sync с тем же каталогом) оставляем.
+    """
+    path = Config.METRICS_MULTIPROC_DIR
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        # counter_<pid>.db, gauge_livesum_<pid>.db, ...
+        pid = name[:-3].rsplit('_', 1)[-1] if name.endswith('.db') else ''
+        if pid.isdigit() and not process_alive(int(pid)):
+            os.remove(os.path.join(path, name))
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = path
+    return path
+
+
+def run_supervisor(args):
+    """Запускает воркеры отдельными процессами и перезапускает упавшие"""
+    if args.workers > 1 and not Config.SOCKETIO_MESSAGE_QUEUE:
+        logging.warning("Несколько воркеров без SOCKETIO_MESSAGE_QUEUE: события Socket.IO не выйдут за пределы процесса")
+    metrics_dir = prepare_metrics_dir()
+    from prometheus_client import multiprocess
+
+    def spawn(index):
+        # Пул делим на число воркеров в родителе: дочерний процесс запускается с --workers 1
+        pool_size, overflow = pool_size_for(args.workers)
+        env = dict(os.environ, DB_POOL_SIZE=str(pool_size), DB_MAX_OVERFLOW=str(overflow))
+        cmd = [sys.executable, os.path.abspath(__file__), '--mode', args.mode, '--host', args.host,
+               '--port', str(args.port + index), '--workers', '1']
+        if args.no_warmup:
+            cmd.append('--no-warmup')
+        return subprocess.Popen(cmd, env=env)
+
+    workers = {index: spawn(index) for index in range(args.workers)}
+    stopping = []
+
+    def _stop(signum, frame):
+        stopping.append(signum)
+        for proc in workers.values():
+            proc.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while not stopping:
+        for index, proc in list(workers.items()):
+            if proc.poll() is not None and not stopping:
+                logging.error(f"Воркер на порту {args.port + index} завершился с кодом {proc.returncode}, перезапускаем")
+                # Gauge умершего процесса (соединения, клиенты Socket.IO) больше не учитываем
+                multiprocess.mark_process_dead(proc.pid, metrics_dir)
+                workers[index] = spawn(index)
+        time.sleep(1)
+
+    for proc in workers.values():
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    args = parse_args(argv)
+    if args.workers > 1:
+        run_supervisor(args)
+    else:
+        run_worker(args)
+
+
+if __name__ == '__main__':
+    main()
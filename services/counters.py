@@ -0,0 +1,41 @@
+from sqlalchemy import case, func, update
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+
+
+def _newer(current, incoming):
+    return case((current.is_(None) | (incoming > current), incoming), else_=current)
+
+
+def increment(conn, model, keys, sums, rows, latest=(), newest=()):
+    """
+    INSERT … ON CONFLICT DO UPDATE, прибавляющий sums к уже накопленным
+    значениям строки с тем же ключом keys. Колонки latest перезаписываются
+    новым значением, если оно не NULL, колонки newest — только большим.
+    Одна команда на пачку rows.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    dialect = conn.dialect.name
+
+    if dialect in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = insert(table)
+        changes = {c: table.c[c] + stmt.excluded[c] for c in sums}
+        changes.update({c: func.coalesce(stmt.excluded[c], table.c[c]) for c in latest})
+        changes.update({c: _newer(table.c[c], stmt.excluded[c]) for c in newest})
+        conn.execute(stmt.on_conflict_do_update(index_elements=list(keys), set_=changes), rows)
+    elif dialect == "mysql":
+        stmt = mysql.insert(table)
+        changes = {c: table.c[c] + stmt.inserted[c] for c in sums}
+        changes.update({c: func.coalesce(stmt.inserted[c], table.c[c]) for c in latest})
+        changes.update({c: _newer(table.c[c], stmt.inserted[c]) for c in newest})
+        conn.execute(stmt.on_duplicate_key_update(changes), rows)
+    else:
+        for row in rows:
+            values = {c: table.c[c] + row[c] for c in sums}
+            values.update({c: func.coalesce(row[c], table.c[c]) for c in latest})
+            values.update({c: _newer(table.c[c], row[c]) for c in newest})
+            result = conn.execute(update(table).where(*(table.c[k] == row[k] for k in keys)).values(values))
+            if result.rowcount == 0:
+                conn.execute(table.insert(), row)
@@ -0,0 +1,96 @@
+from sqlalchemy import func, case
+from sqlalchemy.orm import contains_eager, joinedload
+from extensions import db
+from models.ticket import Ticket, TicketMessage, Status
+from models.ticket_view import TicketView
+from services.pagination import keyset_paginate
+from services.ticket_views import views, seen_since_update
+
+# Ключ сортировки архива: у старых финальных тикетов closed_at может быть пустым
+CLOSED_SORT_KEY = func.coalesce(Ticket.closed_at, Ticket.created_at)
+
+
+def _message_count():
+    return (
+        db.select(func.count(TicketMessage.id))
+        .where(TicketMessage.ticket_id == Ticket.id)
+        .correlate(Ticket)
+        .scalar_subquery()
+    )
+
+
+def get_open_tickets_page(user_id, per_page, after=None, before=None):
+    """
+    Страница активных тикетов с keyset-пагинацией по (created_at, id):
+    статус и автор подгружаются join'ом, число сообщений и флаг
+    "непрочитано" считаются в SQL. Возвращает (page, highlights, message_counts).
+    """
+    # Последний просмотр каждого тикета текущим пользователем
+    last_view = (
+        db.session.query(
+            TicketView.ticket_id.label("ticket_id"),
+            func.max(TicketView.last_viewed_at).label("last_viewed_at"),
+        )
+        .filter(TicketView.user_id == user_id)
+        .group_by(TicketView.ticket_id)
+        .subquery()
+    )
+    unread = case(
+        (last_view.c.last_viewed_at.is_(None), True),
+        (Ticket.updated_at > last_view.c.last_viewed_at, True),
+        else_=False,
+    )
+
+    query = (
+        db.session.query(Ticket, _message_count(), unread)
+        .join(Ticket.status)
+        .outerjoin(last_view, last_view.c.ticket_id == Ticket.id)
+        .filter(Status.category != 'final')
+        .options(contains_eager(Ticket.status), joinedload(Ticket.author))
+    )
+    page = keyset_paginate(
+        query,
+        keys=[Ticket.created_at, Ticket.id],
+        key_of=lambda row: (row[0].created_at, row[0].id),
+        per_page=per_page,
+        after=after,
+        before=before,
+    )
+
+    rows = page.items
+    highlights = {ticket.id: bool(flag) for ticket, _, flag in rows}
+    message_counts = {ticket.id: count for ticket, count, _ in rows}
+    page.items = [ticket for ticket, _, _ in rows]
+    # Свои просмотры тикетов этой страницы, ещё не сброшенные из буфера в ticket_view
+    pending = views.pending_for(user_id)
+    if pending:
+        for ticket in page.items:
+            viewed_at = pending.get(ticket.id)
+            if viewed_at and highlights[ticket.id] and seen_since_update(viewed_at, ticket.updated_at):
+                highlights[ticket.id] = False
+    return page, highlights, message_counts
+
+
+def get_closed_tickets_page(per_page, after=None, before=None):
+    """
+    Страница архива (финальные статусы) с keyset-пагинацией по
+    (coalesce(closed_at, created_at), id). Возвращает (page, message_counts).
+    """
+    query = (
+        db.session.query(Ticket, _message_count())
+        .join(Ticket.status)
+        .filter(Status.category == 'final')
+        .options(contains_eager(Ticket.status), joinedload(Ticket.author))
+    )
+    page = keyset_paginate(
+        query,
+        keys=[CLOSED_SORT_KEY, Ticket.id],
+        key_of=lambda row: (row[0].closed_at or row[0].created_at, row[0].id),
+        per_page=per_page,
+        after=after,
+        before=before,
+    )
+    message_counts = {ticket.id: count for ticket, count in page.items}
+    page.items = [ticket for ticket, _ in page.items]
+    return page, message_counts
+
@@ -0,0 +1,210 @@
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from sqlalchemy import delete, func, select, update
+from extensions import db
+from models.attachment import TicketAttachment, StoredFile, Upload
+from models.ticket import TicketMessageAttachment
+from models.user import User
+from services import storage, thumbnails
+from services.uploads import expire_uploads
+
+# thumbs/ab/cd/<stem>_320.webp → ab/cd/<stem>
+DERIVATIVE_RE = re.compile(r"^(?P<stem>.+)_\d+\.[a-z0-9]+$")
+
+
+class GcStats:
+    def __init__(self):
+        self.scanned = 0
+        self.removed = 0
+        self.removed_bytes = 0
+        self.thumbs_removed = 0
+        self.tmp_removed = 0
+        self.refcounts_fixed = 0
+        self.rows_removed = 0
+        self.uploads_expired = 0
+
+    def __str__(self):
+        return (f"просмотрено файлов: {self.scanned}, удалено: {self.removed} "
+                f"({self.removed_bytes / 1024 / 1024:.1f} МБ), миниатюр: {self.thumbs_removed}, "
+                f"временных: {self.tmp_removed}, исправлено счётчиков: {self.refcounts_fixed}, "
+                f"удалено строк stored_file: {self.rows_removed}, незабранных загрузок: {self.uploads_expired}")
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _walk(root, top=""):
+    """Относительные пути файлов (через /) внутри root/top, без служебных каталогов и скрытых файлов"""
+    start = os.path.join(root, top) if top else root
+    for dirpath, dirnames, filenames in os.walk(start):
+        if dirpath == root:
+            dirnames[:] = [d for d in dirnames if d not in (storage.TMP_DIR, thumbnails.THUMBS_DIR)]
+        rel = os.path.relpath(dirpath, root).replace(os.sep, "/")
+        for filename in filenames:
+            if filename.startswith(".") and top != storage.TMP_DIR:
+                continue
+            yield filename if rel == "." else f"{rel}/{filename}"
+
+
+def _avatar_names(names):
+    return {f"uploads/{name}": name for name in names}
+
+
+def referenced_names(names):
+    """Какие из names на что-то ссылаются: вложения, загрузки, StoredFile, аватары"""
+    names = list(names)
+    avatars = _avatar_names(names)
+    found = set()
+    for statement in (
+        select(TicketAttachment.filename).where(TicketAttachment.filename.in_(names)),
+        select(TicketMessageAttachment.filename).where(TicketMessageAttachment.filename.in_(names)),
+        select(Upload.filename).where(Upload.filename.in_(names)),
+        select(StoredFile.path).where(StoredFile.path.in_(names)),
+    ):
+        found.update(db.session.execute(statement).scalars())
+    found.update(avatars[a] for a in db.session.execute(
+        select(User.avatar).where(User.avatar.in_(list(avatars)))
+    ).scalars())
+    return found
+
+
+def _actual_refcounts(paths):
+    counts = dict.fromkeys(paths, 0)
+    for column in (TicketAttachment.filename, TicketMessageAttachment.filename, Upload.filename):
+        for path, count in db.session.execute(
+            select(column, func.count()).where(column.in_(paths)).group_by(column)
+        ):
+            counts[path] += count
+    avatars = _avatar_names(paths)
+    for avatar, count in db.session.execute(
+        select(User.avatar, func.count()).where(User.avatar.in_(list(avatars))).group_by(User.avatar)
+    ):
+        counts[avatars[avatar]] += count
+    return counts
+
+
+def reconcile_refcounts(cutoff, batch_size, stats, dry_run=False):
+    """
+    Сверяем ref_count с реальным числом ссылок. Строки читаем раньше
+    ссылок, а правим условным UPDATE по прочитанному значению: если счётчик
+    успел измениться параллельно, правку пропускаем до следующего прохода.
+    Строки без ссылок удаляем только старше cutoff.
+    """
+    last_sha = ""
+    while True:
+        rows = db.session.execute(
+            select(StoredFile.sha256, StoredFile.path, StoredFile.ref_count, StoredFile.created_at)
+            .where(StoredFile.sha256 > last_sha)
+            .order_by(StoredFile.sha256)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_sha = rows[-1].sha256
+        actual = _actual_refcounts([row.path for row in rows])
+
+        for row in rows:
+            refs = actual[row.path]
+            created_at = row.created_at
+            if created_at is not None and created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            if refs == 0 and (created_at is None or created_at < cutoff):
+                stats.rows_removed += 1
+                if not dry_run:
+                    db.session.execute(delete(StoredFile).where(
+                        StoredFile.sha256 == row.sha256, StoredFile.ref_count == row.ref_count))
+            elif refs != row.ref_count:
+                stats.refcounts_fixed += 1
+                if not dry_run:
+                    db.session.execute(update(StoredFile).where(
+                        StoredFile.sha256 == row.sha256, StoredFile.ref_count == row.ref_count
+                    ).values(ref_count=refs))
+        db.session.commit()
+
+
+def _older_than(path, cutoff_ts):
+    try:
+        return os.stat(path).st_mtime < cutoff_ts
+    except FileNotFoundError:
+        return False
+
+
+def collect_garbage(root, grace, batch_size=500, dry_run=False):
+    """
+    Один проход сборки мусора в UPLOAD_FOLDER:
+    0) незабранные загрузки (/uploads) старше grace отпускаются;
+    1) сверка stored_file.ref_count с вложениями, загрузками и аватарами;
+    2) файлы, на которые ничто не ссылается и которые старше grace, удаляются;
+    3) миниатюры без оригинала и брошенные временные файлы — тоже.
+    """
+    stats = GcStats()
+    cutoff_ts = time.time() - grace.total_seconds()
+    if dry_run:
+        stats.uploads_expired = Upload.query.filter(Upload.created_at < datetime.now(timezone.utc) - grace).count()
+    else:
+        stats.uploads_expired = expire_uploads(datetime.now(timezone.utc) - grace, batch_size)
+        storage.wait_for_removals()
+    reconcile_refcounts(datetime.now(timezone.utc) - grace, batch_size, stats, dry_run)
+
+    for batch in _batches(_walk(root), batch_size):
+        stats.scanned += len(batch)
+        referenced = referenced_names(batch)
+        db.session.rollback()
+        for name in batch:
+            path = os.path.join(root, name)
+            if name in referenced or not _older_than(path, cutoff_ts):
+                continue
+            stats.removed += 1
+            stats.removed_bytes += os.path.getsize(path)
+            if not dry_run:
+                storage.remove_file(root, name)
+
+    listings = {}
+    for name in _walk(root, thumbnails.THUMBS_DIR):
+        match = DERIVATIVE_RE.match(name[len(thumbnails.THUMBS_DIR) + 1:])
+        if match:
+            directory, stem = os.path.split(os.path.join(root, match.group("stem")))
+            if directory not in listings:
+                listings[directory] = (
+                    {os.path.splitext(entry)[0] for entry in os.listdir(directory)} if os.path.isdir(directory) else set()
+                )
+            if stem in listings[directory]:
+                continue
+        if _older_than(os.path.join(root, name), cutoff_ts):
+            stats.thumbs_removed += 1
+            if not dry_run:
+                os.remove(os.path.join(root, name))
+
+    for name in _walk(root, storage.TMP_DIR):
+        if _older_than(os.path.join(root, name), cutoff_ts):
+            stats.tmp_removed += 1
+            if not dry_run:
+                os.remove(os.path.join(root, name))
+
+    return stats
+
+
+def run_gc_loop(app, grace, batch_size, every):
+    """Сборка мусора раз в every секунд (для отдельного процесса или systemd)"""
+    with app.app_context():
+        while True:
+            try:
+                stats = collect_garbage(app.config['UPLOAD_FOLDER'], grace, batch_size)
+                logging.info(f"Сборка мусора в загрузках: {stats}")
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Сборка мусора в загрузках: {e}")
+            finally:
+                db.session.remove()
+            time.sleep(every)
@@ -0,0 +1,129 @@
+import logging
+import os
+import time
+from flask import g, request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess,
+                               push_to_gateway)
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+# Метрики Prometheus. При нескольких воркерах (serve.py --workers N) каждый процесс
+# пишет значения в файлы PROMETHEUS_MULTIPROC_DIR, а /metrics складывает их по всем процессам.
+# Переменную нужно выставить до импорта prometheus_client — это делает serve.py
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время ответа по эндпоинтам",
+    ("endpoint", "method"), buckets=LATENCY_BUCKETS,
+)
+HTTP_REQUESTS = Counter("http_requests_total", "Ответы по эндпоинтам и кодам", ("endpoint", "method", "status"))
+
+DB_POOL_CAPACITY = Gauge("db_pool_capacity", "pool_size + max_overflow", multiprocess_mode="livesum")
+DB_POOL_OPEN = Gauge("db_pool_connections_open", "Открытые соединения пула", multiprocess_mode="livesum")
+DB_POOL_IN_USE = Gauge("db_pool_connections_in_use", "Соединения, выданные из пула", multiprocess_mode="livesum")
+
+SALES_FETCH_RUNS = Counter("sales_fetch_runs_total", "Проходы загрузки заказов", ("outcome",))
+SALES_FETCH_ROWS = Counter("sales_fetch_rows_total", "Строки заказов из API: fetched, inserted, skipped, rejected", ("result",))
+SALES_FETCH_DURATION = Histogram(
+    "sales_fetch_duration_seconds", "Длительность прохода загрузки заказов",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+
+DIGISELLER_LATENCY = Histogram(
+    "digiseller_request_duration_seconds", "Время ответа API Digiseller",
+    ("operation",), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+DIGISELLER_ERRORS = Counter("digiseller_request_errors_total", "Ошибки API Digiseller", ("operation", "reason"))
+
+SOCKETIO_CLIENTS = Gauge("socketio_connected_clients", "Подключённые клиенты Socket.IO", multiprocess_mode="livesum")
+SOCKETIO_EMITS = Counter("socketio_events_emitted_total", "Отправленные события Socket.IO", ("event",))
+
+
+def multiprocess_dir():
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+def render():
+    """Текст для /metrics: сумма по всем процессам или реестр этого процесса"""
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def process_exited():
+    """Gauge этого процесса (соединения пула и т. п.) больше не учитываются в сумме /metrics"""
+    if multiprocess_dir():
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def push_batch(gateway, job):
+    """
+    Разовые прогоны (cron) отправляют свои метрики в Pushgateway: в общем
+    каталоге PROMETHEUS_MULTIPROC_DIR каждый запуск оставлял бы новые файлы.
+    """
+    if multiprocess_dir():
+        logging.warning("Разовый прогон пишет метрики в PROMETHEUS_MULTIPROC_DIR: файлы каждого запуска "
+                        "останутся в каталоге до перезапуска serve.py; для cron используйте METRICS_PUSHGATEWAY")
+    if not gateway:
+        return
+    try:
+        push_to_gateway(gateway, job=job, registry=REGISTRY)
+    except OSError as e:
+        logging.error(f"Метрики не отправлены в Pushgateway {gateway}: {e}")
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _observe_request(exc):
+    # teardown, а не after_request: необработанное исключение обходит after_request, а такие 500 нужнее всего
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        status = 500 if exc is not None else g.pop("metrics_status", 500)
+        endpoint = request.endpoint or "unmatched"
+        HTTP_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        HTTP_REQUESTS.labels(endpoint, request.method, str(status)).inc()
+
+
+def _on_connect(dbapi_connection, connection_record):
+    DB_POOL_OPEN.inc()
+
+
+def _on_close(dbapi_connection, connection_record):
+    DB_POOL_OPEN.dec()
+
+
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    DB_POOL_IN_USE.inc()
+
+
+def _on_checkin(dbapi_connection, connection_record):
+    DB_POOL_IN_USE.dec()
+
+
+def init_app(app):
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_timer)
+    app.after_request(_remember_status)
+    app.teardown_request(_observe_request)
+
+    if not event.contains(Pool, "checkout", _on_checkout):
+        event.listen(Pool, "connect", _on_connect)
+        event.listen(Pool, "close", _on_close)
+        event.listen(Pool, "close_detached", _on_close)
+        event.listen(Pool, "checkout", _on_checkout)
+        event.listen(Pool, "checkin", _on_checkin)
+
+    engine_options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    if 'pool_size' in engine_options:
+        DB_POOL_CAPACITY.set(engine_options['pool_size'] + engine_options.get('max_overflow', 0))
@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import date, datetime
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    """Страница keyset-пагинации (по курсору, без OFFSET)"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def encode_cursor(values):
+    """Кодируем значения ключа сортировки в строку для URL"""
+    packed = [
+        {"dt": v.isoformat()} if isinstance(v, datetime) else {"d": v.isoformat()} if isinstance(v, date) else v
+        for v in values
+    ]
+    raw = json.dumps(packed, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """Обратное преобразование; на мусорный курсор возвращаем None"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        packed = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(packed, list):
+        return None
+    try:
+        return [_unpack(v) for v in packed]
+    except (ValueError, TypeError):
+        return None
+
+
+def _unpack(value):
+    if isinstance(value, dict):
+        if "dt" in value:
+            return datetime.fromisoformat(value["dt"])
+        if "d" in value:
+            return date.fromisoformat(value["d"])
+    return value
+
+
+def _beyond(keys, values, forward):
+    """Условие "строка лежит за курсором" для сортировки всех ключей по убыванию"""
+    clauses = []
+    for i, (key, value) in enumerate(zip(keys, values)):
+        prefix = [k == v for k, v in zip(keys[:i], values[:i])]
+        step = key < value if forward else key > value
+        clauses.append(and_(*prefix, step))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, keys, key_of, per_page, after=None, before=None):
+    """
+    Keyset-пагинация запроса, отсортированного по keys (все по убыванию).
+    key_of(item) возвращает значения ключей для элемента выдачи,
+    after/before — курсоры из предыдущей страницы.
+    """
+    after_values = decode_cursor(after)
+    before_values = decode_cursor(before)
+    if after_values and len(after_values) != len(keys):
+        after_values = None
+    if before_values and len(before_values) != len(keys):
+        before_values = None
+
+    if before_values and not after_values:
+        rows = (query.filter(_beyond(keys, before_values, forward=False))
+                .order_by(*[k.asc() for k in keys])
+                .limit(per_page + 1).all())
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        next_cursor = encode_cursor(key_of(items[-1])) if items else None
+        prev_cursor = encode_cursor(key_of(items[0])) if items and has_more else None
+        return KeysetPage(items, next_cursor, prev_cursor)
+
+    if after_values:
+        query = query.filter(_beyond(keys, after_values, forward=True))
+    rows = query.order_by(*[k.desc() for k in keys]).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = encode_cursor(key_of(items[-1])) if items and has_more else None
+    prev_cursor = encode_cursor(key_of(items[0])) if items and after_values else None
+    return KeysetPage(items, next_cursor, prev_cursor)
@@ -0,0 +1,195 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from contextvars import ContextVar
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Профиль текущего запроса; None — запрос не попал в выборку, события движка сразу выходят
+_current = ContextVar("perf_profile", default=None)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Форма запроса: без литералов и с одинаковым видом IN-списков любой длины
+_WS_RE = re.compile(r"\s+")
+_IN_LIST_RE = re.compile(r"\((?:\s*(?:\?|%\([^)]*\)s|%s|:\w+)\s*,)+\s*(?:\?|%\([^)]*\)s|%s|:\w+)\s*\)")
+_NUMBER_RE = re.compile(r"\b\d+\b")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+
+
+def statement_shape(statement):
+    shape = _WS_RE.sub(" ", statement).strip()
+    shape = _STRING_RE.sub("'?'", shape)
+    shape = _IN_LIST_RE.sub("(?…)", shape)
+    return _NUMBER_RE.sub("N", shape)
+
+
+def _caller():
+    """Первая строка кода проекта в стеке — откуда пришёл запрос к базе"""
+    for frame in reversed(traceback.extract_stack(limit=60)[:-3]):
+        path = frame.filename
+        if path.startswith(PROJECT_ROOT) and "site-packages" not in path and not path.endswith("profiler.py"):
+            return f"{os.path.relpath(path, PROJECT_ROOT)}:{frame.lineno} {frame.name}"
+    return None
+
+
+class RequestProfile:
+    def __init__(self, method, path, endpoint):
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.duration_ms = 0.0
+        self.status = None
+        self.queries = 0
+        self.db_ms = 0.0
+        self.shapes = Counter()
+        self.shape_ms = Counter()
+        self.origins = {}
+        self.slowest = []        # [(мс, форма)] — несколько самых долгих
+        self.n_plus_one = []     # [(форма, повторов, откуда)]
+
+    def record(self, statement, elapsed_ms, keep):
+        shape = statement_shape(statement)
+        self.queries += 1
+        self.db_ms += elapsed_ms
+        self.shapes[shape] += 1
+        self.shape_ms[shape] += elapsed_ms
+        if shape not in self.origins:
+            self.origins[shape] = _caller()
+        self.slowest.append((elapsed_ms, shape))
+        if len(self.slowest) > keep:
+            self.slowest.sort(reverse=True)
+            del self.slowest[keep:]
+
+    def finish(self, status, n_plus_one_threshold):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.status = status
+        self.slowest.sort(reverse=True)
+        self.n_plus_one = [
+            (shape, count, self.origins.get(shape))
+            for shape, count in self.shapes.most_common()
+            if count >= n_plus_one_threshold and shape.lstrip().upper().startswith("SELECT")
+        ]
+
+    def as_dict(self):
+        return {
+            "method": self.method,
+            "path": self.path,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "queries": self.queries,
+            "db_ms": round(self.db_ms, 2),
+            "repeated": [
+                {"shape": shape, "count": count, "ms": round(self.shape_ms[shape], 2), "origin": self.origins.get(shape)}
+                for shape, count in self.shapes.most_common(10) if count > 1
+            ],
+            "slowest": [{"ms": round(ms, 2), "shape": shape} for ms, shape in self.slowest],
+            "n_plus_one": [{"shape": s, "count": c, "origin": o} for s, c, o in self.n_plus_one],
+        }
+
+
+class Profiler:
+    """
+    Профилировщик SQL по запросам. Включается PERF_PROFILING; каждый запрос
+    попадает в выборку с вероятностью PERF_SAMPLE_RATE. Последние
+    PERF_HISTORY профилей хранятся в памяти процесса для /debug/perf.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.slow_ms = 0
+        self.n_plus_one_threshold = 0
+        self.keep_slowest = 5
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=200)
+
+    def init_app(self, app):
+        config = app.config
+        self.enabled = bool(config['PERF_PROFILING'])
+        if not self.enabled:
+            return
+        self.sample_rate = config['PERF_SAMPLE_RATE']
+        self.slow_ms = config['PERF_SLOW_REQUEST_MS']
+        self.n_plus_one_threshold = config['PERF_N_PLUS_ONE_THRESHOLD']
+        self._recent = deque(maxlen=config['PERF_HISTORY'])
+
+        # Слушатели движка вешаем только при включённом профилировании
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        app.before_request(self._start)
+        app.after_request(self._server_timing)
+        app.teardown_request(self._finish)
+
+    def _start(self):
+        # Статику и саму страницу профилей не профилируем
+        if request.endpoint == 'static' or request.blueprint == 'debug' or random.random() >= self.sample_rate:
+            return
+        profile = RequestProfile(request.method, request.full_path.rstrip("?"), request.endpoint)
+        g.perf_token = _current.set(profile)
+
+    def _server_timing(self, response):
+        profile = _current.get()
+        if profile is not None:
+            response.headers.add("Server-Timing", f'db;dur={profile.db_ms:.1f};desc="{profile.queries} SQL"')
+            g.perf_status = response.status_code
+        return response
+
+    def _finish(self, exc=None):
+        profile = _current.get()
+        token = g.pop("perf_token", None)
+        if profile is None or token is None:
+            return
+        _current.reset(token)
+        profile.finish(g.pop("perf_status", 500), self.n_plus_one_threshold)
+        with self._lock:
+            self._recent.append(profile)
+
+        if profile.n_plus_one:
+            shape, count, origin = profile.n_plus_one[0]
+            logging.warning(f"N+1 в {profile.method} {profile.path}: {count}× {shape[:200]} ({origin})")
+        if self.slow_ms and profile.duration_ms >= self.slow_ms:
+            worst = "; ".join(f"{ms:.1f} мс {shape[:200]}" for ms, shape in profile.slowest[:3])
+            logging.warning(
+                f"Медленный запрос {profile.method} {profile.path}: {profile.duration_ms:.0f} мс, "
+                f"SQL {profile.queries} за {profile.db_ms:.0f} мс. Худшие: {worst}"
+            )
+
+    def recent(self, order_by="db_ms", limit=100):
+        """Последние профили по убыванию order_by (db_ms, queries, duration_ms)"""
+        with self._lock:
+            profiles = list(self._recent)
+        return sorted(profiles, key=lambda p: getattr(p, order_by), reverse=True)[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._recent.clear()
+
+
+profiler = Profiler()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("perf_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is None:
+        return
+    started = conn.info.get("perf_started")
+    if not started:
+        return
+    profile.record(statement, (time.perf_counter() - started.pop()) * 1000, profiler.keep_slowest)
@@ -0,0 +1,39 @@
+from sqlalchemy import func
+from extensions import db
+from models.sales import Sale
+from models.ticket import Ticket
+from services.pagination import keyset_paginate
+from services.sales_search import SALE_SORT_KEY
+
+
+def get_purchase_totals(email):
+    """Суммы покупок по валютам одним агрегатом: [(currency, amount, count)]"""
+    return (
+        db.session.query(Sale.amount_currency, func.coalesce(func.sum(Sale.amount_in), 0), func.count(Sale.id))
+        .filter(Sale.email == email)
+        .group_by(Sale.amount_currency)
+        .order_by(func.count(Sale.id).desc())
+        .all()
+    )
+
+
+def get_purchase_page(email, per_page, after=None):
+    """Страница истории покупок (новые сверху) по индексу (email, дата оплаты, id)"""
+    return keyset_paginate(
+        Sale.query.filter(Sale.email == email),
+        keys=[SALE_SORT_KEY, Sale.id],
+        key_of=lambda sale: (sale.date_pay or sale.date_put, sale.id),
+        per_page=per_page,
+        after=after,
+    )
+
+
+def tickets_for_invoices(invoice_ids):
+    """Номер заказа -> id тикета, только для заказов текущей страницы"""
+    if not invoice_ids:
+        return {}
+    return {
+        order_number.strip(): ticket_id
+        for ticket_id, order_number in db.session.query(Ticket.id, Ticket.order_number)
+        .filter(Ticket.order_number.in_(invoice_ids))
+    }
@@ -0,0 +1,45 @@
+from extensions import socketio
+from services import thumbnails
+from services.metrics import SOCKETIO_EMITS
+
+# Комнаты Socket.IO: тикет (кто его сейчас открыл), пользователь, дашборд
+DASHBOARD_ROOM = "dashboard"
+
+
+def ticket_room(ticket_id):
+    return f"ticket:{ticket_id}"
+
+
+def user_room(user_id):
+    return f"user:{user_id}"
+
+
+def emit(event, data, to):
+    SOCKETIO_EMITS.labels(event).inc()
+    socketio.emit(event, data, to=to)
+
+
+def notify_new_message(ticket, message, author):
+    """
+    Полное событие — тем, кто смотрит тикет, и автору тикета; дашбордам —
+    id тикета для подсветки карточки и авторы, чтобы не уведомлять дважды
+    (автору тикета хватит new_message). Через SOCKETIO_MESSAGE_QUEUE
+    событие доходит до клиентов любого воркера.
+    """
+    rooms = [ticket_room(ticket.id)]
+    if ticket.user_id and ticket.user_id != author.id:
+        rooms.append(user_room(ticket.user_id))
+
+    emit("new_message", {
+        "ticket_id": ticket.id,
+        "user_id": author.id,
+        "author": author.display_name or author.username,
+        "avatar": thumbnails.avatar_url(author),
+        "message_id": message.id,
+    }, to=rooms)
+    emit("ticket_updated", {
+        "ticket_id": ticket.id,
+        "message_id": message.id,
+        "user_id": author.id,
+        "ticket_user_id": ticket.user_id,
+    }, to=DASHBOARD_ROOM)
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, or_, select
+from extensions import db
+from models.sales import SalesLog, SalesLogDaily
+from services import counters
+from services.pagination import keyset_paginate
+from services.sales_rollup import TZ_MSK
+
+# Типы ошибок прохода загрузчика
+ERROR_KINDS = {
+    "api": "API",
+    "retry": "Повтор",
+    "parse": "Разбор",
+    "missing": "Нет полей",
+    "insert": "Вставка",
+    "fatal": "Общая",
+}
+FAILED_STATUSES = ("api_error", "error")
+# Пустые проходы (новых заказов нет) в лог не пишутся
+STATUS_LABELS = {"ok": "Загружено", "api_error": "Ошибка API", "error": "Ошибка"}
+# Сколько ошибок хранить в записи прохода; остальные только считаются
+MAX_ERROR_ITEMS = 100
+
+DAILY_SUMS = ("runs", "failed_runs", "orders_loaded", "rows_fetched", "rows_skipped", "pages",
+              "duration_ms", "api_requests", "api_ms", "error_count")
+
+
+class LoaderRun:
+    """
+    Статистика одного прохода загрузки заказов. Страницы качаются в
+    нескольких потоках, поэтому время запросов к API копится под блокировкой.
+    """
+
+    def __init__(self, window_start=None, window_end=None):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.pages = 0
+        self.fetched = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.api_requests = 0
+        self.api_ms = 0.0
+        self.api_max_ms = 0.0
+        self.error_count = 0
+        self.errors = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def api_call(self, elapsed_ms):
+        with self._lock:
+            self.api_requests += 1
+            self.api_ms += elapsed_ms
+            self.api_max_ms = max(self.api_max_ms, elapsed_ms)
+
+    def error(self, kind, message, invoice_id=None):
+        with self._lock:
+            self.error_count += 1
+            if len(self.errors) < MAX_ERROR_ITEMS:
+                self.errors.append({"kind": kind, "message": str(message)[:500],
+                                    "invoice_id": str(invoice_id) if invoice_id is not None else None})
+
+    def save(self, status, note=""):
+        """Пишет проход в sales_log отдельным коммитом"""
+        db.session.add(SalesLog(
+            status=status,
+            note=note,
+            orders_loaded=self.inserted,
+            window_start=self.window_start,
+            window_end=self.window_end,
+            duration_ms=int((time.perf_counter() - self._started) * 1000),
+            pages=self.pages,
+            rows_fetched=self.fetched,
+            rows_skipped=self.skipped,
+            api_requests=self.api_requests,
+            api_ms=round(self.api_ms, 1),
+            api_max_ms=round(self.api_max_ms, 1),
+            error_count=self.error_count,
+            error_items=self.errors or None,
+        ))
+        db.session.commit()
+
+
+# --- Просмотр ---
+
+def _parse_day(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+    except ValueError:
+        return None
+
+
+def _utc_bound(day):
+    """Начало московского дня в naive UTC, как хранится sales_log.timestamp"""
+    start = TZ_MSK.localize(datetime.combine(day, datetime.min.time()))
+    return start.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def list_runs(per_page, status=None, errors_only=False, date_from=None, date_to=None, after=None, before=None):
+    """Проходы от новых к старым, keyset по id. Даты — московские YYYY-MM-DD"""
+    query = SalesLog.query
+    if status == "failed":
+        query = query.filter(SalesLog.status.in_(FAILED_STATUSES))
+    elif status in STATUS_LABELS:
+        query = query.filter(SalesLog.status == status)
+    if errors_only:
+        # У старых записей ошибки только в тексте errors
+        query = query.filter(or_(SalesLog.error_count > 0, SalesLog.errors > ""))
+    day_from, day_to = _parse_day(date_from), _parse_day(date_to)
+    if day_from:
+        query = query.filter(SalesLog.timestamp >= _utc_bound(day_from))
+    if day_to:
+        query = query.filter(SalesLog.timestamp < _utc_bound(day_to + timedelta(days=1)))
+    return keyset_paginate(query, keys=[SalesLog.id], key_of=lambda log: (log.id,),
+                           per_page=per_page, after=after, before=before)
+
+
+def list_daily(per_page, after=None, before=None):
+    return keyset_paginate(SalesLogDaily.query, keys=[SalesLogDaily.day], key_of=lambda d: (d.day,),
+                           per_page=per_page, after=after, before=before)
+
+
+# --- Хранение ---
+
+def _log_day(timestamp):
+    """Московская дата прохода; sales_log.timestamp — naive UTC"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(TZ_MSK).date()
+
+
+def compact(keep_days, batch_size=5000):
+    """
+    Проходы старше keep_days сворачиваются в sales_log_daily и удаляются.
+    Повторный запуск досуммирует в те же дни только новые старые проходы.
+    Возвращает число свёрнутых проходов.
+    """
+    cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=keep_days)
+    old = SalesLog.timestamp < cutoff
+
+    days = defaultdict(Counter)
+    compacted = 0
+    rows = db.session.execute(
+        select(SalesLog.timestamp, SalesLog.status, SalesLog.errors, SalesLog.orders_loaded, SalesLog.rows_fetched,
+               SalesLog.rows_skipped, SalesLog.pages, SalesLog.duration_ms, SalesLog.api_requests,
+               SalesLog.api_ms, SalesLog.error_count)
+        .where(old)
+        .execution_options(yield_per=batch_size)
+    )
+    for row in rows:
+        day = days[_log_day(row.timestamp)]
+        # Старые записи без status: неудачной считаем запись с ошибками и без заказов
+        failed = row.status in FAILED_STATUSES if row.status else bool(row.errors) and not row.orders_loaded
+        day["runs"] += 1
+        day["failed_runs"] += int(failed)
+        day["orders_loaded"] += row.orders_loaded or 0
+        day["rows_fetched"] += row.rows_fetched or 0
+        day["rows_skipped"] += row.rows_skipped or 0
+        day["pages"] += row.pages or 0
+        day["duration_ms"] += row.duration_ms or 0
+        day["api_requests"] += row.api_requests or 0
+        day["api_ms"] += row.api_ms or 0
+        day["error_count"] += row.error_count or (1 if row.errors else 0)
+        compacted += 1
+    if not compacted:
+        return 0
+
+    counters.increment(db.session.connection(), SalesLogDaily, ("day",), DAILY_SUMS, [
+        {"day": day, **{name: totals[name] for name in DAILY_SUMS}} for day, totals in days.items()
+    ])
+    deleted = db.session.execute(delete(SalesLog).where(old)).rowcount
+    if deleted != compacted:
+        # Параллельное сжатие уже забрало часть проходов — иначе посчитали бы их дважды
+        db.session.rollback()
+        raise RuntimeError(f"Сжатие лога: прочитано {compacted}, удалено {deleted}; повторите позже")
+    db.session.commit()
+    return compacted
+
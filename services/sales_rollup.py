@@ -0,0 +1,256 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import pytz
+from sqlalchemy import delete, func, select, text
+from extensions import db
+from models.sales import Sale, SalesDaily, SalesProductMonthly, SyncState
+from services import counters
+
+TZ_MSK = pytz.timezone("Europe/Moscow")
+# Строка sync_state, отмечающая, что fix_lmt_dates уже выполнена (watermark — её граница)
+LMT_FIX_NAME = "lmt_fix_applied"
+
+DAILY_KEYS = ("day", "currency", "method_pay", "aggregator_pay")
+PRODUCT_KEYS = ("month", "product_id", "currency")
+SUMS = ("orders", "amount_in", "amount_out")
+
+# Колонки Sale, которых достаточно для свёрток (rebuild читает только их)
+SALE_COLUMNS = (Sale.date_pay, Sale.date_put, Sale.product_id, Sale.product_name, Sale.amount_in,
+                Sale.amount_out, Sale.amount_currency, Sale.method_pay, Sale.aggregator_pay)
+
+BREAKDOWNS = {
+    "method": SalesDaily.method_pay,
+    "aggregator": SalesDaily.aggregator_pay,
+}
+
+
+def sale_day(date_pay, date_put):
+    """Московская дата продажи: по оплате, а без неё — по добавлению. Naive-даты (SQLite) уже московские"""
+    dt = date_pay or date_put
+    if dt is None:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(TZ_MSK)
+    return dt.date()
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def aggregate(rows, daily=None, products=None):
+    """
+    Суммирует продажи (словари или строки с колонками SALE_COLUMNS) в
+    приращения свёрток: {ключ: [orders, amount_in, amount_out]}.
+    """
+    daily = defaultdict(lambda: [0, 0.0, 0.0]) if daily is None else daily
+    products = {} if products is None else products
+    for row in rows:
+        row = row if isinstance(row, dict) else row._mapping
+        day = sale_day(row["date_pay"], row["date_put"])
+        if day is None:
+            continue
+        currency = row["amount_currency"] or ""
+        amount_in = row["amount_in"] or 0
+        amount_out = row["amount_out"] or 0
+
+        totals = daily[(day, currency, row["method_pay"] or "", row["aggregator_pay"] or "")]
+        totals[0] += 1
+        totals[1] += amount_in
+        totals[2] += amount_out
+
+        key = (month_start(day), row["product_id"] or 0, currency)
+        product = products.setdefault(key, [row["product_name"], 0, 0.0, 0.0])
+        product[0] = row["product_name"] or product[0]
+        product[1] += 1
+        product[2] += amount_in
+        product[3] += amount_out
+    return daily, products
+
+
+def _daily_rows(daily):
+    return [dict(zip(DAILY_KEYS, key), orders=t[0], amount_in=t[1], amount_out=t[2]) for key, t in daily.items()]
+
+
+def _product_rows(products):
+    return [dict(zip(PRODUCT_KEYS, key), product_name=p[0], orders=p[1], amount_in=p[2], amount_out=p[3])
+            for key, p in products.items()]
+
+
+def apply_sales(values):
+    """
+    Добавляет только что вставленные заказы в свёртки. Вызывается в той же
+    транзакции, что и вставка в sales: заказ и его вклад в свёртки
+    фиксируются вместе. Коммит — на вызывающем.
+    """
+    daily, products = aggregate(values)
+    if not daily:
+        return
+    conn = db.session.connection()
+    counters.increment(conn, SalesDaily, DAILY_KEYS, SUMS, _daily_rows(daily))
+    counters.increment(conn, SalesProductMonthly, PRODUCT_KEYS, SUMS, _product_rows(products), latest=("product_name",))
+
+
+def rebuild(batch_size=5000):
+    """
+    Пересчитать свёртки с нуля одним проходом по sales (читаются только
+    нужные колонки, потоково). Старые строки заменяются в той же
+    транзакции. Возвращает (заказов, строк по дням, строк по товарам).
+    """
+    daily, products = aggregate([])
+    total = 0
+    rows = db.session.execute(select(*SALE_COLUMNS).execution_options(yield_per=batch_size))
+    for partition in rows.partitions():
+        aggregate(partition, daily, products)
+        total += len(partition)
+
+    db.session.execute(delete(SalesDaily))
+    db.session.execute(delete(SalesProductMonthly))
+    daily_rows, product_rows = _daily_rows(daily), _product_rows(products)
+    for chunk in range(0, len(daily_rows), batch_size):
+        db.session.execute(SalesDaily.__table__.insert(), daily_rows[chunk:chunk + batch_size])
+    for chunk in range(0, len(product_rows), batch_size):
+        db.session.execute(SalesProductMonthly.__table__.insert(), product_rows[chunk:chunk + batch_size])
+    db.session.commit()
+    return total, len(daily_rows), len(product_rows)
+
+
+def lmt_fix_cutoff():
+    """Граница created_at, с которой уже выполнена fix_lmt_dates, или None"""
+    state = db.session.get(SyncState, LMT_FIX_NAME)
+    return state.watermark if state else None
+
+
+def fix_lmt_dates(before, dry_run=False):
+    """
+    Разовая правка заказов, записанных до перехода parse_sale_row на localize:
+    московское время сохранялось со смещением LMT +2:30, то есть момент
+    оплаты в базе на 30 минут (в 2011–2014 годах — на 1,5 часа) позже
+    настоящего. Затронут только Postgres (timestamptz): SQLite и MySQL
+    хранят время без зоны, как его прислал API. Правятся заказы с
+    created_at < before; после правки нужен rebuild(). Возвращает число заказов.
+
+    Правка не идемпотентна (повтор сдвинул бы даты ещё раз), поэтому вместе
+    с UPDATE в той же транзакции пишется отметка LMT_FIX_NAME; при ней
+    повторный запуск отказывается работать (RuntimeError).
+    """
+    if db.session.connection().dialect.name != "postgresql":
+        return 0
+    applied = lmt_fix_cutoff()
+    if applied is not None:
+        raise RuntimeError(f"Правка LMT уже выполнена для заказов до {applied:%Y-%m-%d %H:%M} UTC")
+    count = db.session.execute(select(func.count()).select_from(Sale).where(Sale.created_at < before)).scalar()
+    if dry_run:
+        return count
+    # Отметка первой: параллельный запуск упадёт на первичном ключе и откатит свой UPDATE
+    db.session.add(SyncState(name=LMT_FIX_NAME, watermark=before, last_run_at=datetime.now(pytz.utc),
+                             last_inserted=count))
+    db.session.flush()
+    if count:
+        # Восстанавливаем московское время «как в API» (+2:30 от UTC) и локализуем его правильно
+        db.session.execute(text("""
+            UPDATE sales SET
+                date_put = ((date_put AT TIME ZONE 'UTC') + interval '150 minutes') AT TIME ZONE 'Europe/Moscow',
+                date_pay = ((date_pay AT TIME ZONE 'UTC') + interval '150 minutes') AT TIME ZONE 'Europe/Moscow'
+            WHERE created_at < :before"""), {"before": before})
+    db.session.commit()
+    return count
+
+
+# --- Чтение (только из свёрток) ---
+
+def currencies():
+    """Валюты по убыванию оборота"""
+    return db.session.execute(
+        select(SalesDaily.currency).group_by(SalesDaily.currency).order_by(func.sum(SalesDaily.amount_in).desc())
+    ).scalars().all()
+
+
+def _totals(row):
+    return {"orders": int(row.orders or 0), "amount_in": round(row.amount_in or 0, 2),
+            "amount_out": round(row.amount_out or 0, 2)}
+
+
+def _sums(model):
+    return (func.sum(model.orders).label("orders"), func.sum(model.amount_in).label("amount_in"),
+            func.sum(model.amount_out).label("amount_out"))
+
+
+def daily_series(start, end, currency):
+    """Итоги по дням в [start, end] без пропусков: дни без продаж — нулями"""
+    found = {
+        row.day: _totals(row)
+        for row in db.session.execute(
+            select(SalesDaily.day, *_sums(SalesDaily))
+            .where(SalesDaily.day.between(start, end), SalesDaily.currency == currency)
+            .group_by(SalesDaily.day)
+        )
+    }
+    empty = {"orders": 0, "amount_in": 0, "amount_out": 0}
+    return [
+        {"day": (start + timedelta(days=i)).isoformat(), **found.get(start + timedelta(days=i), empty)}
+        for i in range((end - start).days + 1)
+    ]
+
+
+def monthly_series(days):
+    """Помесячные итоги из дневного ряда"""
+    months = {}
+    for point in days:
+        month = months.setdefault(point["day"][:7], {"month": point["day"][:7], "orders": 0, "amount_in": 0, "amount_out": 0})
+        for key in SUMS:
+            month[key] = round(month[key] + point[key], 2)
+    return list(months.values())
+
+
+def breakdown(by, start, end, currency):
+    """Итоги за период в разрезе метода оплаты или агрегатора"""
+    column = BREAKDOWNS[by]
+    return [
+        {"name": row.name or "—", **_totals(row)}
+        for row in db.session.execute(
+            select(column.label("name"), *_sums(SalesDaily))
+            .where(SalesDaily.day.between(start, end), SalesDaily.currency == currency)
+            .group_by(column)
+            .order_by(func.sum(SalesDaily.amount_in).desc())
+        )
+    ]
+
+
+def top_products(start, end, currency, limit=20):
+    """Товары с наибольшим оборотом за месяцы периода (start — первое число месяца)"""
+    return [
+        {"product_id": row.product_id, "name": row.product_name, **_totals(row)}
+        for row in db.session.execute(
+            select(SalesProductMonthly.product_id, func.max(SalesProductMonthly.product_name).label("product_name"),
+                   *_sums(SalesProductMonthly))
+            .where(SalesProductMonthly.month.between(start, end),
+                   SalesProductMonthly.currency == currency)
+            .group_by(SalesProductMonthly.product_id)
+            .order_by(func.sum(SalesProductMonthly.amount_in).desc())
+            .limit(limit)
+        )
+    ]
+
+
+def analytics(months, currency=None, today=None):
+    """Всё для страницы аналитики за последние months месяцев (включая текущий)"""
+    today = today or datetime.now(TZ_MSK).date()
+    start = month_start(today)
+    for _ in range(months - 1):
+        start = month_start(start - timedelta(days=1))
+
+    available = currencies()
+    currency = currency if currency in available else (available[0] if available else "")
+    days = daily_series(start, today, currency)
+    return {
+        "start": start.isoformat(),
+        "end": today.isoformat(),
+        "currency": currency,
+        "currencies": available,
+        "days": days,
+        "months": monthly_series(days),
+        "methods": breakdown("method", start, today, currency),
+        "aggregators": breakdown("aggregator", start, today, currency),
+        "products": top_products(start, today, currency),
+    }
@@ -0,0 +1,86 @@
+import ipaddress
+import re
+from sqlalchemy import func, or_
+from extensions import db
+from models.sales import Sale
+from services.pagination import keyset_paginate
+
+# Ключ сортировки выдачи: date_pay может быть пустым у неоплаченных заказов
+SALE_SORT_KEY = func.coalesce(Sale.date_pay, Sale.date_put)
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+INVOICE_RE = re.compile(r"^\d+$")
+# Ключи вида XXXXX-XXXXX-XXXXX или длинная строка из букв и цифр без пробелов
+LICENSE_KEY_RE = re.compile(r"^(?:[A-Za-z0-9]{2,}(?:-[A-Za-z0-9]{2,})+|(?=.*\d)(?=.*[A-Za-z])[A-Za-z0-9]{12,})$")
+
+KIND_LABELS = {
+    'invoice': 'номер заказа',
+    'email': 'email',
+    'ip': 'IP-адрес',
+    'key': 'ключ товара',
+    'text': 'текст',
+}
+
+
+def classify_query(term):
+    """Определяем, что ввёл агент: номер заказа, email, IP, ключ или просто текст"""
+    if INVOICE_RE.match(term):
+        return 'invoice'
+    if EMAIL_RE.match(term):
+        return 'email'
+    try:
+        ipaddress.ip_address(term)
+        return 'ip'
+    except ValueError:
+        pass
+    if LICENSE_KEY_RE.match(term):
+        return 'key'
+    return 'text'
+
+
+def _like_escape(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_sales_query(term, kind):
+    """Точные и префиксные запросы идут по btree-индексам, текст — по триграммному"""
+    query = Sale.query
+    if kind == 'invoice':
+        return query.filter(Sale.invoice_id == term)
+    if kind == 'email':
+        return query.filter(Sale.email.in_({term, term.lower()}))
+    if kind == 'ip':
+        return query.filter(Sale.ip == term)
+    if kind == 'key':
+        return query.filter(Sale.product_entry.startswith(term, autoescape=True))
+    pattern = f"%{_like_escape(term)}%"
+    return query.filter(or_(
+        Sale.product_name.ilike(pattern, escape="\\"),
+        Sale.product_entry.ilike(pattern, escape="\\"),
+    ))
+
+
+def estimate_count(query, cap):
+    """
+    Быстрая оценка размера выдачи: считаем не больше cap + 1 строк.
+    Возвращает (count, exact); при exact=False найдено больше cap.
+    """
+    limited = query.with_entities(Sale.id).limit(cap + 1).subquery()
+    count = db.session.query(func.count()).select_from(limited).scalar()
+    return min(count, cap), count <= cap
+
+
+def search_sales(term, per_page, count_cap, after=None, before=None):
+    """Возвращает (kind, KeysetPage); page.total = (count, exact)"""
+    kind = classify_query(term)
+    query = build_sales_query(term, kind)
+    page = keyset_paginate(
+        query,
+        keys=[SALE_SORT_KEY, Sale.id],
+        key_of=lambda sale: (sale.date_pay or sale.date_put, sale.id),
+        per_page=per_page,
+        after=after,
+        before=before,
+    )
+    page.total = estimate_count(query, count_cap)
+    return kind, page
@@ -0,0 +1,186 @@
+import logging
+import os
+import signal
+import socket
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, update
+from sqlalchemy.exc import IntegrityError
+import digiseller
+from extensions import db
+from models.sales import SyncState
+from services import metrics
+from services.token_store import make_token_store
+
+SYNC_NAME = "digiseller_sales"
+# Сколько продлений аренды должно укладываться в её срок (запас на медленную запись страницы)
+MIN_LEASE_HEARTBEATS = 4
+
+
+def runner_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def configure_from_app(app):
+    digiseller.configure_digiseller(
+        app.config['DIGISELLER_SELLER_ID'],
+        app.config['DIGISELLER_API_KEY'],
+        page_rows=app.config['DIGISELLER_PAGE_ROWS'],
+        max_parallel=app.config['DIGISELLER_MAX_PARALLEL'],
+        max_retries=app.config['DIGISELLER_MAX_RETRIES'],
+        token_store=make_token_store(app.config),
+    )
+
+
+def _get_state():
+    state = db.session.get(SyncState, SYNC_NAME)
+    if state is None:
+        try:
+            db.session.add(SyncState(name=SYNC_NAME))
+            db.session.commit()
+        except IntegrityError:
+            # Строку параллельно создал другой раннер
+            db.session.rollback()
+        state = db.session.get(SyncState, SYNC_NAME)
+    return state
+
+
+def acquire_lease(owner, ttl):
+    """
+    Атомарно берём (или продлеваем) аренду: UPDATE пройдёт, только если
+    аренда свободна, истекла или уже наша. Два раннера не загрузят одно окно.
+    """
+    _get_state()
+    now = datetime.now(timezone.utc)
+    result = db.session.execute(
+        update(SyncState)
+        .where(
+            SyncState.name == SYNC_NAME,
+            or_(
+                SyncState.lease_owner.is_(None),
+                SyncState.lease_owner == owner,
+                SyncState.lease_expires_at < now,
+            ),
+        )
+        .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=ttl))
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def release_lease(owner):
+    db.session.execute(
+        update(SyncState)
+        .where(SyncState.name == SYNC_NAME, SyncState.lease_owner == owner)
+        .values(lease_owner=None, lease_expires_at=None)
+    )
+    db.session.commit()
+
+
+def check_lease_ttl(lease_ttl):
+    """Срок аренды должен покрывать несколько продлений, иначе окно загрузят два раннера"""
+    minimum = MIN_LEASE_HEARTBEATS * digiseller.HEARTBEAT_INTERVAL
+    if lease_ttl < minimum:
+        raise ValueError(f"SALES_SYNC_LEASE_TTL={lease_ttl} слишком мал: нужно не меньше {minimum} с")
+
+
+class LeaseLost(Exception):
+    """Аренду за время прохода забрал другой раннер"""
+
+
+def sync_once(owner, lease_ttl, overlap, keep_lease=False):
+    """
+    Один проход: окно от сохранённого водяного знака до текущего момента.
+    Водяной знак двигается только после успешной загрузки всего окна,
+    с отступом overlap секунд назад (повторы отсекает ON CONFLICT).
+    Аренда продлевается, пока качаются страницы (раз в
+    digiseller.HEARTBEAT_INTERVAL секунд), и перед записью каждой страницы,
+    а по окончании освобождается; keep_lease=True оставляет её за демоном
+    до следующего прохода.
+    Возвращает число новых заказов или None, если аренда занята другим раннером.
+    """
+    check_lease_ttl(lease_ttl)
+    if not acquire_lease(owner, lease_ttl):
+        return None
+    try:
+        return _sync_window(owner, lease_ttl, overlap)
+    finally:
+        if not keep_lease:
+            db.session.rollback()
+            release_lease(owner)
+
+
+def _sync_window(owner, lease_ttl, overlap):
+    def renew_lease():
+        if not acquire_lease(owner, lease_ttl):
+            raise LeaseLost(f"Аренду синхронизации забрал другой раннер ({owner})")
+
+    state = _get_state()
+    date_start = state.watermark or digiseller.get_last_sale_date()
+    date_finish = digiseller.get_moscow_time()
+
+    ok, inserted = digiseller.load_sales_window(date_start, date_finish, before_page=renew_lease)
+
+    state = _get_state()
+    state.last_run_at = datetime.now(timezone.utc)
+    if ok:
+        state.watermark = date_finish - timedelta(seconds=overlap)
+        state.last_success_at = state.last_run_at
+        state.last_inserted = inserted
+        state.consecutive_failures = 0
+    else:
+        state.consecutive_failures = (state.consecutive_failures or 0) + 1
+    db.session.commit()
+
+    if not ok:
+        raise RuntimeError("Окно не загружено, водяной знак не сдвинут")
+    return inserted
+
+
+def run_daemon(app, min_interval, max_interval, lease_ttl, overlap):
+    """
+    Бесконечный опрос Digiseller с адаптивным интервалом: после новых заказов
+    спрашиваем снова через min_interval, в тишине и при ошибках — реже,
+    вплоть до max_interval. Останавливается по SIGTERM/SIGINT.
+    """
+    check_lease_ttl(lease_ttl)
+    owner = runner_id()
+    stopping = []
+
+    def _stop(signum, frame):
+        logging.info(f"Синхронизация продаж: получен сигнал {signum}, останавливаемся")
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    interval = min_interval
+    with app.app_context():
+        configure_from_app(app)
+        logging.info(f"Синхронизация продаж запущена ({owner})")
+        try:
+            while not stopping:
+                try:
+                    inserted = sync_once(owner, lease_ttl, overlap, keep_lease=True)
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f"Синхронизация продаж: {e}")
+                    interval = min(interval * 2, max_interval)
+                else:
+                    if inserted is None:
+                        logging.debug("Аренда у другого раннера, ждём")
+                        interval = max_interval
+                    elif inserted:
+                        interval = min_interval
+                    else:
+                        interval = min(interval * 1.5, max_interval)
+                finally:
+                    db.session.remove()
+
+                deadline = time.monotonic() + interval
+                while not stopping and time.monotonic() < deadline:
+                    time.sleep(min(1.0, deadline - time.monotonic()))
+        finally:
+            release_lease(owner)
+            metrics.process_exited()
+            logging.info("Синхронизация продаж остановлена")
@@ -0,0 +1,331 @@
+import logging
+import re
+import time
+from markupsafe import Markup, escape
+from sqlalchemy import event, inspect, or_, text
+from sqlalchemy.orm import Session, joinedload
+from extensions import db
+from models.ticket import Ticket, TicketMessage
+from services.pagination import KeysetPage, encode_cursor, decode_cursor
+
+# Маркеры подсветки внутри сниппета: в HTML превращаются в <mark> уже после экранирования
+HL_START, HL_STOP = "\x02", "\x03"
+SNIPPET_WORDS = 16
+
+# Сколько секунд доверяем ответу "индекса нет", прежде чем проверить снова
+READY_RECHECK_SECONDS = 60
+
+
+def _like_pattern(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+class PostgresBackend:
+    """tsvector (GIN) + pg_trgm для подстрок вроде кусков номера заказа"""
+
+    table = "ticket_search"
+    ddl = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        """CREATE TABLE IF NOT EXISTS ticket_search (
+            ticket_id INTEGER PRIMARY KEY REFERENCES ticket(id) ON DELETE CASCADE,
+            document TEXT NOT NULL,
+            tsv TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', document)) STORED
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_search_tsv ON ticket_search USING gin (tsv)",
+        "CREATE INDEX IF NOT EXISTS idx_ticket_search_trgm ON ticket_search USING gin (document gin_trgm_ops)",
+    ]
+
+    def upsert(self, conn, docs):
+        conn.execute(
+            text("""INSERT INTO ticket_search (ticket_id, document) VALUES (:ticket_id, :document)
+                    ON CONFLICT (ticket_id) DO UPDATE SET document = excluded.document"""),
+            [{"ticket_id": tid, "document": doc} for tid, doc in docs.items()],
+        )
+
+    def delete(self, conn, ticket_ids):
+        conn.execute(text("DELETE FROM ticket_search WHERE ticket_id = ANY(:ids)"), {"ids": list(ticket_ids)})
+
+    def search(self, conn, term, cursor, limit):
+        params = {"q": term, "like": _like_pattern(term), "limit": limit,
+                  "opts": f"StartSel={HL_START},StopSel={HL_STOP},MaxWords={SNIPPET_WORDS},MinWords=5"}
+        after = ""
+        if cursor:
+            params["c_score"], params["c_id"] = cursor
+            after = "WHERE score < :c_score OR (score = :c_score AND ticket_id < :c_id)"
+        sql = f"""
+            WITH hits AS (
+                SELECT s.ticket_id, s.document, q.query,
+                       (ts_rank_cd(s.tsv, q.query) + CASE WHEN s.document ILIKE :like THEN 1 ELSE 0 END)::float8 AS score
+                FROM ticket_search s, websearch_to_tsquery('simple', :q) AS q(query)
+                WHERE s.tsv @@ q.query OR s.document ILIKE :like
+            )
+            SELECT ticket_id, score, ts_headline('simple', document, query, :opts) AS snippet
+            FROM hits {after}
+            ORDER BY score DESC, ticket_id DESC
+            LIMIT :limit"""
+        return conn.execute(text(sql), params).all()
+
+
+class SqliteBackend:
+    """FTS5 для локального запуска; rowid виртуальной таблицы = id тикета"""
+
+    table = "ticket_fts"
+    ddl = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ticket_fts USING fts5(document, tokenize = 'unicode61 remove_diacritics 2')",
+    ]
+
+    def upsert(self, conn, docs):
+        self.delete(conn, docs.keys())
+        conn.execute(
+            text("INSERT INTO ticket_fts (rowid, document) VALUES (:ticket_id, :document)"),
+            [{"ticket_id": tid, "document": doc} for tid, doc in docs.items()],
+        )
+
+    def delete(self, conn, ticket_ids):
+        ids = list(ticket_ids)
+        if ids:
+            conn.execute(text(f"DELETE FROM ticket_fts WHERE rowid IN ({','.join(str(int(i)) for i in ids)})"))
+
+    @staticmethod
+    def _match_query(term):
+        # Каждое слово — отдельная фраза с префиксным поиском, синтаксис FTS5 пользователю недоступен
+        words = [w.replace('"', '""') for w in term.split() if re.search(r"\w", w)]
+        return " ".join(f'"{w}"*' for w in words)
+
+    def search(self, conn, term, cursor, limit):
+        match = self._match_query(term)
+        if not match:
+            return []
+        params = {"q": match, "limit": limit}
+        after = ""
+        if cursor:
+            params["c_score"], params["c_id"] = cursor
+            after = "WHERE score < :c_score OR (score = :c_score AND ticket_id < :c_id)"
+        sql = f"""
+            SELECT ticket_id, score, snippet FROM (
+                SELECT rowid AS ticket_id, -bm25(ticket_fts) AS score,
+                       snippet(ticket_fts, 0, char(2), char(3), '…', {SNIPPET_WORDS}) AS snippet
+                FROM ticket_fts WHERE ticket_fts MATCH :q
+            ) {after}
+            ORDER BY score DESC, ticket_id DESC
+            LIMIT :limit"""
+        return conn.execute(text(sql), params).all()
+
+
+class GenericBackend:
+    """Запасной вариант (например, MySQL): отдельная таблица документов и LIKE по ней"""
+
+    table = "ticket_search"
+    ddl = [
+        "CREATE TABLE IF NOT EXISTS ticket_search (ticket_id INTEGER PRIMARY KEY, document TEXT NOT NULL)",
+    ]
+
+    def upsert(self, conn, docs):
+        self.delete(conn, docs.keys())
+        conn.execute(
+            text("INSERT INTO ticket_search (ticket_id, document) VALUES (:ticket_id, :document)"),
+            [{"ticket_id": tid, "document": doc} for tid, doc in docs.items()],
+        )
+
+    def delete(self, conn, ticket_ids):
+        ids = list(ticket_ids)
+        if ids:
+            conn.execute(text(f"DELETE FROM ticket_search WHERE ticket_id IN ({','.join(str(int(i)) for i in ids)})"))
+
+    def search(self, conn, term, cursor, limit):
+        params = {"like": _like_pattern(term), "limit": limit}
+        after = ""
+        if cursor:
+            params["c_id"] = cursor[1]
+            after = "AND ticket_id < :c_id"
+        rows = conn.execute(
+            text(f"""SELECT ticket_id, document FROM ticket_search
+                     WHERE document LIKE :like {after}
+                     ORDER BY ticket_id DESC LIMIT :limit"""),
+            params,
+        ).all()
+        return [(tid, 0.0, _plain_snippet(doc, term)) for tid, doc in rows]
+
+
+def _plain_snippet(document, term, width=80):
+    pos = document.lower().find(term.lower())
+    if pos < 0:
+        return document[:width * 2]
+    start = max(0, pos - width)
+    end = pos + len(term)
+    return (("…" if start else "") + document[start:pos] + HL_START + document[pos:end] + HL_STOP
+            + document[end:end + width] + ("…" if end + width < len(document) else ""))
+
+
+_BACKENDS = {"postgresql": PostgresBackend, "sqlite": SqliteBackend}
+_ready = {}
+_warned_missing = set()   # базы, о которых уже предупредили: отсутствие индекса пишем в лог раз за процесс
+
+
+def get_backend(bind=None):
+    bind = bind or db.engine
+    return _BACKENDS.get(bind.dialect.name, GenericBackend)()
+
+
+def index_ready(bind=None):
+    """Создан ли поисковый индекс; отрицательный ответ кэшируем ненадолго"""
+    bind = bind or db.engine
+    key = str(bind.url)
+    ready, checked_at = _ready.get(key, (False, None))
+    if ready or (checked_at is not None and time.monotonic() - checked_at < READY_RECHECK_SECONDS):
+        return ready
+    ready = inspect(bind).has_table(get_backend(bind).table)
+    _ready[key] = (ready, time.monotonic())
+    if not ready and key not in _warned_missing:
+        _warned_missing.add(key)
+        logging.warning("Поисковый индекс не создан, поиск тикетов идёт через LIKE (flask search rebuild)")
+    return ready
+
+
+def build_documents(conn, ticket_ids):
+    """Текст документа: поля тикета + все сообщения чата"""
+    ids = list(ticket_ids)
+    tickets = conn.execute(
+        db.select(Ticket.id, Ticket.order_number, Ticket.customer_email, Ticket.product, Ticket.reason)
+        .where(Ticket.id.in_(ids))
+    ).all()
+    messages = conn.execute(
+        db.select(TicketMessage.ticket_id, TicketMessage.content)
+        .where(TicketMessage.ticket_id.in_(ids), TicketMessage.content.isnot(None))
+        .order_by(TicketMessage.ticket_id, TicketMessage.created_at)
+    ).all()
+
+    docs = {row.id: [row.order_number, row.customer_email, row.product, row.reason] for row in tickets}
+    for ticket_id, content in messages:
+        if ticket_id in docs:
+            docs[ticket_id].append(content)
+    return {tid: "\n".join(p.strip() for p in parts if p and p.strip()) for tid, parts in docs.items()}
+
+
+def reindex(conn, ticket_ids, backend=None):
+    backend = backend or get_backend(conn.engine)
+    ticket_ids = set(ticket_ids)
+    docs = build_documents(conn, ticket_ids)
+    if docs:
+        backend.upsert(conn, docs)
+    missing = ticket_ids - set(docs)
+    if missing:
+        backend.delete(conn, missing)
+
+
+def rebuild_index(batch_size=1000):
+    """Создаёт индекс (если нужно) и переиндексирует все тикеты пачками"""
+    backend = get_backend()
+    with db.engine.begin() as conn:
+        for statement in backend.ddl:
+            conn.execute(text(statement))
+    _ready.pop(str(db.engine.url), None)
+
+    total = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            ids = conn.execute(
+                db.select(Ticket.id).where(Ticket.id > last_id).order_by(Ticket.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            reindex(conn, ids, backend)
+        total += len(ids)
+        last_id = ids[-1]
+    return total
+
+
+# --- Поддержание индекса в актуальном состоянии при записи ---
+
+@event.listens_for(Session, "after_flush")
+def _collect_dirty_tickets(session, flush_context):
+    dirty = session.info.setdefault("search_dirty", set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Ticket) and obj.id is not None:
+            dirty.add(obj.id)
+        elif isinstance(obj, TicketMessage) and obj.ticket_id is not None:
+            dirty.add(obj.ticket_id)
+
+
+def mark_dirty(session, ticket_ids):
+    """Для массовых UPDATE/DELETE мимо ORM: переиндексировать тикеты при коммите"""
+    session.info.setdefault("search_dirty", set()).update(ticket_ids)
+
+
+@event.listens_for(Session, "before_commit")
+def _reindex_dirty_tickets(session):
+    # before_commit срабатывает до последнего flush внутри commit() — иначе его изменения ушли бы в следующий коммит
+    session.flush()
+    dirty = session.info.pop("search_dirty", None)
+    if not dirty:
+        return
+    conn = session.connection()
+    if index_ready(conn.engine):
+        reindex(conn, dirty)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_dirty_tickets(session):
+    session.info.pop("search_dirty", None)
+
+
+# --- Поиск ---
+
+def highlight(snippet):
+    """Экранируем текст сниппета и только потом расставляем <mark>"""
+    html = str(escape(snippet or ""))
+    return Markup(html.replace(HL_START, "<mark>").replace(HL_STOP, "</mark>"))
+
+
+def _search_without_index(term, cursor, limit):
+    """Запасной поиск без индекса: новые тикеты первыми, сниппет по полям тикета"""
+    like = _like_pattern(term)
+    query = (
+        db.select(Ticket.id, Ticket.order_number, Ticket.customer_email, Ticket.product, Ticket.reason)
+        .where(or_(
+            Ticket.order_number.ilike(like, escape="\\"),
+            Ticket.customer_email.ilike(like, escape="\\"),
+            Ticket.product.ilike(like, escape="\\"),
+            Ticket.reason.ilike(like, escape="\\"),
+            Ticket.id.in_(db.select(TicketMessage.ticket_id).where(TicketMessage.content.ilike(like, escape="\\"))),
+        ))
+        .order_by(Ticket.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        query = query.where(Ticket.id < cursor[1])
+    rows = db.session.execute(query).all()
+    return [(row.id, 0.0, _plain_snippet("\n".join(p for p in row[1:] if p), term)) for row in rows]
+
+
+def search_tickets(term, per_page, after=None):
+    """
+    Ранжированный поиск по индексу; пока индекса нет — LIKE, как до него. Возвращает KeysetPage, где items —
+    список (ticket, snippet) в порядке релевантности.
+    """
+    term = re.sub(r"\s+", " ", term or "").strip()
+    if not term:
+        return KeysetPage([])
+
+    cursor = decode_cursor(after)
+    if cursor and len(cursor) != 2:
+        cursor = None
+
+    if index_ready():
+        rows = get_backend().search(db.session.connection(), term, cursor, per_page + 1)
+    else:
+        # Индекс ещё не построен (flask search rebuild): ищем как раньше, LIKE по тикетам и сообщениям
+        rows = _search_without_index(term, cursor, per_page + 1)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    ids = [row[0] for row in rows]
+    tickets = {
+        t.id: t for t in Ticket.query.options(joinedload(Ticket.status)).filter(Ticket.id.in_(ids)).all()
+    } if ids else {}
+    items = [(tickets[tid], highlight(snippet)) for tid, _, snippet in rows if tid in tickets]
+
+    next_cursor = encode_cursor([rows[-1][1], rows[-1][0]]) if has_more else None
+    return KeysetPage(items, next_cursor=next_cursor)
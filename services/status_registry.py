@@ -0,0 +1,117 @@
+import threading
+import time
+import uuid
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import cache
+from models.ticket import Status
+
+VERSION_KEY = "status_registry:version"
+# Как часто (секунды) сверяем локальную копию с общей версией в кэше
+CHECK_INTERVAL = 2.0
+
+
+class StatusInfo:
+    """Неизменяемый снимок строки Status: безопасно делить между потоками и запросами"""
+
+    __slots__ = ("id", "name", "label", "category", "color", "description", "group")
+
+    def __init__(self, status):
+        for attr in self.__slots__:
+            object.__setattr__(self, attr, getattr(status, attr))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("StatusInfo только для чтения")
+
+    def __repr__(self):
+        return f"<StatusInfo {self.id} {self.name}>"
+
+
+class StatusRegistry:
+    """
+    Все статусы процесса: грузятся одним запросом и индексируются по id,
+    имени и категории. Любая запись в Status (через ORM) меняет общую
+    версию в extensions.cache — остальные воркеры перечитают справочник
+    не позже чем через CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _shared_version(self):
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(VERSION_KEY, version, timeout=0):
+                version = cache.get(VERSION_KEY) or version
+        return version
+
+    def _snapshot(self):
+        now = time.monotonic()
+        data = self._data
+        if data is not None and now - self._checked_at < CHECK_INTERVAL:
+            return data
+
+        with self._lock:
+            version = self._shared_version()
+            if self._data is None or version != self._version:
+                statuses = [StatusInfo(s) for s in Status.query.order_by(Status.id).all()]
+                by_category = {}
+                for s in statuses:
+                    by_category.setdefault(s.category, []).append(s)
+                self._data = {
+                    "all": statuses,
+                    "by_id": {s.id: s for s in statuses},
+                    "by_name": {s.name: s for s in statuses},
+                    "by_category": by_category,
+                }
+                self._version = version
+            self._checked_at = now
+            return self._data
+
+    def all(self):
+        return self._snapshot()["all"]
+
+    def get(self, status_id):
+        try:
+            return self._snapshot()["by_id"].get(int(status_id))
+        except (TypeError, ValueError):
+            return None
+
+    def by_name(self, name):
+        return self._snapshot()["by_name"].get(name)
+
+    def by_category(self, category):
+        return self._snapshot()["by_category"].get(category, [])
+
+    def open_ids(self):
+        """Статусы не из категории final (NULL-категория, как и в SQL, не считается)"""
+        return [s.id for s in self.all() if s.category is not None and s.category != 'final']
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+
+
+statuses = StatusRegistry()
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_statuses_changed(session, flush_context):
+    if any(isinstance(obj, Status) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["statuses_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_statuses(session):
+    if session.info.pop("statuses_changed", False):
+        statuses.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_status_changes(session):
+    session.info.pop("statuses_changed", None)
@@ -0,0 +1,278 @@
+import hashlib
+import logging
+import mimetypes
+import os
+import queue
+import re
+import tempfile
+import threading
+from collections import Counter
+from flask import current_app
+from sqlalchemy import bindparam, delete, event, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+from extensions import db
+from models.attachment import StoredFile
+from services import thumbnails
+
+CHUNK_SIZE = 64 * 1024
+TMP_DIR = ".tmp"
+BATCH_SIZE = 500
+
+
+def upload_root():
+    return current_app.config['UPLOAD_FOLDER']
+
+
+def file_path(name):
+    """Абсолютный путь к файлу по имени из вложения (старые плоские имена тоже)"""
+    return os.path.join(upload_root(), name)
+
+
+def _extension(original_name, content_type):
+    ext = os.path.splitext(secure_filename(original_name or ""))[1].lower()
+    if not ext and content_type:
+        ext = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,10}", ext) else ""
+
+
+def content_path(sha256, ext):
+    """ab/cd/abcd…ef.png — два уровня каталогов, чтобы не складывать всё в одну папку"""
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+class HashingSpool:
+    """
+    Временный файл в UPLOAD_FOLDER/.tmp, который считает SHA-256 и размер
+    по мере записи. Годится как stream_factory для разбора multipart:
+    тело запроса пишется на диск один раз, без промежуточных буферов.
+    """
+
+    def __init__(self, max_size=None):
+        tmp_dir = os.path.join(upload_root(), TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=tmp_dir)
+        self._file = os.fdopen(fd, "w+b")
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.max_size = max_size
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge(f"Файл больше {self.max_size // (1024 * 1024)} МБ")
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def seek(self, *args):
+        return self._file.seek(*args)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, *args):
+        return self._file.read(*args)
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        _discard(self.path)
+
+
+def _spool(stream):
+    """Копируем поток во временный файл на том же диске, попутно считая SHA-256 и размер"""
+    spool = HashingSpool()
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.close()
+    except BaseException:
+        spool.discard()
+        raise
+    return spool
+
+
+def _discard(tmp_path):
+    try:
+        os.unlink(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def _add_reference(sha256):
+    """ref_count + 1 одним UPDATE; None, если такого содержимого ещё нет"""
+    result = db.session.execute(
+        update(StoredFile)
+        .where(StoredFile.sha256 == sha256)
+        .values(ref_count=StoredFile.ref_count + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return None
+    return db.session.get(StoredFile, sha256, populate_existing=True)
+
+
+def _place(tmp_path, stored):
+    """Кладём файл на место, если его там нет (например, удалили руками), иначе выбрасываем копию"""
+    target = file_path(stored.path)
+    if os.path.exists(target):
+        _discard(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_path, target)
+
+
+def store_stream(stream, original_name=None, content_type=None):
+    """
+    Сохраняет содержимое потока и берёт на него одну ссылку. Одинаковые
+    файлы хранятся один раз. Возвращает StoredFile; stored.path кладём в
+    filename вложения. Ссылка фиксируется вместе с транзакцией вызывающего.
+    """
+    return store_spooled(_spool(stream), original_name, content_type)
+
+
+def store_spooled(spool, original_name=None, content_type=None):
+    """То же для уже записанного HashingSpool: файл переносится на место без копирования"""
+    spool.close()
+    sha256 = spool.sha256
+    try:
+        stored = _add_reference(sha256)
+        if stored is None:
+            stored = StoredFile(
+                sha256=sha256,
+                path=content_path(sha256, _extension(original_name, content_type)),
+                size=spool.size,
+                content_type=content_type,
+                ref_count=1,
+            )
+            try:
+                with db.session.begin_nested():
+                    db.session.add(stored)
+            except IntegrityError:
+                # То же содержимое параллельно сохранил другой запрос
+                stored = _add_reference(sha256)
+                if stored is None:
+                    raise
+        _place(spool.path, stored)
+    except BaseException:
+        _discard(spool.path)
+        raise
+    return stored
+
+
+def store_upload(file):
+    """FileStorage из формы → путь для поля filename"""
+    return store_stream(file.stream, file.filename, file.mimetype).path
+
+
+def release(name):
+    """Снимает одну ссылку с файла вложения (см. release_many)"""
+    release_many([name])
+
+
+def release_many(names):
+    """
+    Снимает по ссылке за каждое имя в names (повторы — несколько ссылок).
+    Строки StoredFile, на которые больше никто не ссылается, удаляются,
+    а сами файлы после коммита уходят в фоновую очередь удаления. Старые
+    плоские имена без StoredFile удаляются так же, как раньше.
+    """
+    counts = Counter(names)
+    if not counts:
+        return
+    table = StoredFile.__table__
+    unlink = db.session.info.setdefault("storage_unlink", set())
+    paths = list(counts)
+    for start in range(0, len(paths), BATCH_SIZE):
+        batch = paths[start:start + BATCH_SIZE]
+        stored = set(db.session.execute(select(table.c.path).where(table.c.path.in_(batch))).scalars())
+        unlink.update(set(batch) - stored)
+        if not stored:
+            continue
+        db.session.execute(
+            update(table)
+            .where(table.c.path == bindparam("p_path"))
+            .values(ref_count=table.c.ref_count - bindparam("p_count")),
+            [{"p_path": path, "p_count": counts[path]} for path in stored],
+        )
+        # Удаляем, только если за это время никто не взял новую ссылку
+        orphaned = list(db.session.execute(
+            select(table.c.path).where(table.c.path.in_(stored), table.c.ref_count <= 0)
+        ).scalars())
+        if orphaned:
+            db.session.execute(delete(table).where(table.c.path.in_(orphaned), table.c.ref_count <= 0))
+            unlink.update(orphaned)
+
+
+# --- Фоновое удаление файлов ---
+# Запрос не ждёт os.remove; если процесс умрёт раньше, файлы подберёт flask media gc
+
+_removals = queue.Queue()
+_remover = None
+_remover_lock = threading.Lock()
+
+
+def _remove_worker():
+    while True:
+        root, name = _removals.get()
+        try:
+            remove_file(root, name)
+        finally:
+            _removals.task_done()
+
+
+def remove_file(root, name):
+    """Удаляет файл и его миниатюры"""
+    try:
+        os.remove(os.path.join(root, name))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.warning(f"Не удалось удалить файл {name}: {e}")
+    thumbnails.remove_derivatives(root, name)
+
+
+def queue_removal(root, names):
+    global _remover
+    with _remover_lock:
+        if _remover is None:
+            _remover = threading.Thread(target=_remove_worker, name="storage-remover", daemon=True)
+            _remover.start()
+    for name in names:
+        _removals.put((root, name))
+
+
+def wait_for_removals():
+    """Дождаться, пока очередь удаления опустеет (CLI и проверки)"""
+    _removals.join()
+
+
+@event.listens_for(Session, "after_commit")
+def _unlink_released(session):
+    names = session.info.pop("storage_unlink", None)
+    if not names:
+        return
+    # Файл мог снова понадобиться параллельной загрузке того же содержимого
+    names = list(names)
+    revived = set()
+    with db.engine.connect() as conn:
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = names[start:start + BATCH_SIZE]
+            revived.update(conn.execute(select(StoredFile.path).where(StoredFile.path.in_(batch))).scalars())
+    queue_removal(upload_root(), [name for name in names if name not in revived])
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_released(session):
+    session.info.pop("storage_unlink", None)
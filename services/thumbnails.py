@@ -0,0 +1,158 @@
+import glob
+import importlib.util
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app, url_for
+
+# Имя производной → (наибольшая сторона в px, обрезать ли до квадрата).
+# Вложения в шаблонах не шире 150px, аватары — 32–150px: берём с запасом под HiDPI
+DERIVATIVES = {
+    'thumb': (320, False),
+    'avatar_sm': (96, True),
+    'avatar_lg': (300, True),
+}
+ATTACHMENT_KINDS = ('thumb',)
+AVATAR_KINDS = ('avatar_sm', 'avatar_lg')
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+THUMBS_DIR = "thumbs"
+DEFAULT_AVATAR = 'img/default-avatar.png'
+
+_executor = None
+_executor_lock = threading.Lock()
+_pillow_available = importlib.util.find_spec("PIL") is not None
+
+
+def render_derivatives(source, targets, fmt, quality):
+    """Выполняется в дочернем процессе: только Pillow, без приложения и БД"""
+    from PIL import Image, ImageOps
+
+    done = 0
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        for target, size, crop in targets:
+            if os.path.exists(target):
+                continue
+            if crop:
+                out = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            else:
+                out = image.copy()
+                out.thumbnail((size, size), Image.LANCZOS)
+            if fmt == 'JPEG' and out.mode not in ('RGB', 'L'):
+                out = out.convert('RGB')
+            elif out.mode == 'P':
+                out = out.convert('RGBA')
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp = f"{target}.tmp"
+            out.save(tmp, fmt, quality=quality)
+            os.replace(tmp, target)
+            done += 1
+    return done
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: дочерние процессы не наследуют соединения с БД и monkey patching воркера
+            _executor = ProcessPoolExecutor(
+                max_workers=current_app.config['THUMBNAIL_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _executor
+
+
+def shutdown():
+    """
+    Останавливает пул: ещё не начатые задачи отменяются, идущие дожидаемся.
+    Зовётся при остановке сервера: под eventlet/gevent не остановленный пул
+    не даёт процессу завершиться.
+    """
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _extension():
+    return 'jpg' if current_app.config['THUMBNAIL_FORMAT'].lower() in ('jpg', 'jpeg') else 'webp'
+
+
+def derivative_name(name, kind):
+    """thumbs/ab/cd/<sha>_320.webp — рядом с оригиналами, внутри UPLOAD_FOLDER"""
+    size, _ = DERIVATIVES[kind]
+    stem = os.path.splitext(name)[0]
+    return f"{THUMBS_DIR}/{stem}_{size}.{_extension()}"
+
+
+def is_image(name):
+    return os.path.splitext(name or "")[1].lower() in IMAGE_EXTENSIONS
+
+
+def schedule(name, kinds):
+    """
+    Ставит построение производных в пул процессов и сразу возвращается.
+    Возвращает Future или None, если строить нечего.
+    """
+    if not _pillow_available or not is_image(name):
+        return None
+    root = current_app.config['UPLOAD_FOLDER']
+    targets = [
+        (os.path.join(root, derivative_name(name, kind)), *DERIVATIVES[kind])
+        for kind in kinds
+        if not os.path.exists(os.path.join(root, derivative_name(name, kind)))
+    ]
+    if not targets:
+        return None
+    fmt = 'JPEG' if _extension() == 'jpg' else 'WEBP'
+    future = _get_executor().submit(
+        render_derivatives, os.path.join(root, name), targets, fmt, current_app.config['THUMBNAIL_QUALITY']
+    )
+    future.add_done_callback(lambda f: _log_failure(name, f))
+    return future
+
+
+def _log_failure(name, future):
+    error = future.exception()
+    if error is not None:
+        logging.warning(f"Миниатюры для {name} не построены: {error}")
+
+
+def remove_derivatives(root, name):
+    """Удаляет все производные файла (вызывается вместе с удалением оригинала)"""
+    stem = os.path.splitext(name)[0]
+    for path in glob.glob(os.path.join(root, THUMBS_DIR, glob.escape(stem) + "_*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def thumbnail_url(name, kind='thumb'):
+    """URL производной, если она уже готова, иначе оригинала"""
+    derivative = derivative_name(name, kind)
+    if os.path.exists(os.path.join(current_app.config['UPLOAD_FOLDER'], derivative)):
+        return url_for('media.serve_upload', name=derivative)
+    return url_for('media.serve_upload', name=name)
+
+
+def avatar_upload_name(avatar):
+    """User.avatar хранится относительно static ("uploads/…"); внутри UPLOAD_FOLDER — без префикса"""
+    return avatar[len('uploads/'):] if avatar and avatar.startswith('uploads/') else None
+
+
+def avatar_url(user, kind='avatar_sm'):
+    if not user.avatar:
+        return url_for('static', filename=DEFAULT_AVATAR)
+    name = avatar_upload_name(user.avatar)
+    return thumbnail_url(name, kind) if name else url_for('static', filename=user.avatar)
+
+
+def generate_missing(names_with_kinds):
+    """Строит недостающие производные для пар (name, kinds) и ждёт окончания; для CLI"""
+    futures = [f for f in (schedule(name, kinds) for name, kinds in names_with_kinds) if f is not None]
+    failed = sum(1 for f in futures if f.exception() is not None)
+    return len(futures), failed
@@ -0,0 +1,248 @@
+from collections import Counter, defaultdict
+from datetime import timezone
+from sqlalchemy import delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+from extensions import db
+from models.ticket import Ticket
+from models.ticket_metrics import TicketCloseBucket, TicketStatusCounter
+from services import counters
+from services.status_registry import statuses
+
+# Верхние границы корзин времени до закрытия, секунды: 1 ч … 30 дней, последняя — всё остальное
+HOUR = 3600
+DAY = 24 * HOUR
+BUCKETS = (HOUR, 4 * HOUR, 12 * HOUR, DAY, 2 * DAY, 3 * DAY, 7 * DAY, 14 * DAY, 30 * DAY)
+INF = 2 ** 31 - 1
+
+
+def bucket_for(seconds):
+    for le in BUCKETS:
+        if seconds <= le:
+            return le
+    return INF
+
+
+def _utc(dt):
+    # SQLite возвращает naive-даты, в базе они в UTC
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
+
+
+def time_to_close(created_at, closed_at):
+    if created_at is None or closed_at is None:
+        return None
+    return max((_utc(closed_at) - _utc(created_at)).total_seconds(), 0.0)
+
+
+class Deltas:
+    """Изменения счётчиков внутри одной транзакции"""
+
+    def __init__(self):
+        self.statuses = Counter()
+        self.buckets = defaultdict(lambda: [0, 0.0])
+
+    def status(self, status_id, delta):
+        if status_id is not None:
+            self.statuses[status_id] += delta
+
+    def closed(self, created_at, closed_at, delta):
+        seconds = time_to_close(created_at, closed_at)
+        if seconds is not None:
+            bucket = self.buckets[bucket_for(seconds)]
+            bucket[0] += delta
+            bucket[1] += delta * seconds
+
+    def __bool__(self):
+        return any(self.statuses.values()) or any(b[0] for b in self.buckets.values())
+
+
+def _deltas(session):
+    return session.info.setdefault("ticket_metrics", Deltas())
+
+
+@event.listens_for(Ticket.status_id, "set", active_history=True)
+@event.listens_for(Ticket.closed_at, "set", active_history=True)
+def _load_old_value(target, value, oldvalue, initiator):
+    """Старое значение нужно в истории даже у просроченного после commit объекта"""
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_ticket_changes(session, flush_context):
+    for obj in session.new:
+        if isinstance(obj, Ticket):
+            deltas = _deltas(session)
+            deltas.status(obj.status_id, 1)
+            deltas.closed(obj.created_at, obj.closed_at, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Ticket):
+            deltas = _deltas(session)
+            deltas.status(obj.status_id, -1)
+            deltas.closed(obj.created_at, obj.closed_at, -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Ticket):
+            continue
+        state = inspect(obj)
+        status = state.attrs.status_id.history
+        if status.has_changes():
+            deltas = _deltas(session)
+            for old in status.deleted:
+                deltas.status(old, -1)
+            for new in status.added:
+                deltas.status(new, 1)
+        closed = state.attrs.closed_at.history
+        if closed.has_changes():
+            deltas = _deltas(session)
+            for old in closed.deleted:
+                deltas.closed(obj.created_at, old, -1)
+            for new in closed.added:
+                deltas.closed(obj.created_at, new, 1)
+
+
+def record_deleted(session, ticket_ids):
+    """Для DELETE мимо ORM (services.tickets): снять удаляемые тикеты со счётчиков"""
+    deltas = _deltas(session)
+    for status_id, count in session.execute(
+        select(Ticket.status_id, func.count()).where(Ticket.id.in_(ticket_ids)).group_by(Ticket.status_id)
+    ):
+        deltas.status(status_id, -count)
+    for created_at, closed_at in session.execute(
+        select(Ticket.created_at, Ticket.closed_at).where(Ticket.id.in_(ticket_ids), Ticket.closed_at.isnot(None))
+    ):
+        deltas.closed(created_at, closed_at, -1)
+
+
+def _apply(conn, deltas):
+    counters.increment(conn, TicketStatusCounter, ("status_id",), ("tickets",), [
+        {"status_id": status_id, "tickets": delta} for status_id, delta in deltas.statuses.items() if delta
+    ])
+    counters.increment(conn, TicketCloseBucket, ("le",), ("tickets", "seconds"), [
+        {"le": le, "tickets": count, "seconds": seconds} for le, (count, seconds) in deltas.buckets.items() if count
+    ])
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_ticket_changes(session):
+    # before_commit срабатывает до последнего flush внутри commit() — сбрасываем изменения сами
+    session.flush()
+    deltas = session.info.pop("ticket_metrics", None)
+    if deltas:
+        _apply(session.connection(), deltas)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_ticket_changes(session):
+    session.info.pop("ticket_metrics", None)
+
+
+# --- Чтение ---
+
+def status_counts():
+    """{status_id: число тикетов} из счётчиков"""
+    return dict(db.session.execute(select(TicketStatusCounter.status_id, TicketStatusCounter.tickets)).all())
+
+
+def count_in_statuses(status_ids):
+    if not status_ids:
+        return 0
+    return db.session.execute(
+        select(func.coalesce(func.sum(TicketStatusCounter.tickets), 0))
+        .where(TicketStatusCounter.status_id.in_(status_ids))
+    ).scalar()
+
+
+def close_histogram():
+    """Корзины по возрастанию le: [(le, tickets, seconds)]"""
+    return db.session.execute(
+        select(TicketCloseBucket.le, TicketCloseBucket.tickets, TicketCloseBucket.seconds)
+        .where(TicketCloseBucket.tickets > 0)
+        .order_by(TicketCloseBucket.le)
+    ).all()
+
+
+def _quantile(buckets, total, q):
+    """Оценка квантиля по гистограмме: верхняя граница корзины, в которую он попал"""
+    rank = q * total
+    seen = 0
+    for le, tickets, _ in buckets:
+        seen += tickets
+        if seen >= rank:
+            return None if le == INF else le
+    return None
+
+
+def snapshot():
+    """Счётчики по статусам и группам, время до закрытия — без запросов к таблице ticket"""
+    counts = status_counts()
+    open_ids = set(statuses.open_ids())
+    by_status = [
+        {"id": s.id, "name": s.name, "label": s.label, "group": s.group, "category": s.category,
+         "color": s.color, "tickets": counts.get(s.id, 0)}
+        for s in statuses.all()
+    ]
+    groups = Counter()
+    for s in by_status:
+        groups[s["group"] or ""] += s["tickets"]
+
+    buckets = close_histogram()
+    closed = sum(b.tickets for b in buckets)
+    seconds = sum(b.seconds for b in buckets)
+    return {
+        "statuses": by_status,
+        "groups": dict(groups),
+        "open": sum(s["tickets"] for s in by_status if s["id"] in open_ids),
+        "final": sum(s["tickets"] for s in by_status if s["category"] == "final"),
+        "time_to_close": {
+            "tickets": closed,
+            "mean_seconds": round(seconds / closed) if closed else None,
+            "p50_seconds": _quantile(buckets, closed, 0.5),
+            "p90_seconds": _quantile(buckets, closed, 0.9),
+            "buckets": [{"le": None if b.le == INF else b.le, "tickets": b.tickets} for b in buckets],
+        },
+    }
+
+
+# --- Сверка ---
+
+def recompute(batch_size=5000):
+    """Точные значения счётчиков по таблице ticket (полный проход)"""
+    deltas = Deltas()
+    for status_id, count in db.session.execute(
+        select(Ticket.status_id, func.count()).group_by(Ticket.status_id)
+    ):
+        deltas.status(status_id, count)
+    rows = db.session.execute(
+        select(Ticket.created_at, Ticket.closed_at)
+        .where(Ticket.closed_at.isnot(None))
+        .execution_options(yield_per=batch_size)
+    )
+    for created_at, closed_at in rows:
+        deltas.closed(created_at, closed_at, 1)
+    return deltas
+
+
+def repair(dry_run=False, batch_size=5000):
+    """
+    Пересчитать счётчики и гистограмму по тикетам и заменить сохранённые.
+    Возвращает число расхождений (статусы + корзины). Запускать лучше в
+    тихое время: изменения тикетов во время пересчёта могут в него не попасть.
+    """
+    actual = recompute(batch_size)
+    actual_buckets = {le: count for le, (count, _) in actual.buckets.items() if count}
+    stored_statuses = {k: v for k, v in status_counts().items() if v}
+    stored_buckets = {b.le: b.tickets for b in close_histogram()}
+    mismatches = sum(
+        stored.get(key) != fresh.get(key)
+        for stored, fresh in ((stored_statuses, actual.statuses), (stored_buckets, actual_buckets))
+        for key in set(stored) | set(fresh)
+    )
+    if dry_run:
+        db.session.rollback()
+        return mismatches
+
+    session = db.session
+    session.execute(delete(TicketStatusCounter))
+    session.execute(delete(TicketCloseBucket))
+    _apply(session.connection(), actual)
+    session.commit()
+    return mismatches
@@ -0,0 +1,237 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import Column, Index, Integer, MetaData, Table, func, select
+from sqlalchemy.exc import IntegrityError
+from extensions import db
+from models.ticket import Ticket
+from models.ticket_view import TicketView
+from models.user import User
+from services import counters
+
+UNIQUE_INDEX = "uq_ticket_view_user_ticket"
+
+def _utc(dt):
+    # SQLite возвращает naive-даты, в базе они в UTC
+    return dt.replace(tzinfo=timezone.utc) if dt is not None and dt.tzinfo is None else dt
+
+
+class ViewBuffer:
+    """
+    Просмотры тикетов копятся в памяти процесса: на пару (пользователь, тикет)
+    остаётся самое позднее время. Фоновый поток раз в TICKET_VIEW_FLUSH_INTERVAL
+    секунд пишет их одним upsert по uq_ticket_view_user_ticket. Пока запись не
+    сброшена, дашборд учитывает её сам (pending_for), поэтому свой просмотр
+    пользователь видит сразу. При падении процесса теряются только просмотры
+    за последний интервал. Пока уникального индекса нет (не выполнена
+    flask tickets dedupe-views), upsert невозможен: просмотры пишутся сразу,
+    выборкой и вставкой, как до буфера.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}    # {user_id: {ticket_id: время}}
+        self._size = 0
+        self._app = None
+        self._thread = None
+        self.interval = 0
+        self.max_pending = 0
+        self.upsert_ready = None   # есть ли UNIQUE_INDEX; None — ещё не удалось проверить
+
+    def init_app(self, app):
+        self._app = app
+        self.interval = app.config['TICKET_VIEW_FLUSH_INTERVAL']
+        self.max_pending = app.config['TICKET_VIEW_BUFFER_MAX']
+        if self.interval > 0:
+            atexit.register(self._flush_at_exit)
+        with app.app_context():
+            self._check_index()
+
+    def _check_index(self):
+        try:
+            indexes = db.inspect(db.engine).get_indexes(TicketView.__tablename__)
+        except Exception as e:
+            # Таблицы ещё нет (до flask db upgrade) или база недоступна: проверим при первом просмотре
+            logging.debug(f"Просмотры тикетов: индекс не проверен: {e}")
+            return
+        self.upsert_ready = any(index["name"] == UNIQUE_INDEX and index["unique"] for index in indexes)
+        if not self.upsert_ready:
+            logging.error(f"Нет индекса {UNIQUE_INDEX}: просмотры тикетов пишутся сразу, без буфера. "
+                          "Выполните flask tickets dedupe-views и перезапустите приложение")
+
+    def record(self, user_id, ticket_id, when=None):
+        when = when or datetime.now(timezone.utc)
+        if self.upsert_ready is None:
+            self._check_index()
+        if not self.upsert_ready:
+            self._write_direct(user_id, ticket_id, when)
+            return
+        with self._lock:
+            tickets = self._pending.setdefault(user_id, {})
+            previous = tickets.get(ticket_id)
+            if previous is None:
+                self._size += 1
+            if previous is None or when > previous:
+                tickets[ticket_id] = when
+            overflow = self._size >= self.max_pending
+        if self.interval <= 0 or overflow:
+            # Без буфера (или он переполнен) пишем сразу, в том же запросе
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Сброс просмотров тикетов: {e}")
+        else:
+            self._ensure_thread()
+
+    @staticmethod
+    def _write_direct(user_id, ticket_id, when):
+        """Без уникального индекса: выборка и вставка одной строки, как до буфера"""
+        session = db.session.session_factory()
+        try:
+            view = session.execute(
+                select(TicketView).where(TicketView.user_id == user_id, TicketView.ticket_id == ticket_id)
+                .order_by(TicketView.id.desc()).limit(1)
+            ).scalar()
+            if view is None:
+                session.add(TicketView(user_id=user_id, ticket_id=ticket_id, last_viewed_at=when))
+            else:
+                view.last_viewed_at = when
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            logging.error(f"Запись просмотра тикета: {e}")
+        finally:
+            session.close()
+
+    def pending_for(self, user_id):
+        """{ticket_id: время} ещё не сброшенных просмотров пользователя"""
+        with self._lock:
+            return dict(self._pending.get(user_id, ()))
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending, self._size = self._pending, {}, 0
+        return [(user_id, ticket_id, when) for user_id, tickets in pending.items() for ticket_id, when in tickets.items()]
+
+    def _restore(self, rows):
+        for user_id, ticket_id, when in rows:
+            with self._lock:
+                tickets = self._pending.setdefault(user_id, {})
+                previous = tickets.get(ticket_id)
+                if previous is None:
+                    self._size += 1
+                if previous is None or when > previous:
+                    tickets[ticket_id] = when
+
+    def flush(self):
+        """Пишет накопленное одной командой в своей транзакции. Возвращает число строк"""
+        pending = self._take()
+        if not pending:
+            return 0
+        # Отдельная сессия: не трогаем транзакцию текущего запроса
+        session = db.session.session_factory()
+        try:
+            for attempt in (1, 2):
+                rows = self._existing_rows(session, pending)
+                try:
+                    counters.increment(session.connection(), TicketView, ("user_id", "ticket_id"), (), rows,
+                                       newest=("last_viewed_at",))
+                    session.commit()
+                    return len(rows)
+                except IntegrityError as e:
+                    # Тикет или пользователя удалили между проверкой и записью: проверяем заново и повторяем
+                    session.rollback()
+                    if attempt == 2:
+                        raise
+                    logging.warning(f"Просмотры тикетов: {e}; повтор без удалённых тикетов и пользователей")
+        except Exception:
+            session.rollback()
+            self._restore(pending)
+            raise
+        finally:
+            session.close()
+
+    @staticmethod
+    def _existing_rows(session, pending):
+        """Строки для upsert без тикетов и пользователей, удалённых, пока просмотр лежал в буфере"""
+        tickets = set(session.execute(
+            select(Ticket.id).where(Ticket.id.in_({ticket_id for _, ticket_id, _ in pending}))
+        ).scalars())
+        users = set(session.execute(
+            select(User.id).where(User.id.in_({user_id for user_id, _, _ in pending}))
+        ).scalars())
+        return [
+            {"user_id": user_id, "ticket_id": ticket_id, "last_viewed_at": when}
+            for user_id, ticket_id, when in pending if ticket_id in tickets and user_id in users
+        ]
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="ticket-view-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self._app.app_context():
+                    self.flush()
+            except Exception as e:
+                logging.error(f"Сброс просмотров тикетов: {e}")
+
+    def _flush_at_exit(self):
+        try:
+            with self._app.app_context():
+                self.flush()
+        except Exception as e:
+            logging.error(f"Сброс просмотров тикетов при остановке: {e}")
+
+
+views = ViewBuffer()
+
+
+def seen_since_update(viewed_at, updated_at):
+    """Просмотр не раньше последнего изменения тикета — тикет прочитан"""
+    return updated_at is None or _utc(viewed_at) >= _utc(updated_at)
+
+
+# --- Переход на уникальный индекс ---
+
+def deduplicate(batch_size=1000):
+    """
+    Схлопывает дубликаты (user_id, ticket_id), оставшиеся от записи без
+    уникального индекса: остаётся строка с наибольшим id и самым поздним
+    временем. Затем создаёт UNIQUE_INDEX вместо старого
+    idx_ticket_view_user_ticket. Возвращает число удалённых строк.
+    """
+    session = db.session
+    table = TicketView.__table__
+    duplicates = session.execute(
+        select(TicketView.user_id, TicketView.ticket_id, func.max(TicketView.id), func.max(TicketView.last_viewed_at))
+        .group_by(TicketView.user_id, TicketView.ticket_id)
+        .having(func.count() > 1)
+    ).all()
+
+    removed = 0
+    for start in range(0, len(duplicates), batch_size):
+        for user_id, ticket_id, keep_id, last_viewed_at in duplicates[start:start + batch_size]:
+            session.execute(table.update().where(table.c.id == keep_id).values(last_viewed_at=last_viewed_at))
+            removed += session.execute(table.delete().where(
+                table.c.user_id == user_id, table.c.ticket_id == ticket_id, table.c.id != keep_id
+            )).rowcount
+        session.commit()
+
+    engine = db.engine
+    existing = {index["name"] for index in db.inspect(engine).get_indexes(table.name)}
+    if "idx_ticket_view_user_ticket" in existing:
+        # Старый индекс описываем на отдельной таблице, чтобы не добавить его в модель
+        legacy = Table(table.name, MetaData(), Column("user_id", Integer), Column("ticket_id", Integer))
+        Index("idx_ticket_view_user_ticket", legacy.c.user_id, legacy.c.ticket_id).drop(engine)
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+    return removed
@@ -0,0 +1,41 @@
+from sqlalchemy import delete, select, union_all
+from extensions import db
+from models.attachment import TicketAttachment
+from models.ticket import Ticket, TicketMessage, TicketMessageAttachment
+from models.ticket_view import TicketView
+from services import search, storage, ticket_metrics
+
+
+def delete_tickets(ticket_ids):
+    """
+    Удаляет тикеты вместе с сообщениями, вложениями и просмотрами набором
+    DELETE … WHERE … IN, без загрузки ORM-объектов. Ссылки на файлы
+    снимаются одним проходом, сами файлы удаляются в фоне после коммита.
+    Возвращает число удалённых тикетов; коммит — за вызывающим.
+    """
+    ids = list(set(ticket_ids))
+    if not ids:
+        return 0
+
+    message_ids = select(TicketMessage.id).where(TicketMessage.ticket_id.in_(ids))
+    filenames = db.session.execute(union_all(
+        select(TicketMessageAttachment.filename).where(TicketMessageAttachment.message_id.in_(message_ids)),
+        select(TicketAttachment.filename).where(TicketAttachment.ticket_id.in_(ids)),
+    )).scalars().all()
+    storage.release_many(filenames)
+    ticket_metrics.record_deleted(db.session, ids)
+
+    # Зависимые строки удаляем явно: на SQLite ON DELETE CASCADE без PRAGMA foreign_keys не работает
+    for statement in (
+        delete(TicketMessageAttachment).where(TicketMessageAttachment.message_id.in_(message_ids)),
+        delete(TicketMessage).where(TicketMessage.ticket_id.in_(ids)),
+        delete(TicketAttachment).where(TicketAttachment.ticket_id.in_(ids)),
+        delete(TicketView).where(TicketView.ticket_id.in_(ids)),
+    ):
+        db.session.execute(statement.execution_options(synchronize_session=False))
+    result = db.session.execute(
+        delete(Ticket).where(Ticket.id.in_(ids)).execution_options(synchronize_session=False)
+    )
+
+    search.mark_dirty(db.session, ids)
+    return result.rowcount
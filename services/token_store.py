@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class MemoryTokenStore:
+    """Токен в памяти процесса (старое поведение, годится для тестов)"""
+
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        return self._entry
+
+    def set(self, token, expires_at):
+        self._entry = (token, expires_at)
+
+    @contextmanager
+    def lock(self, blocking=True, timeout=30):
+        acquired = self._lock.acquire(blocking, timeout if blocking else -1)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._lock.release()
+
+
+class CacheTokenStore:
+    """
+    Токен в Flask-Caching (extensions.cache): общий для всех воркеров,
+    если бэкенд кэша общий (FileSystemCache, Redis, Memcached).
+    Блокировка — ключ, занятый через cache.add: атомарно в Redis/Memcached,
+    в FileSystemCache — с небольшим окном гонки.
+    """
+
+    def __init__(self, cache, key="digiseller_token"):
+        self.cache = cache
+        self.key = key
+        self.lock_key = f"{key}:lock"
+        self._local = threading.Lock()
+
+    def get(self):
+        entry = self.cache.get(self.key)
+        return tuple(entry) if entry else None
+
+    def set(self, token, expires_at):
+        self.cache.set(self.key, (token, expires_at), timeout=max(1, int(expires_at - time.time())))
+
+    @contextmanager
+    def lock(self, blocking=True, timeout=30):
+        owner = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        acquired = False
+        if self._local.acquire(blocking, timeout if blocking else -1):
+            try:
+                while True:
+                    acquired = bool(self.cache.add(self.lock_key, owner, timeout=timeout))
+                    if acquired or not blocking or time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.1)
+                yield acquired
+            finally:
+                if acquired and self.cache.get(self.lock_key) == owner:
+                    self.cache.delete(self.lock_key)
+                self._local.release()
+        else:
+            yield False
+
+
+class SqliteTokenStore:
+    """
+    Токен в локальном файле SQLite: переживает рестарты, общий для всех
+    процессов на хосте. Блокировка — транзакция BEGIN IMMEDIATE.
+    """
+
+    def __init__(self, path, name="digiseller_token"):
+        self.path = path
+        self.name = name
+        self._tls = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS tokens (name TEXT PRIMARY KEY, token TEXT, expires_at REAL)")
+        finally:
+            conn.close()
+
+    def _connect(self, timeout=30):
+        return sqlite3.connect(self.path, timeout=timeout, isolation_level=None)
+
+    def get(self):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT token, expires_at FROM tokens WHERE name = ?", (self.name,)).fetchone()
+        finally:
+            conn.close()
+        return tuple(row) if row else None
+
+    def set(self, token, expires_at):
+        # Под блокировкой пишем в её же транзакцию, иначе сами себя заблокируем
+        locked = getattr(self._tls, "conn", None)
+        conn = locked or self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO tokens (name, token, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at",
+                (self.name, token, expires_at),
+            )
+        finally:
+            if locked is None:
+                conn.close()
+
+    @contextmanager
+    def lock(self, blocking=True, timeout=30):
+        conn = self._connect(timeout=timeout if blocking else 0)
+        acquired = False
+        try:
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                acquired = True
+                self._tls.conn = conn
+            except sqlite3.OperationalError:
+                acquired = False
+            yield acquired
+        finally:
+            if acquired:
+                self._tls.conn = None
+                conn.execute("COMMIT")
+            conn.close()
+
+
+def make_token_store(config):
+    """Хранилище токена по DIGISELLER_TOKEN_STORE: cache | sqlite | memory"""
+    kind = config.get('DIGISELLER_TOKEN_STORE', 'cache')
+    if kind == 'sqlite':
+        return SqliteTokenStore(config['DIGISELLER_TOKEN_SQLITE_PATH'])
+    if kind == 'memory':
+        return MemoryTokenStore()
+    from extensions import cache
+    return CacheTokenStore(cache)
@@ -0,0 +1,119 @@
+import mimetypes
+import os
+from sqlalchemy import delete, select
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from extensions import db
+from models.attachment import Upload
+from services import storage, thumbnails
+
+
+def allowed_types(extensions):
+    """MIME-типы, соответствующие разрешённым расширениям"""
+    return {mimetypes.guess_type(f"file.{ext}")[0] for ext in extensions} - {None}
+
+
+def check_file_type(filename, content_type, extensions):
+    """Только разрешённые расширения с соответствующим им Content-Type, иначе BadRequest"""
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if ext not in extensions or mimetype not in allowed_types(extensions):
+        raise BadRequest(f"Недопустимый тип файла {filename!r}: разрешены {', '.join(sorted(extensions))}")
+
+
+def receive_uploads(environ, user_id, max_file_size, max_files, max_request_size, allowed_extensions):
+    """
+    Разбирает multipart-тело запроса, записывая каждый файл сразу во
+    временный файл хранилища (HashingSpool), и регистрирует их как Upload.
+    Лимиты: размер файла, число файлов и размер всего запроса — при
+    превышении RequestEntityTooLarge. Файл с расширением или типом не из
+    allowed_extensions — BadRequest до записи на диск. Коммит — за вызывающим.
+    """
+    spools = []
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        if filename:
+            check_file_type(filename, content_type, allowed_extensions)
+        if len(spools) >= max_files:
+            raise RequestEntityTooLarge(f"Не больше {max_files} файлов за раз")
+        spool = storage.HashingSpool(max_size=max_file_size)
+        spools.append(spool)
+        return spool
+
+    try:
+        try:
+            _, _, files = parse_form_data(
+                environ,
+                stream_factory=stream_factory,
+                max_content_length=max_request_size,
+                max_form_memory_size=64 * 1024,
+                max_form_parts=max_files * 2 + 10,
+                silent=False,
+            )
+        except RequestEntityTooLarge as e:
+            if e.description != RequestEntityTooLarge.description:
+                raise
+            # Лимит всего запроса проверяет сам werkzeug — подменяем его английский текст
+            raise RequestEntityTooLarge(f"Запрос больше {max_request_size // (1024 * 1024)} МБ") from e
+        uploads = []
+        for _, file in files.items(multi=True):
+            if not file.filename or file.stream.size == 0:
+                continue
+            stored = storage.store_spooled(file.stream, file.filename, file.mimetype)
+            upload = Upload(
+                filename=stored.path,
+                original_name=file.filename[:256],
+                content_type=file.mimetype,
+                size=stored.size,
+                user_id=user_id,
+            )
+            db.session.add(upload)
+            uploads.append(upload)
+            thumbnails.schedule(stored.path, thumbnails.ATTACHMENT_KINDS)
+        db.session.flush()
+        return uploads
+    finally:
+        # Перенесённые в хранилище файлы уже на месте, остальное выбрасываем
+        for spool in spools:
+            spool.discard()
+
+
+def claim_uploads(upload_ids, user_id):
+    """
+    Забирает незакреплённые загрузки пользователя: строка Upload удаляется,
+    ссылка на файл переходит к создаваемому вложению. Чужие и уже занятые
+    id пропускаются. Возвращает Upload в порядке upload_ids.
+    """
+    ids = list(dict.fromkeys(int(i) for i in upload_ids if str(i).isdigit()))
+    if not ids:
+        return []
+
+    rows = {u.id: u for u in Upload.query.filter(Upload.id.in_(ids), Upload.user_id == user_id)}
+    claimed = []
+    for upload_id in ids:
+        upload = rows.get(upload_id)
+        if upload is None:
+            continue
+        # Условный DELETE: два параллельных сообщения не заберут один файл дважды
+        result = db.session.execute(
+            delete(Upload).where(Upload.id == upload_id).execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            db.session.expunge(upload)
+            claimed.append(upload)
+    return claimed
+
+
+def expire_uploads(cutoff, batch_size=500):
+    """Незабранные загрузки старше cutoff: удаляем строки и отпускаем файлы. Возвращает число"""
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Upload.id, Upload.filename).where(Upload.created_at < cutoff).limit(batch_size)
+        ).all()
+        if not rows:
+            return total
+        db.session.execute(delete(Upload).where(Upload.id.in_([row.id for row in rows])))
+        storage.release_many([row.filename for row in rows])
+        db.session.commit()
+        total += len(rows)
@@ -0,0 +1,85 @@
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from extensions import db, cache
+from models.user import User
+
+KEY_PREFIX = "user_identity:"
+
+
+class UserIdentity(UserMixin):
+    """
+    current_user из кэша: только то, что нужно шаблонам и проверкам прав.
+    Только для чтения; чтобы изменить пользователя, берите record().
+    """
+
+    FIELDS = ("id", "username", "display_name", "avatar", "is_admin")
+
+    def __init__(self, data):
+        for attr in self.FIELDS:
+            object.__setattr__(self, attr, data[attr])
+
+    def __setattr__(self, key, value):
+        raise AttributeError("UserIdentity только для чтения: меняйте record()")
+
+    def __repr__(self):
+        return f"<UserIdentity {self.id} {self.username}>"
+
+
+def _key(user_id):
+    return f"{KEY_PREFIX}{user_id}"
+
+
+def load_identity(user_id):
+    """
+    user_loader Flask-Login. Пользователь кэшируется в extensions.cache на
+    USER_CACHE_TTL секунд; при 0 — каждый раз читается из БД, как раньше.
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    ttl = current_app.config['USER_CACHE_TTL']
+    if not ttl:
+        return db.session.get(User, user_id)
+
+    data = cache.get(_key(user_id))
+    if data is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        data = {attr: getattr(user, attr) for attr in UserIdentity.FIELDS}
+        cache.set(_key(user_id), data, timeout=ttl)
+    return UserIdentity(data)
+
+
+def record(user):
+    """ORM-строка пользователя (current_user может быть UserIdentity)"""
+    return user if isinstance(user, User) else db.session.get(User, user.id)
+
+
+def invalidate(user_id):
+    """Сбросить кэш пользователя; после ORM-коммита это делает хук ниже"""
+    cache.delete(_key(user_id))
+
+
+# Любое изменение User через ORM (профиль, админка, flask shell) сбрасывает кэш после коммита
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = {obj.id for obj in (*session.new, *session.dirty, *session.deleted)
+               if isinstance(obj, User) and obj.id is not None}
+    if changed:
+        session.info.setdefault("users_changed", set()).update(changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("users_changed", ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("users_changed", None)